@@ -0,0 +1,111 @@
+# Copyright 2015 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Run the benchmarks without asv: `python -m benchmarks [-b REGEX]`."""
+
+from __future__ import print_function
+
+import argparse
+import importlib
+import itertools
+import os
+import re
+import sys
+import timeit
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def discover():
+    """Yield (name, class) for every benchmark class."""
+    for filename in sorted(os.listdir(BENCHMARKS_DIR)):
+        if not (filename.startswith('bench_') and filename.endswith('.py')):
+            continue
+        module = importlib.import_module('benchmarks.%s' % filename[:-3])
+        for name in sorted(dir(module)):
+            cls = getattr(module, name)
+            if (isinstance(cls, type) and
+                    cls.__module__ == module.__name__ and
+                    any(attr.startswith('time_') for attr in dir(cls))):
+                yield '%s.%s' % (filename[:-3], name), cls
+
+
+def param_sets(cls):
+    """Return the parameter combinations of a benchmark class."""
+    params = getattr(cls, 'params', None)
+    if params is None:
+        return [()]
+    if not getattr(cls, 'param_names', None) or not isinstance(
+            params, tuple):
+        # a single parameter, asv style
+        params = (params,)
+    return list(itertools.product(*params))
+
+
+def run(cls, method, params, repeat, min_time):
+    """Return the best time of one call of cls().method(*params)."""
+    bench = cls()
+    if hasattr(bench, 'setup'):
+        bench.setup(*params)
+    try:
+        func = getattr(bench, method)
+        timer = timeit.Timer(lambda: func(*params))
+        number, elapsed = 1, timer.timeit(1)
+        while elapsed < min_time:
+            number *= 10
+            elapsed = timer.timeit(number)
+        best = min([elapsed] + timer.repeat(repeat - 1, number)) / number
+    finally:
+        if hasattr(bench, 'teardown'):
+            bench.teardown(*params)
+    return best
+
+
+def _format(seconds):
+    """Format seconds with a sensible unit."""
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return '%.3g%s' % (seconds / scale, unit)
+    return '%.3gns' % (seconds / 1e-9)
+
+
+def main(argv=None):
+    """Run the benchmarks matching -b, printing their times."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-b', '--bench', default='',
+                        help="Only run benchmarks matching this regex")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Best of this many runs")
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help="Seconds each run should at least take")
+    args = parser.parse_args(argv)
+    pattern = re.compile(args.bench)
+
+    for name, cls in discover():
+        for method in sorted(attr for attr in dir(cls)
+                             if attr.startswith('time_')):
+            full_name = '%s.%s' % (name, method)
+            if not pattern.search(full_name):
+                continue
+            for params in param_sets(cls):
+                label = ', '.join(
+                    '%s=%s' % pair for pair in
+                    zip(getattr(cls, 'param_names', ()), params))
+                best = run(cls, method, params, args.repeat, args.min_time)
+                print('%-60s %-45s %10s' % (full_name, label, _format(best)))
+                sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# Copyright 2015 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""metadata.rb and Berksfile benchmarks."""
+
+from fastfood import book
+
+from benchmarks import synthetic
+
+
+class MetadataRb(synthetic.Quiet):
+
+    """Time parsing metadata.rb files and merging dependencies into them."""
+
+    params = [10, 100, 1000]
+    param_names = ['dependencies']
+
+    def setup(self, dependencies):
+        super(MetadataRb, self).setup()
+        self.text = synthetic.metadata_rb(dependencies)
+        self.metadata = book.MetadataRb.from_string(self.text)
+        self.other = book.MetadataRb.from_dict({'depends': {
+            'new%d' % index: {} for index in range(dependencies // 10)}})
+
+    def time_parse(self, _):
+        self.metadata.parse()
+
+    def time_merge(self, _):
+        book.MetadataRb.from_string(self.text).merge(self.other)
+
+    def time_merge_stencils(self, _):
+        # a build merging the dependencies of ten stencils
+        metadata = book.MetadataRb.from_string(self.text)
+        for _ in range(10):
+            metadata.merge(self.other)
+
+
+class Berksfile(synthetic.Quiet):
+
+    """Time parsing Berksfiles and merging cookbooks into them."""
+
+    params = [10, 100, 1000]
+    param_names = ['dependencies']
+
+    def setup(self, dependencies):
+        super(Berksfile, self).setup()
+        self.text = synthetic.berksfile(dependencies)
+        self.berksfile = book.Berksfile.from_string(self.text)
+        self.other = book.Berksfile.from_dict({'cookbook': {
+            'new%d' % index: {'git': 'https://github.com/example/new%d'
+                                     % index}
+            for index in range(dependencies // 10)}})
+
+    def time_parse(self, _):
+        self.berksfile.parse()
+
+    def time_merge(self, _):
+        book.Berksfile.from_string(self.text).merge(self.other)
+
+    def time_merge_stencils(self, _):
+        # a build merging the dependencies of ten stencils
+        berksfile = book.Berksfile.from_string(self.text)
+        for _ in range(10):
+            berksfile.merge(self.other)
+
+
+class WriteStatements(synthetic.Quiet):
+
+    """Time FileWrapper.write_statements() on growing files.
+
+    Should grow linearly with lines + statements.
+    """
+
+    params = ([100, 1000, 10000], [10, 100, 1000])
+    param_names = ['lines', 'statements']
+
+    def setup(self, lines, statements):
+        super(WriteStatements, self).setup()
+        self.text = synthetic.metadata_rb(lines)
+        self.statements = ["depends 'new%d'\n" % index
+                           for index in range(statements)]
+
+    def time_write_statements(self, *_):
+        book.MetadataRb.from_string(self.text).write_statements(
+            self.statements)
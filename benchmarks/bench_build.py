@@ -0,0 +1,109 @@
+# Copyright 2015 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cookbook build and stencil benchmarks."""
+
+import os
+import shutil
+import tempfile
+
+from fastfood import food
+from fastfood import pack
+from fastfood import templating
+
+from benchmarks import synthetic
+
+
+class BuildCookbook(synthetic.Quiet):
+
+    """Time food.build_cookbook() on synthetic packs."""
+
+    params = ([1, 10], [1, 5], [5, 25])
+    param_names = ['stencil_sets', 'stencils', 'templates']
+    timeout = 300
+
+    def setup(self, stencil_sets, stencils, templates):
+        super(BuildCookbook, self).setup()
+        self.tempdir = tempfile.mkdtemp(prefix='fastfood-bench-')
+        self.pack_path = synthetic.make_pack(
+            os.path.join(self.tempdir, 'pack'), stencil_sets=stencil_sets,
+            stencils=stencils, templates=templates, partials=2, binaries=2,
+            dependencies=5)
+        self.config = synthetic.make_config(
+            os.path.join(self.tempdir, 'fastfood.json'), 'synthetic',
+            stencil_sets=stencil_sets, stencils=stencils)
+        self.template_pack = pack.TemplatePack(self.pack_path)
+        self.cookbooks = os.path.join(self.tempdir, 'cookbooks')
+        os.makedirs(self.cookbooks)
+        # measure rendering, not the on-disk bytecode cache
+        templating.configure_cache(None)
+
+    def teardown(self, *_):
+        shutil.rmtree(self.tempdir)
+        super(BuildCookbook, self).teardown()
+
+    def build(self, **options):
+        cookbook = os.path.join(self.cookbooks, 'synthetic')
+        if os.path.isdir(cookbook):
+            shutil.rmtree(cookbook)
+        food.build_cookbook(self.config, self.template_pack, self.cookbooks,
+                            **options)
+
+    def time_build_cookbook(self, *_):
+        self.build()
+
+    def time_build_cookbook_stream(self, *_):
+        self.build(stream=True)
+
+
+class RebuildCookbook(BuildCookbook):
+
+    """Time rebuilding cookbooks that are already up to date."""
+
+    def setup(self, *params):
+        super(RebuildCookbook, self).setup(*params)
+        self.build()
+
+    def time_build_cookbook(self, *_):
+        food.build_cookbook(self.config, self.template_pack, self.cookbooks)
+
+    def time_build_cookbook_stream(self, *_):
+        food.build_cookbook(self.config, self.template_pack, self.cookbooks,
+                            stream=True)
+
+    def time_build_cookbook_forced(self, *_):
+        food.build_cookbook(self.config, self.template_pack, self.cookbooks,
+                            force=True, incremental=False)
+
+
+class GetStencil(object):
+
+    """Time StencilSet.get_stencil() for stencils of growing size."""
+
+    params = ([1, 25, 250], [0, 50])
+    param_names = ['templates', 'dependencies']
+
+    def setup(self, templates, dependencies):
+        self.tempdir = tempfile.mkdtemp(prefix='fastfood-bench-')
+        pack_path = synthetic.make_pack(
+            os.path.join(self.tempdir, 'pack'), templates=templates,
+            partials=5, binaries=0, dependencies=dependencies)
+        self.stencil_set = pack.TemplatePack(pack_path).load_stencil_set(
+            'set0')
+
+    def teardown(self, *_):
+        shutil.rmtree(self.tempdir)
+
+    def time_get_stencil(self, *_):
+        self.stencil_set.get_stencil('stencil0', name='bench')
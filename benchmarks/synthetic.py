@@ -0,0 +1,202 @@
+# Copyright 2015 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Synthetic template packs, cookbooks and ruby files for benchmarks."""
+
+import json
+import logging
+import os
+import sys
+
+METADATA_RB = """\
+name             '|{ cookbook['name'] }|'
+maintainer       'Rackspace US, Inc.'
+maintainer_email 'rackspace-cookbooks@rackspace.com'
+license          'All rights reserved'
+description      'Installs/Configures |{ cookbook['name'] }|'
+long_description IO.read(File.join(File.dirname(__FILE__), 'README.md'))
+version          '0.1.0'
+"""
+
+BERKSFILE = """\
+source 'https://api.berkshelf.com'
+
+metadata
+"""
+
+RECIPE = """\
+#
+# Cookbook Name:: |{ cookbook['name'] }|
+# Recipe:: |{ options['name'] }|
+#
+# Copyright |{ options['year'] }|, Rackspace
+#
+{% for index in range(options['resources']|int) %}
+package '|{ options['name'] }|-|{ index }|' do
+  action :install
+  version |{ qstring(options['version']) }|
+end
+
+template '/etc/|{ options['name'] }|/|{ index }|.conf' do
+  source '|{ options['name'] }|.conf.erb'
+  variables(port: |{ 8000 + index }|)
+  notifies :restart, 'service[|{ options['name'] }|]'
+end
+{% endfor %}
+service '|{ options['name'] }|' do
+  action [:enable, :start]
+end
+"""
+
+PARTIAL = """\
+  - name: |{ options['name'] }|
+    run_list:
+      - recipe[|{ cookbook['name'] }|::|{ options['name'] }|]
+"""
+
+
+class Quiet(object):
+
+    """Benchmark base class silencing what fastfood prints and logs."""
+
+    def setup(self, *_):
+        self._stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        logging.disable(logging.WARNING)
+
+    def teardown(self, *_):
+        logging.disable(logging.NOTSET)
+        sys.stdout.close()
+        sys.stdout = self._stdout
+
+
+def _write(path, content, mode='w'):
+    """Write content to path, creating its parent dirs."""
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, mode) as out:
+        out.write(content)
+
+
+def make_pack(path, stencil_sets=1, stencils=1, templates=1, partials=0,
+              binaries=0, dependencies=0, binary_size=64 * 1024,
+              resources=10):
+    """Write a synthetic template pack at path, returning its path.
+
+    The pack has a 'base' stencil set writing metadata.rb and Berksfile,
+    plus 'stencil_sets' sets named set0, set1... Each of their
+    'stencils' stencils renders 'templates' recipes (of 'resources'
+    resources each), appends to 'partials' test suite files, copies
+    'binaries' binaries of 'binary_size' bytes and adds 'dependencies'
+    metadata.rb and Berksfile dependencies.
+    """
+    manifest = {'api': 1, 'stencil_sets': {
+        'base': {'help': 'Creates the base cookbook files'}}}
+    _write(os.path.join(path, 'stencils', 'base', 'manifest.json'),
+           json.dumps({
+               'id': 'base', 'api': 1, 'default_stencil': 'base',
+               'options': {},
+               'stencils': {'base': {'files': {
+                   'metadata.rb': 'metadata.rb',
+                   'Berksfile': 'Berksfile'}}}}))
+    _write(os.path.join(path, 'stencils', 'base', 'metadata.rb'),
+           METADATA_RB)
+    _write(os.path.join(path, 'stencils', 'base', 'Berksfile'), BERKSFILE)
+
+    for set_index in range(stencil_sets):
+        set_name = 'set%d' % set_index
+        set_path = os.path.join(path, 'stencils', set_name)
+        manifest['stencil_sets'][set_name] = {
+            'help': 'Synthetic stencil set %d' % set_index}
+        set_manifest = {
+            'id': set_name, 'api': 1, 'default_stencil': 'stencil0',
+            'options': {
+                'name': {'help': 'Recipe name', 'default': set_name},
+                'year': {'help': 'Copyright year', 'default': '2015'},
+                'version': {'help': 'Package version',
+                            'default': "node['%s']['version']" % set_name},
+                'resources': {'help': 'Resources per recipe',
+                              'default': str(resources)},
+            },
+            'stencils': {},
+        }
+        for index in range(templates):
+            _write(os.path.join(set_path, 'recipes', 'recipe%d.rb' % index),
+                   RECIPE)
+        for index in range(partials):
+            _write(os.path.join(set_path, 'partials', 'suite%d.yml' % index),
+                   PARTIAL)
+        for index in range(binaries):
+            _write(os.path.join(set_path, 'files', 'blob%d.bin' % index),
+                   os.urandom(binary_size), mode='wb')
+        for stencil_index in range(stencils):
+            prefix = 'recipes/<NAME>_%d' % stencil_index
+            stencil = {
+                'files': {
+                    '%s_%d.rb' % (prefix, index):
+                    'recipes/recipe%d.rb' % index
+                    for index in range(templates)},
+                # every stencil appends to the same files
+                'partials': {
+                    'test/suites/suite%d.yml' % index:
+                    'partials/suite%d.yml' % index
+                    for index in range(partials)},
+                'binaries': {
+                    'files/default/%s_%d_%d.bin' % (set_name, stencil_index,
+                                                    index):
+                    'files/blob%d.bin' % index
+                    for index in range(binaries)},
+                'dependencies': {
+                    '%s_dep%d' % (set_name, index): {}
+                    for index in range(dependencies)},
+                'berks_dependencies': {
+                    '%s_dep%d' % (set_name, index): {
+                        'git': 'https://github.com/example/%s_dep%d'
+                               % (set_name, index)}
+                    for index in range(dependencies)},
+            }
+            set_manifest['stencils']['stencil%d' % stencil_index] = stencil
+        _write(os.path.join(set_path, 'manifest.json'),
+               json.dumps(set_manifest, indent=2))
+
+    _write(os.path.join(path, 'manifest.json'), json.dumps(manifest))
+    return path
+
+
+def make_config(path, name, stencil_sets=1, stencils=1):
+    """Write a fastfood.json using every stencil of a synthetic pack."""
+    entries = [{'stencil_set': 'base', 'stencil': 'base'}]
+    for set_index in range(stencil_sets):
+        for stencil_index in range(stencils):
+            entries.append({'stencil_set': 'set%d' % set_index,
+                            'stencil': 'stencil%d' % stencil_index})
+    _write(path, json.dumps({'name': name, 'stencils': entries}))
+    return path
+
+
+def metadata_rb(dependencies):
+    """Return the text of a metadata.rb with that many dependencies."""
+    lines = [METADATA_RB.replace("|{ cookbook['name'] }|", 'synthetic')]
+    lines.extend("depends 'cookbook%d', '~> %d.0'\n" % (index, index % 9)
+                 for index in range(dependencies))
+    return ''.join(lines)
+
+
+def berksfile(dependencies):
+    """Return the text of a Berksfile with that many dependencies."""
+    lines = [BERKSFILE, '\n']
+    lines.extend("cookbook 'cookbook%d', git: "
+                 "'https://github.com/example/cookbook%d'\n" % (index, index)
+                 for index in range(dependencies))
+    return ''.join(lines)
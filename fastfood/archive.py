@@ -0,0 +1,337 @@
+# Copyright 2015 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Template packs in a zip or tar archive, read without extracting them.
+
+Files in an archive have paths as if it were extracted in its place:
+<archive path>/<member name>. isfile(), isdir(), getsize() and
+open_file() take such paths as well as paths on disk, once the archive
+is open (see open_archive() and locate()).
+
+Archives are memory-mapped, and only their index (the zip central
+directory, or the tar headers) is read up front; members are read as
+they are needed. Compressed tar archives cannot be read at random, so
+they are decompressed into memory when opened.
+
+The archive modules are only imported once an archive is met, for
+template packs in dirs not to pay for them.
+"""
+
+import io
+import mmap
+import os
+import posixpath
+import stat
+import threading
+import time
+import zlib
+
+from fastfood import utils
+
+try:
+    # python 2 mmaps only have the old buffer interface
+    _slice = buffer  # pylint: disable=invalid-name
+except NameError:
+    def _slice(data, offset, size):
+        """Return a zero-copy view of size bytes of data from offset."""
+        return memoryview(data)[offset:offset + size]
+
+# open archives by path, see open_archive()
+_ARCHIVES = {}
+_ARCHIVES_LOCK = threading.Lock()
+
+
+def _member_name(name):
+    """Return the archive member 'name' relative to the archive root."""
+    name = posixpath.normpath(name).lstrip('/')
+    return '' if name == '.' else name
+
+
+class Archive(object):
+
+    """A zip or tar archive, mapped into memory.
+
+    'files' are {member name: (size, mtime, mode)} and 'dirs' the names
+    of the dirs holding them, member names being relative to the root of
+    the archive and '/' separated.
+    """
+
+    def __init__(self, path):
+        """Open the archive at 'path', reading its index."""
+        self.path = utils.normalize_path(path)
+        self.stamp = utils.file_stamp(self.path)
+        self.files = {}
+        self.dirs = set([''])
+        with open(self.path, 'rb') as stream:
+            # an empty file cannot be mapped, nor be an archive
+            if not os.fstat(stream.fileno()).st_size:
+                raise ValueError("%s is not a zip or tar archive" % path)
+            self._map = mmap.mmap(stream.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        self._read_index()
+
+    def __repr__(self):
+        """Canonical string representation of the archive."""
+        return '<%s %s>' % (type(self).__name__, self.path)
+
+    def _read_index(self):
+        """Fill in self.files and self.dirs."""
+        raise NotImplementedError
+
+    def _add(self, name, size, mtime, mode):
+        """Add a file member to the index."""
+        name = _member_name(name)
+        self.files[name] = (size, mtime, mode)
+        while '/' in name:
+            name = name.rsplit('/', 1)[0]
+            self.dirs.add(name)
+
+    def open(self, name):
+        """Return a binary file object reading the member 'name'."""
+        raise NotImplementedError
+
+    def copy(self, name, stream):
+        """Write the content of the member 'name' to a binary stream."""
+        with self.open(name) as member:
+            while True:
+                chunk = member.read(65536)
+                if not chunk:
+                    break
+                stream.write(chunk)
+
+
+class _MapFile(io.RawIOBase):
+
+    """A seekable, read-only file object over a memory map."""
+
+    def __init__(self, mapping):
+        super(_MapFile, self).__init__()
+        self._mapping = mapping
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self._mapping[self._position:self._position + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._mapping)
+        self._position = offset
+        return offset
+
+    def tell(self):
+        return self._position
+
+
+class ZipArchive(Archive):
+
+    """A zip archive, members being read through its central directory."""
+
+    def _read_index(self):
+        """Read the central directory."""
+        import zipfile
+
+        self._zip = zipfile.ZipFile(_MapFile(self._map))
+        for info in self._zip.infolist():
+            if info.filename.endswith('/'):
+                self.dirs.add(_member_name(info.filename))
+                continue
+            mode = (info.external_attr >> 16) & 0o7777 or 0o644
+            mtime = time.mktime(info.date_time + (0, 0, -1))
+            self._add(info.filename, info.file_size, mtime, mode)
+        self._names = {_member_name(name): name
+                       for name in self._zip.namelist()}
+
+    def open(self, name):
+        """Return a binary file object reading the member 'name'."""
+        return self._zip.open(self._names[name])
+
+
+class TarArchive(Archive):
+
+    """A tar archive, members being read straight from the mapping."""
+
+    def _read_index(self):
+        """Read the tar headers, decompressing the archive if needed."""
+        import tarfile
+
+        head = self._map[:6]
+        data = None
+        if head.startswith(b'\x1f\x8b'):
+            data = zlib.decompress(self._map[:], 16 + zlib.MAX_WBITS)
+        elif head.startswith(b'BZh'):
+            import bz2
+            data = bz2.decompress(self._map[:])
+        elif head.startswith(b'\xfd7zXZ'):
+            try:
+                import lzma
+            except ImportError:
+                # python 2, tarfile fails on it below
+                pass
+            else:
+                data = lzma.decompress(self._map[:])
+        if data is not None:
+            self._map.close()
+            self._map = data
+        self._offsets = {}
+        stream = self._map if data is None else io.BytesIO(data)
+        with tarfile.open(fileobj=stream, mode='r:') as tar:
+            for info in tar:
+                if info.isdir():
+                    self.dirs.add(_member_name(info.name))
+                elif info.isfile():
+                    self._add(info.name, info.size, info.mtime,
+                              info.mode & 0o7777)
+                    self._offsets[_member_name(info.name)] = info.offset_data
+                # links and special files are left out
+
+    def _view(self, name):
+        """Return a zero-copy view of the member 'name'."""
+        return _slice(self._map, self._offsets[name], self.files[name][0])
+
+    def open(self, name):
+        """Return a binary file object reading the member 'name'."""
+        return io.BytesIO(self._view(name))
+
+    def copy(self, name, stream):
+        """Write the content of the member 'name' to a binary stream."""
+        stream.write(self._view(name))
+
+
+def is_archive(path):
+    """Whether the file at path is a zip or tar archive."""
+    if not os.path.isfile(path):
+        return False
+    import tarfile
+    import zipfile
+
+    if zipfile.is_zipfile(path):
+        return True
+    try:
+        return tarfile.is_tarfile(path)
+    except (IOError, OSError, EOFError):
+        return False
+
+
+def open_archive(path):
+    """Return the Archive at path, opening it again if it changed."""
+    import zipfile
+
+    path = utils.normalize_path(path)
+    with _ARCHIVES_LOCK:
+        archive = _ARCHIVES.get(path)
+        if archive is None or archive.stamp != utils.file_stamp(path):
+            if zipfile.is_zipfile(path):
+                archive = ZipArchive(path)
+            else:
+                archive = TarArchive(path)
+            _ARCHIVES[path] = archive
+        return archive
+
+
+def locate(path, discover=False):
+    """Return (Archive, member name) for a path into an open archive.
+
+    Returns None for any other path. With 'discover', archives that are
+    not open yet are looked for, and opened, in the parents of path.
+    """
+    path = utils.normalize_path(path)
+    for archive_path, archive in list(_ARCHIVES.items()):
+        if path == archive_path:
+            return archive, ''
+        if path.startswith(archive_path + os.sep):
+            return archive, path[len(archive_path) + 1:].replace(os.sep,
+                                                                 '/')
+    if discover:
+        parent = path
+        while not os.path.exists(parent):
+            parent, child = os.path.split(parent)
+            if not child:
+                return None
+        if is_archive(parent):
+            open_archive(parent)
+            return locate(path)
+    return None
+
+
+def isfile(path):
+    """Whether path is a file on disk or in an open archive."""
+    if os.path.isfile(path):
+        return True
+    located = locate(path)
+    return located is not None and located[1] in located[0].files
+
+
+def isdir(path):
+    """Whether path is a dir on disk, an open archive or a dir in one."""
+    if os.path.isdir(path):
+        return True
+    located = locate(path)
+    return located is not None and located[1] in located[0].dirs
+
+
+def getsize(path):
+    """Return the size of a file, or of an archive member."""
+    located = locate(path)
+    if located is None or located[1] not in located[0].files:
+        return os.path.getsize(path)
+    return located[0].files[located[1]][0]
+
+
+def getmode(path):
+    """Return the permission bits of a file, or of an archive member."""
+    located = locate(path)
+    if located is None or located[1] not in located[0].files:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    return located[0].files[located[1]][2]
+
+
+def open_file(path, mode='r'):
+    """Open a file, or an archive member, for reading.
+
+    'mode' is 'r' (utf-8 text) or 'rb'.
+    """
+    located = locate(path)
+    if located is None or located[1] not in located[0].files:
+        return io.open(path, mode, encoding=None if 'b' in mode else 'utf-8')
+    stream = located[0].open(located[1])
+    if 'b' in mode:
+        return stream
+    return io.TextIOWrapper(stream, encoding='utf-8')
+
+
+def pack_root(archive):
+    """Return the path of the template pack in an open archive.
+
+    That is the archive itself, or the single top dir of the archive,
+    holding manifest.json. None if there is no such manifest.
+    """
+    if 'manifest.json' in archive.files:
+        return archive.path
+    tops = {name.split('/', 1)[0] for name in archive.files}
+    if len(tops) == 1:
+        top = tops.pop()
+        if '%s/manifest.json' % top in archive.files:
+            return os.path.join(archive.path, top)
+    return None
@@ -40,7 +40,7 @@ class CookBook(object):
     def name(self):
         """Cookbook name property."""
         try:
-            return self.metadata.to_dict()['name']
+            return self.metadata.parsed['name']
         except KeyError:
             raise LookupError("%s is missing 'name' attribute'."
                               % self.metadata)
@@ -70,6 +70,13 @@ class CookBook(object):
         return self._berksfile
 
 
+def _value(statement, positional, options):
+    """Return the value of a single string argument, or the source text."""
+    if len(positional) == 1 and not options:
+        return positional[0]
+    return statement.argument_text()
+
+
 class MetadataRb(utils.FileWrapper):
 
     """Wrapper for a metadata.rb file."""
@@ -106,29 +113,23 @@ class MetadataRb(utils.FileWrapper):
                 line = "%s '%s'" % (line, "', '".join(metadata))
         return line
 
-    def to_dict(self):
-        """Return a dictionary representation of this metadata.rb file."""
-        return self.parse()
-
     def parse(self):
         """Parse the metadata.rb into a dict."""
-        data = utils.ruby_lines(self.readlines())
-        data = [tuple(j.strip() for j in line.split(None, 1))
-                for line in data]
+        datamap = {}
         depends = {}
-        for line in data:
-            if not len(line) == 2:
+        for statement in self.document:
+            key = statement.keyword
+            if key is None:
                 continue
-            key, value = line
-            if key == 'depends':
-                value = value.split(',')
-                lib = utils.ruby_strip(value[0])
-                detail = [utils.ruby_strip(j) for j in value[1:]]
-                depends[lib] = detail
-        datamap = {key: utils.ruby_strip(val) for key, val in data}
+            positional, options = statement.arguments()
+            if not positional and not options:
+                continue
+            if key == 'depends' and positional:
+                depends[positional[0]] = positional[1:]
+                continue
+            datamap[key] = _value(statement, positional, options)
         if depends:
             datamap['depends'] = depends
-        self.seek(0)
         return datamap
 
     def merge(self, other):
@@ -136,8 +137,8 @@ class MetadataRb(utils.FileWrapper):
         if not isinstance(other, MetadataRb):
             raise TypeError("MetadataRb to merge should be a 'MetadataRb' "
                             "instance, not %s.", type(other))
-        current = self.to_dict()
-        new = other.to_dict()
+        current = self.parsed
+        new = other.parsed
 
         # compare and gather cookbook dependencies
         meta_writelines = ['%s\n' % self.depends_statement(cbn, meta)
@@ -155,61 +156,59 @@ class Berksfile(utils.FileWrapper):
     berks_options = [
         'branch',
         'git',
+        'group',
         'path',
         'ref',
         'revision',
         'tag',
     ]
 
-    def to_dict(self):
-        """Return a dictionary representation of this Berksfile."""
-        return self.parse()
-
     def parse(self):
         """Parse this Berksfile into a dict."""
         self.flush()
-        self.seek(0)
-        data = utils.ruby_lines(self.readlines())
-        data = [tuple(j.strip() for j in line.split(None, 1))
-                for line in data]
         datamap = {}
-        for line in data:
-            if len(line) == 1:
-                datamap[line[0]] = True
-            elif len(line) == 2:
-                key, value = line
-                if key == 'cookbook':
-                    datamap.setdefault('cookbook', {})
-                    value = [utils.ruby_strip(v) for v in value.split(',')]
-                    lib, detail = value[0], value[1:]
-                    datamap['cookbook'].setdefault(lib, {})
-                    # if there is additional dependency data but its
-                    # not the ruby hash, its the version constraint
-                    if detail and not any("".join(detail).startswith(o)
-                                          for o in self.berks_options):
-                        constraint, detail = detail[0], detail[1:]
-                        datamap['cookbook'][lib]['constraint'] = constraint
-                    if detail:
-                        for deet in detail:
-                            opt, val = [
-                                utils.ruby_strip(i)
-                                for i in deet.split(':', 1)
-                            ]
-                            if not any(opt == o for o in self.berks_options):
-                                raise ValueError(
-                                    "Cookbook detail '%s' does not specify "
-                                    "one of '%s'" % (opt, self.berks_options))
-                            else:
-                                datamap['cookbook'][lib][opt.strip(':')] = (
-                                    utils.ruby_strip(val))
-                elif key == 'source':
-                    datamap.setdefault(key, [])
-                    datamap[key].append(utils.ruby_strip(value))
-                elif key:
-                    datamap[key] = utils.ruby_strip(value)
-        self.seek(0)
+        self._parse_statements(self.document, datamap)
         return datamap
 
+    def _parse_statements(self, statements, datamap, group=None):
+        """Parse Berksfile statements into datamap.
+
+        The cookbooks of a group block are those of the Berksfile, with
+        the 'group' option.
+        """
+        for statement in statements:
+            key = statement.keyword
+            if key is None:
+                continue
+            positional, options = statement.arguments()
+            block = statement.block if key == 'group' else None
+            if block is not None:
+                self._parse_statements(
+                    block, datamap,
+                    group=_value(statement, positional, options))
+            elif not positional and not options:
+                datamap[key] = True
+            elif key == 'cookbook' and positional:
+                lib = positional[0]
+                cookbook = datamap.setdefault('cookbook', {}).setdefault(
+                    lib, {})
+                # the version constraint comes before any option
+                if len(positional) > 1:
+                    cookbook['constraint'] = positional[1]
+                for opt, val in options.items():
+                    if opt not in self.berks_options:
+                        raise ValueError(
+                            "Cookbook detail '%s' does not specify "
+                            "one of '%s'" % (opt, self.berks_options))
+                    cookbook[opt] = val
+                if group is not None:
+                    cookbook['group'] = group
+            elif key == 'source':
+                datamap.setdefault(key, [])
+                datamap[key].append(_value(statement, positional, options))
+            else:
+                datamap[key] = _value(statement, positional, options)
+
     @classmethod
     def from_dict(cls, dictionary):
         """Create a Berksfile instance from a dict."""
@@ -246,9 +245,10 @@ class Berksfile(utils.FileWrapper):
                                 % (cookbook_name, metadata))
             # not like the others...
             if 'constraint' in metadata:
-                line += ", '%s'" % metadata.pop('constraint')
+                line += ", '%s'" % metadata['constraint']
             for opt, spec in metadata.items():
-                line += ", %s: '%s'" % (opt, spec)
+                if opt != 'constraint':
+                    line += ", %s: '%s'" % (opt, spec)
         return line
 
     def merge(self, other):
@@ -256,8 +256,8 @@ class Berksfile(utils.FileWrapper):
         if not isinstance(other, Berksfile):
             raise TypeError("Berksfile to merge should be a 'Berksfile' "
                             "instance, not %s.", type(other))
-        current = self.to_dict()
-        new = other.to_dict()
+        current = self.parsed
+        new = other.parsed
 
         # compare and gather cookbook dependencies
         berks_writelines = ['%s\n' % self.cookbook_statement(cbn, meta)
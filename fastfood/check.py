@@ -0,0 +1,211 @@
+# Copyright 2015 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Template pack preflight, see check_pack().
+
+Finds what would break a build before any cookbook uses it: stencil sets
+that do not load, stencils that do not resolve, missing files, partials
+and binaries, and templates (or the templates they include, import or
+extend) that do not compile.
+"""
+
+import logging
+import multiprocessing
+import os
+import traceback
+
+import jinja2
+
+from fastfood import archive
+from fastfood import events
+from fastfood import exc
+from fastfood import pack
+from fastfood import templating
+
+LOG = logging.getLogger(__name__)
+
+# the template pack loaded by each check_pack() worker process
+_WORKER_PACK = None
+
+
+def _error(err, stencil=None, path=None):
+    """Return the report entry for the error 'err'."""
+    return {
+        'stencil': stencil,
+        'path': path,
+        'error': '%s: %s' % (exc.get_friendly_title(err), err),
+    }
+
+
+def _check_template(env, name):
+    """Compile the template 'name' of env and every template it refers to.
+
+    References are followed recursively (templates included by included
+    templates, and so on). Returns the names of the templates referred
+    to that do not exist.
+    """
+    templating.get_template(os.path.join(env.searchpath, name), env=env)
+    missing = []
+    visited = set([name])
+    pending = [name]
+    while pending:
+        for referenced in templating.referenced_templates(env,
+                                                          pending.pop()):
+            # None for names only known when rendering
+            if referenced is None or referenced in visited:
+                continue
+            visited.add(referenced)
+            try:
+                env.get_template(referenced)
+            except jinja2.TemplateNotFound:
+                missing.append(referenced)
+                continue
+            pending.append(referenced)
+    return missing
+
+
+def check_stencil_set(template_pack, stencilset_name):
+    """Check one stencil set of template_pack.
+
+    Returns its report: {'stencils': count, 'templates': count,
+    'binaries': count, 'seconds': {phase: seconds}, 'errors': [...]},
+    errors being {'stencil': name, 'path': file, 'error': message}.
+    """
+    report = {
+        'stencils': 0,
+        'templates': 0,
+        'binaries': 0,
+        'seconds': {},
+        'errors': [],
+    }
+    errors = report['errors']
+
+    start = events.clock()
+    try:
+        stencil_set = template_pack.load_stencil_set(stencilset_name)
+        stencil_names = sorted(stencil_set.stencils)
+    except Exception as err:  # pylint: disable=broad-except
+        errors.append(_error(err))
+        report['seconds']['load'] = events.clock() - start
+        return report
+    report['seconds']['load'] = events.clock() - start
+
+    # {path relative to the stencil set: (kind, first stencil using it)}
+    used = {}
+    start = events.clock()
+    for stencil_name in stencil_names:
+        try:
+            # the name option only matters to target paths
+            stencil = stencil_set.get_stencil(stencil_name,
+                                              name=stencil_name)
+        except Exception as err:  # pylint: disable=broad-except
+            errors.append(_error(err, stencil=stencil_name))
+            continue
+        report['stencils'] += 1
+        for key, kind in (('files', 'template'), ('partials', 'template'),
+                          ('binaries', 'binary')):
+            for path in (stencil.get(key) or {}).values():
+                used.setdefault(path, (kind, stencil_name))
+    report['seconds']['resolve'] = events.clock() - start
+
+    start = events.clock()
+    # the sources, even if the stencil set has compiled templates
+    env = templating.get_environment(stencil_set.path)
+    for path, (kind, stencil_name) in sorted(used.items()):
+        full_path = os.path.join(stencil_set.path, path)
+        if not archive.isfile(full_path):
+            errors.append({
+                'stencil': stencil_name,
+                'path': path,
+                'error': "Missing %s %s" % (kind, path),
+            })
+            continue
+        if kind == 'binary':
+            report['binaries'] += 1
+            continue
+        report['templates'] += 1
+        try:
+            missing = _check_template(env, path)
+        except Exception as err:  # pylint: disable=broad-except
+            LOG.debug("Template %s does not compile:\n%s", full_path,
+                      traceback.format_exc())
+            errors.append(_error(err, stencil=stencil_name, path=path))
+            continue
+        for name in missing:
+            errors.append({
+                'stencil': stencil_name,
+                'path': path,
+                'error': "Missing template %s" % name,
+            })
+    report['seconds']['compile'] = events.clock() - start
+    return report
+
+
+def _init_check_worker(templatepack_path, cache_dir, cache_size):
+    """Load the template pack once in a check_pack() worker."""
+    global _WORKER_PACK  # pylint: disable=global-statement
+    templating.configure_cache(cache_dir, max_size=cache_size)
+    _WORKER_PACK = pack.TemplatePack(templatepack_path)
+
+
+def _check_job(stencilset_name):
+    """Check one stencil set in a check_pack() worker."""
+    return stencilset_name, check_stencil_set(_WORKER_PACK, stencilset_name)
+
+
+def check_pack(templatepack_path, jobs=None):
+    """Check every stencil set listed in a template pack.
+
+    The template pack (a path, or an already loaded pack.TemplatePack)
+    is loaded once per worker process, each checking whole stencil sets;
+    there are 'jobs' workers, one per CPU by default, or none with 1.
+    Nothing stops at the first error: all of them are reported.
+
+    Returns the report, JSON-serializable:
+
+        {'template_pack': path, 'jobs': jobs, 'seconds': seconds,
+         'errors': total count of errors,
+         'stencil_sets': {name: see check_stencil_set()}}
+    """
+    start = events.clock()
+    if isinstance(templatepack_path, pack.TemplatePack):
+        template_pack = templatepack_path
+    else:
+        template_pack = pack.TemplatePack(templatepack_path)
+    names = sorted(template_pack.stencil_sets)
+    jobs = max(1, min(jobs or multiprocessing.cpu_count(), len(names)))
+
+    if jobs == 1:
+        reports = {name: check_stencil_set(template_pack, name)
+                   for name in names}
+    else:
+        cache = templating.JINJA_ENV.bytecode_cache
+        initargs = (template_pack.location,
+                    cache.directory if cache else None,
+                    cache.max_size if cache else templating.DEFAULT_CACHE_SIZE)
+        pool = multiprocessing.Pool(jobs, initializer=_init_check_worker,
+                                    initargs=initargs)
+        try:
+            reports = dict(pool.imap_unordered(_check_job, names))
+        finally:
+            pool.terminate()
+            pool.join()
+
+    return {
+        'template_pack': template_pack.path,
+        'jobs': jobs,
+        'seconds': events.clock() - start,
+        'errors': sum(len(report['errors']) for report in reports.values()),
+        'stencil_sets': reports,
+    }
@@ -0,0 +1,126 @@
+# Copyright 2015 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Fastfood build events.
+
+Pass a Hooks instance to food.build_cookbook() (or process_stencil())
+to be called back as the build goes:
+
+    build_started       cookbook, config
+    stencil_started     cookbook, stencil_set, stencil
+    template_compiled   template, seconds
+    template_rendered   template, target, bytes, seconds
+    dependencies_merged cookbook, dependencies, berks_dependencies
+    stencil_finished    cookbook, stencil_set, stencil, seconds, up_to_date
+    file_skipped        path, reason ('exists' or 'unchanged')
+    file_written        path, action, bytes, seconds
+    build_finished      cookbook, seconds, written, unchanged, skipped
+
+Each event calls the Hooks method of the same name, which calls emit()
+unless overridden. JsonLines writes every event as a line of JSON.
+
+Hooks are called in the thread running the build. Templates rendered by
+worker processes (jobs > 1) do not report being compiled, and streamed
+templates (stream=True) are only reported by file_written.
+"""
+
+from __future__ import unicode_literals
+
+import contextlib
+import json
+import threading
+import time
+
+EVENTS = ('build_started', 'stencil_started', 'template_compiled',
+          'template_rendered', 'dependencies_merged', 'stencil_finished',
+          'file_skipped', 'file_written', 'build_finished')
+# python 2 has no perf_counter
+# pylint: disable=invalid-name
+clock = getattr(time, 'perf_counter', time.time)
+# the hooks of the build running in each thread, innermost last
+_LOCAL = threading.local()
+
+
+class Hooks(object):
+
+    """Build event callbacks, doing nothing by default.
+
+    Override emit() to handle every event the same way, or the methods
+    named after the events you are interested in.
+    """
+
+    def emit(self, event, **fields):
+        """Handle 'event', one of EVENTS."""
+
+    def __getattr__(self, name):
+        """Send the events without their own method to emit()."""
+        if name not in EVENTS:
+            raise AttributeError(name)
+        return lambda **fields: self.emit(name, **fields)
+
+
+class JsonLines(Hooks):
+
+    """Write each event as a line of JSON to a file object.
+
+    Lines look like {"event": "file_written", "time": 1428000000.0, ...}
+    with the event fields, 'time' being the epoch time of the event.
+    """
+
+    def __init__(self, stream):
+        """Initialize, writing to 'stream'."""
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        """Write the event, flushing it so it can be tailed."""
+        fields['event'] = event
+        fields['time'] = time.time()
+        line = json.dumps(fields, sort_keys=True)
+        with self._lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+
+def _stack():
+    """Return the hooks installed in this thread."""
+    if not hasattr(_LOCAL, 'hooks'):
+        _LOCAL.hooks = []
+    return _LOCAL.hooks
+
+
+@contextlib.contextmanager
+def installed(hooks):
+    """Send the events of the block to 'hooks', if not None."""
+    if hooks is None:
+        yield
+        return
+    stack = _stack()
+    stack.append(hooks)
+    try:
+        yield
+    finally:
+        stack.pop()
+
+
+def enabled():
+    """Whether events are being sent anywhere, in this thread."""
+    return bool(getattr(_LOCAL, 'hooks', None))
+
+
+def emit(event, **fields):
+    """Send 'event' to the hooks installed in this thread, if any."""
+    stack = getattr(_LOCAL, 'hooks', None)
+    if stack:
+        getattr(stack[-1], event)(**fields)
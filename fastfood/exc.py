@@ -52,6 +52,16 @@ class FastfoodTemplatePackAttributeError(AttributeError, FastfoodError):
     """Invalid stencilset request from TemplatePack."""
 
 
+class FastfoodRubySyntaxError(ValueError, FastfoodError):
+
+    """A ruby file (metadata.rb, Berksfile) cannot be read."""
+
+
+class FastfoodDaemonRunning(FastfoodError):
+
+    """A fastfood daemon is already listening on the socket."""
+
+
 def get_friendly_title(err):
     """Turn class, instance, or name (str) into an eyeball-friendly title.
 
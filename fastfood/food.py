@@ -17,20 +17,37 @@
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import collections
 import datetime
 import errno
 import json
 import logging
+import multiprocessing
 import os
 import shutil
+import tempfile
+import traceback
 
 from fastfood import book
+from fastfood import events
+from fastfood import exc
+from fastfood import ledger as ledger_module
 from fastfood import pack
+from fastfood import plan
 from fastfood import templating
+from fastfood import timings
 from fastfood import utils
 
 LOG = logging.getLogger(__name__)
 
+# outcome of one cookbook build in build_cookbooks()
+BuildResult = collections.namedtuple(
+    'BuildResult',
+    'config exit_code cookbook written_files error unchanged_files '
+    'skipped_files')
+# the template pack loaded by each build_cookbooks() worker process
+_WORKER_PACK = None
+
 
 def _determine_selected_stencil(stencil_set, stencil_definition):
     """Determine appropriate stencil name for stencil definition.
@@ -50,11 +67,13 @@ def _determine_selected_stencil(stencil_set, stencil_definition):
     return selected_stencil_name
 
 
-def _build_template_map(cookbook, cookbook_name, stencil):
+def _build_template_map(cookbook, cookbook_name, stencil, build_plan,
+                        dependencies=None):
     """Build a map of variables for this generated cookbook and stencil.
 
     Get template variables from stencil option values, adding the default ones
-    like cookbook and cookbook year.
+    like cookbook and cookbook year, reading metadata.rb as planned so far,
+    with the 'dependencies' not merged into it yet.
     """
     template_map = {
         'cookbook': {"name": cookbook_name},
@@ -63,7 +82,13 @@ def _build_template_map(cookbook, cookbook_name, stencil):
 
     # Cookbooks may not yet have metadata, so we pass an empty dict if so
     try:
-        template_map['cookbook'] = cookbook.metadata.to_dict().copy()
+        metadata = _cookbook_file(cookbook, build_plan, book.MetadataRb)
+        template_map['cookbook'] = dict(metadata.parsed)
+        if dependencies is not None and dependencies.depends:
+            depends = {name: list(meta) for name, (meta, _)
+                       in dependencies.depends.items()}
+            depends.update(template_map['cookbook'].get('depends', {}))
+            template_map['cookbook']['depends'] = depends
     except ValueError:
         # ValueError may be returned if this cookbook does not yet have any
         # metadata.rb written by a stencil. This is okay, as everyone should
@@ -75,92 +100,251 @@ def _build_template_map(cookbook, cookbook_name, stencil):
     return template_map
 
 
-def _render_binaries(files, written_files):
-    """Write binary contents from filetable into files.
+def _cookbook_file(cookbook, build_plan, wrapper_cls):
+    """Return the planned metadata.rb or Berksfile of the cookbook.
 
-    Using filetable for the input files, and the list of files, render
-    all the templates into actual files on disk, forcing to overwrite the file
-    as appropriate, and using the given open mode for the file.
+    'wrapper_cls' is book.MetadataRb or book.Berksfile.
     """
-    for source_path, target_path in files.items():
-        needdir = os.path.dirname(target_path)
-        assert needdir, "Target should have valid parent dir"
-        try:
-            os.makedirs(needdir)
-        except OSError as err:
-            if err.errno != errno.EEXIST:
-                raise
-
-        if os.path.isfile(target_path):
-            if target_path in written_files:
-                LOG.warning("Previous stencil has already written file %s.",
-                            target_path)
-            else:
-                print("Skipping existing file %s" % target_path)
-                LOG.info("Skipping existing file %s", target_path)
-                continue
-
-        print("Writing rendered file %s" % target_path)
-        LOG.info("Writing rendered file %s", target_path)
-
-        shutil.copy(source_path, target_path)
-        if os.path.exists(target_path):
-            written_files.append(target_path)
-
-
-def _render_templates(files, filetable, written_files, force, open_mode='w'):
-    """Write template contents from filetable into files.
-
-    Using filetable for the rendered templates, and the list of files, render
-    all the templates into actual files on disk, forcing to overwrite the file
-    as appropriate, and using the given open mode for the file.
+    if wrapper_cls is book.MetadataRb:
+        path = os.path.join(cookbook.path, 'metadata.rb')
+        missing = "Cookbook needs metadata.rb, %s"
+    else:
+        path = os.path.join(cookbook.path, 'Berksfile')
+        missing = "No Berksfile found at %s"
+    if not build_plan.exists(path):
+        raise ValueError(missing % path)
+    return build_plan.wrap(path, wrapper_cls)
+
+
+def _should_write(target_path, written_files, force, build_plan):
+    """Decide whether target_path should be (over)written."""
+    if build_plan.exists(target_path):
+        if force:
+            LOG.warning("Forcing overwrite of existing file %s.",
+                        target_path)
+        elif target_path in written_files:
+            LOG.warning("Previous stencil has already written file %s.",
+                        target_path)
+        else:
+            print("Skipping existing file %s" % target_path)
+            LOG.info("Skipping existing file %s", target_path)
+            build_plan.skip(target_path)
+            return False
+    return True
+
+
+def _select_targets(files, written_files, force, build_plan):
+    """Return the files whose targets should be written.
+
+    Deciding this before rendering means skipped files are never rendered.
     """
-    for tpl_path, content in filetable:
-        target_path = files[tpl_path]
-        needdir = os.path.dirname(target_path)
-        assert needdir, "Target should have valid parent dir"
-        try:
-            os.makedirs(needdir)
-        except OSError as err:
-            if err.errno != errno.EEXIST:
-                raise
-
-        if os.path.isfile(target_path):
-            if force:
-                LOG.warning("Forcing overwrite of existing file %s.",
-                            target_path)
-            elif target_path in written_files:
-                LOG.warning("Previous stencil has already written file %s.",
-                            target_path)
-            else:
-                print("Skipping existing file %s" % target_path)
-                LOG.info("Skipping existing file %s", target_path)
-                continue
-
-        with open(target_path, open_mode) as newfile:
-            print("Writing rendered file %s" % target_path)
-            LOG.info("Writing rendered file %s", target_path)
-            newfile.write(content)
-            written_files.append(target_path)
+    return {source_path: target_path
+            for source_path, target_path in files.items()
+            if _should_write(target_path, written_files, force, build_plan)}
 
 
 def build_cookbook(build_config, templatepack_path,
-                   cookbooks_home, force=False):
+                   cookbooks_home, force=False, jobs=1, stream=False,
+                   incremental=True, dry_run=False, atomic=False,
+                   durability='none', binaries='copy', build_plan=None,
+                   hooks=None):
     """Build a cookbook from a fastfood.json file.
 
     Can build on an existing cookbook, otherwise this will
-    create a new cookbook for you based on your templatepack.
+    create a new cookbook for you based on your templatepack, which may
+    be a path or an already loaded pack.TemplatePack.
+
+    With 'jobs' > 1, each stencil's templates are rendered concurrently
+    by that many worker processes. With 'stream', templates are instead
+    rendered straight into their target files (see process_stencil()), in
+    this process: 'stream' and 'jobs' > 1 cannot be used together.
+
+    If 'incremental', stencils that are unchanged since the last build
+    (see ledger.BuildLedger) are not built again, unless forced.
+
+    The stencils are first planned (see plan.BuildPlan), then every file
+    is written once, the dependencies of every stencil being merged into
+    metadata.rb and Berksfile at the end (see PendingDependencies). With
+    'dry_run', the plan is only shown. If 'atomic', files are staged in a
+    dir next to the cookbook and renamed into place.
+    'durability' is one of plan.DURABILITY and 'binaries' one of
+    plan.BINARY_STRATEGIES.
+
+    Files whose content would not change are not written. Returns the
+    files written (or that would be) and the cookbook; pass 'build_plan'
+    to also get the unchanged and skipped files out of it.
+
+    'hooks' (see events.Hooks) are called back as the build goes.
     """
+    if hooks is not None:
+        with events.installed(hooks):
+            return build_cookbook(
+                build_config, templatepack_path, cookbooks_home,
+                force=force, jobs=jobs, stream=stream,
+                incremental=incremental, dry_run=dry_run, atomic=atomic,
+                durability=durability, binaries=binaries,
+                build_plan=build_plan)
+
+    if stream and jobs and jobs > 1:
+        raise ValueError("Streamed templates are rendered in this process, "
+                         "build with a single job.")
+    started = events.clock()
     with open(build_config) as cfg:
         cfg = json.load(cfg)
 
     cookbook_name = cfg['name']
-    template_pack = pack.TemplatePack(templatepack_path)
+    events.emit('build_started', cookbook=cookbook_name,
+                config=build_config)
+    if isinstance(templatepack_path, pack.TemplatePack):
+        template_pack = templatepack_path
+    else:
+        template_pack = pack.TemplatePack(templatepack_path)
 
     written_files = []
+    created = not os.path.isdir(
+        os.path.join(utils.normalize_path(cookbooks_home), cookbook_name))
     cookbook = create_new_cookbook(cookbook_name, cookbooks_home)
+    if build_plan is None:
+        build_plan = plan.BuildPlan(binaries=binaries)
+
+    ledger = None
+    if incremental:
+        ledger = ledger_module.BuildLedger(cookbook.path)
 
-    for stencil_definition in cfg['stencils']:
+    pool = None
+    if jobs and jobs > 1:
+        pool = templating.render_pool(jobs)
+    dependencies = PendingDependencies()
+    try:
+        updated_cookbook = _process_stencils(
+            cfg, cookbook, cookbook_name, template_pack, force,
+            written_files, pool, stream, ledger, build_plan, dependencies)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    with timings.phase('merge'):
+        dependencies.apply(cookbook, build_plan)
+
+    if dry_run:
+        written_files = build_plan.show()
+        if created:
+            # leave no trace of the new cookbook
+            os.rmdir(cookbook.path)
+        _build_finished(cookbook_name, started, build_plan)
+        return written_files, updated_cookbook
+
+    stage_dir = None
+    if atomic:
+        stage_dir = tempfile.mkdtemp(
+            prefix='.%s.fastfood-stage-' % cookbook_name,
+            dir=os.path.dirname(cookbook.path))
+    try:
+        with timings.phase('write'):
+            written_files = build_plan.apply(stage_dir=stage_dir,
+                                             durability=durability)
+    finally:
+        if stage_dir is not None:
+            shutil.rmtree(stage_dir, ignore_errors=True)
+
+    if ledger is not None:
+        with timings.phase('ledger'):
+            # what the stencils of the next build render with
+            ledger.save(inputs=_build_template_map(
+                cookbook, cookbook_name, {'options': {}},
+                build_plan)['cookbook'])
+    _build_finished(cookbook_name, started, build_plan)
+    return written_files, updated_cookbook
+
+
+def _build_finished(cookbook_name, started, build_plan):
+    """Emit the build_finished event of build_cookbook()."""
+    events.emit('build_finished', cookbook=cookbook_name,
+                seconds=events.clock() - started,
+                written=len(build_plan.written),
+                unchanged=len(build_plan.unchanged),
+                skipped=len(build_plan.skipped))
+
+
+def _build_one(build_config, template_pack, cookbooks_home, options):
+    """Build one cookbook for build_cookbooks(), returning a BuildResult."""
+    build_plan = plan.BuildPlan(binaries=options.get('binaries', 'copy'))
+    try:
+        written_files, cookbook = build_cookbook(
+            build_config, template_pack, cookbooks_home,
+            build_plan=build_plan, **options)
+    except Exception as err:  # pylint: disable=broad-except
+        LOG.debug("Failed to build %s:\n%s", build_config,
+                  traceback.format_exc())
+        return BuildResult(build_config, 1, None, [],
+                           '%s: %s' % (exc.get_friendly_title(err), err),
+                           [], [])
+    return BuildResult(build_config, 0, cookbook.path, written_files, None,
+                       build_plan.unchanged, build_plan.skipped)
+
+
+def _init_build_worker(templatepack_path, cache_dir, cache_size):
+    """Load the template pack once in a build_cookbooks() worker."""
+    global _WORKER_PACK  # pylint: disable=global-statement
+    templating.configure_cache(cache_dir, max_size=cache_size)
+    _WORKER_PACK = pack.TemplatePack(templatepack_path, preload=True)
+
+
+def _build_job(job):
+    """Build one (build_config, cookbooks_home, options) job."""
+    build_config, cookbooks_home, options = job
+    return _build_one(build_config, _WORKER_PACK, cookbooks_home, options)
+
+
+def build_cookbooks(build_configs, templatepack_path, cookbooks_home,
+                    jobs=1, **options):
+    """Build a cookbook for each of the fastfood.json 'build_configs'.
+
+    The template pack (a path, or an already loaded pack.TemplatePack)
+    is loaded once (once per worker process, with 'jobs' > 1), with all
+    of its stencil sets, and shared by every build. A failed build does
+    not stop the others. 'options' are passed on to build_cookbook().
+
+    Yields a BuildResult per config, in the order of 'build_configs'.
+    """
+    if jobs and jobs > 1 and options.get('hooks') is not None:
+        raise ValueError("Build hooks are not called from worker "
+                         "processes, build with a single job.")
+    if isinstance(templatepack_path, pack.TemplatePack):
+        template_pack = templatepack_path
+        templatepack_path = template_pack.location
+    else:
+        template_pack = None
+    if not jobs or jobs < 2:
+        template_pack = template_pack or pack.TemplatePack(templatepack_path)
+        template_pack.preload()
+        for build_config in build_configs:
+            yield _build_one(build_config, template_pack, cookbooks_home,
+                             options)
+        return
+
+    cache = templating.JINJA_ENV.bytecode_cache
+    initargs = (utils.normalize_path(templatepack_path),
+                cache.directory if cache else None,
+                cache.max_size if cache else templating.DEFAULT_CACHE_SIZE)
+    pool = multiprocessing.Pool(jobs, initializer=_init_build_worker,
+                                initargs=initargs)
+    try:
+        jobs = [(build_config, cookbooks_home, options)
+                for build_config in build_configs]
+        for result in pool.imap(_build_job, jobs):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _process_stencils(cfg, cookbook, cookbook_name, template_pack, force,
+                      written_files, pool, stream, ledger, build_plan,
+                      dependencies):
+    """Process every stencil listed in the fastfood.json config 'cfg'."""
+    updated_cookbook = cookbook
+    for position, stencil_definition in enumerate(cfg['stencils']):
 
         selected_stencil_set_name = stencil_definition.get('stencil_set')
         stencil_set = template_pack.load_stencil_set(selected_stencil_set_name)
@@ -170,29 +354,89 @@ def build_cookbook(build_config, templatepack_path,
             stencil_definition
         )
 
-        stencil = stencil_set.get_stencil(selected_stencil_name,
-                                          **stencil_definition)
-
-        updated_cookbook = process_stencil(
-            cookbook,
-            cookbook_name,  # in case no metadata.rb yet
-            template_pack,
-            force,
-            stencil_set,
-            stencil,
-            written_files
-        )
-
-    return written_files, updated_cookbook
+        started = events.clock()
+        events.emit('stencil_started', cookbook=cookbook_name,
+                    stencil_set=selected_stencil_set_name,
+                    stencil=selected_stencil_name)
+        with timings.stencil('%s/%s' % (selected_stencil_set_name,
+                                        selected_stencil_name)):
+            stencil = stencil_set.get_stencil(selected_stencil_name,
+                                              **stencil_definition)
+
+            if ledger is not None:
+                with timings.phase('ledger'):
+                    inputs = _build_template_map(
+                        cookbook, cookbook_name, stencil, build_plan,
+                        dependencies)['cookbook']
+                    up_to_date = ledger.record(
+                        position, stencil_definition, stencil_set, stencil,
+                        changed=build_plan.changed_paths(), inputs=inputs)
+                if up_to_date and not force:
+                    print("Stencil %s up to date" % selected_stencil_name)
+                    LOG.info("Stencil %s (%s) up to date, skipping",
+                             selected_stencil_name, stencil_set.path)
+                    events.emit('stencil_finished', cookbook=cookbook_name,
+                                stencil_set=selected_stencil_set_name,
+                                stencil=selected_stencil_name,
+                                seconds=events.clock() - started,
+                                up_to_date=True)
+                    continue
+
+            updated_cookbook = process_stencil(
+                cookbook,
+                cookbook_name,  # in case no metadata.rb yet
+                template_pack,
+                force,
+                stencil_set,
+                stencil,
+                written_files,
+                pool=pool,
+                stream=stream,
+                build_plan=build_plan,
+                dependencies=dependencies
+            )
+        events.emit('stencil_finished', cookbook=cookbook_name,
+                    stencil_set=selected_stencil_set_name,
+                    stencil=selected_stencil_name,
+                    seconds=events.clock() - started, up_to_date=False)
+
+    return updated_cookbook
 
 
 def process_stencil(cookbook, cookbook_name, template_pack,
-                    force_argument, stencil_set, stencil, written_files):
+                    force_argument, stencil_set, stencil, written_files,
+                    pool=None, stream=False, build_plan=None, hooks=None,
+                    dependencies=None):
     """Process the stencil requested, writing any missing files as needed.
 
     The stencil named 'stencilset_name' should be one of
-    templatepack's stencils.
+    templatepack's stencils. Templates are rendered by 'pool', if given
+    (see templating.render_pool()). With 'stream', each template is only
+    rendered, chunk by chunk, as its target file is written instead.
+
+    The files are added to 'build_plan' (see plan.BuildPlan), to be
+    written by the caller. Without a plan, they are written right away.
+    The stencil's dependencies are added to 'dependencies' (see
+    PendingDependencies) for the caller to merge, or merged right away.
+    'hooks' (see events.Hooks) are called back as the stencil is built.
     """
+    if hooks is not None:
+        with events.installed(hooks):
+            return process_stencil(cookbook, cookbook_name, template_pack,
+                                   force_argument, stencil_set, stencil,
+                                   written_files, pool=pool, stream=stream,
+                                   build_plan=build_plan,
+                                   dependencies=dependencies)
+
+    if build_plan is None:
+        build_plan = plan.BuildPlan()
+        process_stencil(cookbook, cookbook_name, template_pack,
+                        force_argument, stencil_set, stencil, written_files,
+                        pool=pool, stream=stream, build_plan=build_plan,
+                        dependencies=dependencies)
+        build_plan.apply()
+        return cookbook
+
     # force can be passed on the command line or forced in a stencil's options
     force = force_argument or stencil['options'].get('force', False)
 
@@ -220,28 +464,115 @@ def process_stencil(cookbook, cookbook_name, template_pack,
         for tgt, tpl in stencil['binaries'].items()
     }
 
-    template_map = _build_template_map(cookbook, cookbook_name, stencil)
+    template_map = _build_template_map(cookbook, cookbook_name, stencil,
+                                       build_plan, dependencies)
+
+    env = stencil_set.jinja_env
+    # partials may append to files written just above, so select them after
+    for table, add in ((files, build_plan.write),
+                       (partials, build_plan.append)):
+        table = _select_targets(table, written_files, force, build_plan)
+        if stream:
+            rendered = ((tpl_path, ('template', tpl_path, env, template_map))
+                        for tpl_path in table)
+        else:
+            rendered = ((tpl_path, ('text', content))
+                        for tpl_path, content in templating.render_files(
+                            table.keys(), template_map, env=env, pool=pool))
+        # streamed templates only render as they are written
+        report = events.enabled() and not stream
+        started = events.clock()
+        for tpl_path, part in timings.iterate('render', rendered):
+            if report:
+                events.emit('template_rendered', template=tpl_path,
+                            target=table[tpl_path],
+                            bytes=len(part[1].encode('utf-8')),
+                            seconds=events.clock() - started)
+            add(table[tpl_path], part)
+            written_files.append(table[tpl_path])
+            started = events.clock()
+
+    # no templating needed for binaries, just install them
+    for source_path, target_path in _select_targets(
+            binaries, written_files, False, build_plan).items():
+        build_plan.copy(target_path, source_path)
+        written_files.append(target_path)
+
+    if dependencies is not None:
+        dependencies.add(stencil)
+    else:
+        with timings.phase('merge'):
+            _merge_dependencies(cookbook, stencil, build_plan)
+
+    return cookbook
+
 
-    filetable = templating.render_templates(*files.keys(), **template_map)
-    _render_templates(files, filetable, written_files, force)
+class PendingDependencies(object):
 
-    parttable = templating.render_templates(*partials.keys(), **template_map)
-    _render_templates(partials, parttable, written_files, force, open_mode='a')
+    """The dependencies of the stencils of a build, not merged yet.
 
-    # no templating needed for binaries, just pass off to the copy method
-    _render_binaries(binaries, written_files)
+    Stencils add their 'dependencies' (metadata.rb) and
+    'berks_dependencies' (Berksfile) as they are processed, and apply()
+    merges them all at the end of the build, so each file is parsed and
+    written once instead of once per stencil.
+    """
 
+    def __init__(self):
+        """Initialize, with no dependencies."""
+        # {cookbook name: (constraints or options, id of the stencil)}
+        self.depends = {}
+        self.berks = {}
+
+    def add(self, stencil):
+        """Add the dependencies of a resolved stencil.
+
+        Raises ValueError if another stencil added the same cookbook with
+        other constraints (or Berksfile options).
+        """
+        stencil_id = stencil.get('id')
+        for table, deps in ((self.depends, stencil.get('dependencies')),
+                            (self.berks, stencil.get('berks_dependencies'))):
+            for name, meta in (deps or {}).items():
+                meta = meta or {}
+                if name not in table:
+                    table[name] = (meta, stencil_id)
+                elif table[name][0] != meta:
+                    raise ValueError(
+                        "Stencils %s and %s need cookbook %s with different "
+                        "constraints: %s and %s."
+                        % (table[name][1], stencil_id, name, table[name][0],
+                           meta))
+
+    def apply(self, cookbook, build_plan):
+        """Merge the dependencies into the cookbook's files, if any."""
+        if not self.depends and not self.berks:
+            return
+        stencil = {
+            'dependencies': {name: meta for name, (meta, _)
+                             in self.depends.items()},
+            'berks_dependencies': {name: meta for name, (meta, _)
+                                   in self.berks.items()},
+        }
+        _merge_dependencies(cookbook, stencil, build_plan)
+
+
+def _merge_dependencies(cookbook, stencil, build_plan):
+    """Merge the stencil's dependencies into metadata.rb and Berksfile."""
     # merge metadata.rb dependencies
     stencil_metadata_deps = {'depends': stencil.get('dependencies', {})}
     stencil_metadata = book.MetadataRb.from_dict(stencil_metadata_deps)
-    cookbook.metadata.merge(stencil_metadata)
+    _cookbook_file(cookbook, build_plan, book.MetadataRb).merge(
+        stencil_metadata)
 
     # merge Berksfile dependencies
     stencil_berks_deps = {'cookbook': stencil.get('berks_dependencies', {})}
     stencil_berks = book.Berksfile.from_dict(stencil_berks_deps)
-    cookbook.berksfile.merge(stencil_berks)
+    _cookbook_file(cookbook, build_plan, book.Berksfile).merge(stencil_berks)
 
-    return cookbook
+    events.emit('dependencies_merged',
+                cookbook=os.path.basename(cookbook.path),
+                dependencies=sorted(stencil_metadata_deps['depends']),
+                berks_dependencies=sorted(stencil_berks_deps['cookbook']))
 
 
 def create_new_cookbook(cookbook_name, cookbooks_home):
@@ -0,0 +1,192 @@
+# Copyright 2015 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Fastfood build ledger, for incremental builds."""
+
+import json
+import logging
+import os
+
+from fastfood import templating
+from fastfood import utils
+
+LOG = logging.getLogger(__name__)
+LEDGER_FILE = '.fastfood.lock'
+
+
+class BuildLedger(object):
+
+    """The build ledger of a cookbook.
+
+    Records, for each stencil in the cookbook's fastfood.json, hashes of
+    the config entry, the resolved stencil, the data its templates render
+    with, the template and binary sources (with the templates those
+    include, import or extend) and the files the stencil wrote. A stencil
+    whose inputs are unchanged, and whose outputs are still as the last
+    build left them, does not need to be built again.
+    """
+
+    api = 2
+
+    def __init__(self, cookbook_path):
+        """Initialize the ledger of the cookbook at cookbook_path."""
+        self.cookbook_path = utils.normalize_path(cookbook_path)
+        self.path = os.path.join(self.cookbook_path, LEDGER_FILE)
+        self._previous = []
+        self._records = []
+        # the ledger file as read, so save() can leave it alone
+        self._content = None
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path) as ledger:
+                    self._content = ledger.read()
+                previous = json.loads(self._content)
+            except ValueError as err:
+                LOG.warning("Ignoring unreadable build ledger %s: %s",
+                            self.path, err)
+            else:
+                if previous.get('api') == self.api:
+                    self._previous = previous.get('stencils', [])
+
+    def __repr__(self):
+        """Canonical string representation of the ledger."""
+        return '<%s %s>' % (type(self).__name__, self.path)
+
+    def _output_hashes(self, outputs):
+        """Return {output: hash} for cookbook-relative output paths."""
+        return {output: utils.file_hash(
+                    os.path.join(self.cookbook_path, output))
+                for output in outputs}
+
+    def _source_hashes(self, stencil_set, templates, binaries, previous):
+        """Return ({source: hash}, {template: names it refers to}).
+
+        Templates are followed to those they refer to, recursively. The
+        references of compiled templates, and of templates unchanged since
+        the 'previous' record, are known without parsing them again.
+        """
+        hashes = {source: utils.file_hash(
+                      os.path.join(stencil_set.path, source))
+                  for source in binaries}
+        known = previous.get('references') or {}
+        known_hashes = previous.get('sources') or {}
+        references = {}
+        env = None
+        pending = sorted(templates)
+        while pending:
+            name = pending.pop()
+            if name in references:
+                continue
+            hashes[name] = utils.file_hash(
+                os.path.join(stencil_set.path, name))
+            if hashes[name] is None:
+                references[name] = []
+                continue
+            if name in stencil_set.references:
+                references[name] = stencil_set.references[name]
+            elif name in known and known_hashes.get(name) == hashes[name]:
+                references[name] = known[name]
+            else:
+                # the sources, even if the stencil set has compiled ones
+                env = env or templating.get_environment(stencil_set.path)
+                references[name] = templating.referenced_templates(env,
+                                                                   name)
+            pending.extend(referenced for referenced in references[name]
+                           if referenced is not None and
+                           referenced not in references)
+        return hashes, references
+
+    def record(self, position, definition, stencil_set, stencil,
+               changed=(), inputs=None):
+        """Record the stencil built at 'position' in fastfood.json.
+
+        'definition' is its config entry and 'stencil' the definition
+        resolved by stencil_set. 'inputs' is the cookbook data its
+        templates render with, metadata.rb as planned so far and the like,
+        the options being part of the stencil. 'changed' are the paths that
+        earlier stencils in this build are about to change. Returns True
+        if the stencil is up to date with the last build, i.e. it does not
+        need to be built again.
+        """
+        templates = set()
+        binaries = set()
+        outputs = set()
+        for key, sources in (('files', templates), ('partials', templates),
+                             ('binaries', binaries)):
+            for target, source in (stencil.get(key) or {}).items():
+                sources.add(source)
+                outputs.add(target)
+        # dependencies are merged into these
+        if stencil.get('dependencies'):
+            outputs.add('metadata.rb')
+        if stencil.get('berks_dependencies'):
+            outputs.add('Berksfile')
+
+        if position < len(self._previous):
+            previous = self._previous[position]
+        else:
+            previous = {}
+        sources, references = self._source_hashes(stencil_set, templates,
+                                                  binaries, previous)
+        record = {
+            'entry': utils.data_hash(definition),
+            'stencil': utils.data_hash(stencil),
+            'inputs': utils.data_hash(inputs),
+            'sources': sources,
+            'references': references,
+            'outputs': sorted(outputs),
+        }
+        del self._records[position:]
+        self._records.append(record)
+
+        if not previous:
+            return False
+        if any(None in names for names in references.values()):
+            LOG.debug("Stencil refers to templates only known when "
+                      "rendering, building it again")
+            return False
+        if any(previous.get(key) != record[key]
+               for key in ('entry', 'stencil', 'inputs', 'sources')):
+            return False
+        if any(os.path.join(self.cookbook_path, output) in changed
+               for output in record['outputs']):
+            return False
+        # outputs is saved as {output: hash}
+        return (previous.get('outputs') ==
+                self._output_hashes(record['outputs']))
+
+    def save(self, inputs=None):
+        """Write the ledger, hashing every output as it is now.
+
+        'inputs' is the cookbook data as the build left it, which every
+        stencil of the next build renders with, see record(). A ledger
+        file already holding the same records is not written again.
+        """
+        stencils = []
+        inputs = utils.data_hash(inputs)
+        for record in self._records:
+            record = dict(record)
+            record['inputs'] = inputs
+            record['outputs'] = self._output_hashes(record['outputs'])
+            stencils.append(record)
+        content = json.dumps({'api': self.api, 'stencils': stencils},
+                             indent=2, sort_keys=True)
+        self._previous = stencils
+        if content == self._content:
+            LOG.debug("Build ledger %s unchanged", self.path)
+            return
+        with open('%s.tmp' % self.path, 'w') as ledger:
+            ledger.write(content)
+        os.rename('%s.tmp' % self.path, self.path)
+        self._content = content
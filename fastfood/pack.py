@@ -14,13 +14,29 @@
 
 """Fastfood Template Pack manager."""
 
+import errno
 import json
+import logging
+import marshal
 import os
+import sys
+import threading
 
+from fastfood import archive
 from fastfood import exc
 from fastfood import stencil as stencil_module
+from fastfood import timings
 from fastfood import utils
 
+LOG = logging.getLogger(__name__)
+# the index of a pack's manifests and templates, written in the pack (see
+# TemplatePack.index); marshal data is only read by the python writing it
+INDEX_NAME = '.fastfood.index'
+INDEX_API = 1
+_INDEX_PYTHON = list(sys.version_info[:2]) + [marshal.version]
+# threads loading stencil sets in TemplatePack.preload(), by default
+PRELOAD_THREADS = 8
+
 
 class TemplatePack(object):
 
@@ -29,21 +45,45 @@ class TemplatePack(object):
     Holds references to stencil sets.
     """
 
-    def __init__(self, path):
-        """Initialize, asserting templatepack path and manifest."""
+    def __init__(self, path, preload=False):
+        """Initialize, asserting templatepack path and manifest.
+
+        With 'preload', every stencil set is loaded right away, see
+        preload().
+        """
         self._manifest = None
+        self._index = None
+        self._index_changed = False
+        self._compiled_index = None
         # for caching Stencil instances
         self._stencil_sets = {}
+        # guards the cache and the index, for preload()
+        self._lock = threading.RLock()
         self.path = utils.normalize_path(path)
-        if not os.path.isdir(self.path):
+        # a zip or tar archive of the pack, read in place
+        self.archive = None
+        if archive.is_archive(self.path):
+            self.archive = archive.open_archive(self.path)
+            self.path = archive.pack_root(self.archive)
+            if self.path is None:
+                raise ValueError("Templatepack archive %s has no manifest "
+                                 "file." % self.archive.path)
+        # where compile() writes precompiled templates
+        self.compiled_path = os.path.join(self.path, '.compiled')
+        # archives are not written to, nor need an index
+        self.index_path = (None if self.archive
+                           else os.path.join(self.path, INDEX_NAME))
+        if not archive.isdir(self.path):
             raise ValueError("Templatepack dir %s does not exist."
                              % self.path)
         self.manifest_path = os.path.join(self.path, 'manifest.json')
-        if not os.path.isfile(self.manifest_path):
+        if not archive.isfile(self.manifest_path):
             raise ValueError("Templatepack needs manifest file, %s"
                              % os.path.relpath(self.manifest_path))
         self._validate('api', cls=int)
         self._validate('stencil_sets', cls=dict)
+        if preload:
+            self.preload()
 
     def _validate(self, key, cls=None):
         """Verify the manifest schema."""
@@ -55,20 +95,282 @@ class TemplatePack(object):
                 raise TypeError("Manifest value '%s' should be %s, not %s"
                                 % (key, cls, type(self.manifest[key])))
 
+    @property
+    def location(self):
+        """What to load this pack from again: its dir, or its archive."""
+        return self.archive.path if self.archive else self.path
+
     @property
     def manifest(self):
         """The loaded templatepack manifest property."""
         if not self._manifest:
-            with open(self.manifest_path) as man:
-                self._manifest = json.load(man)
+            self._manifest = self.index['manifest']
         return self._manifest
 
+    @property
+    def index(self):
+        """The index of this pack's manifests, see INDEX_NAME.
+
+        {'manifest': the pack manifest, 'stamp': its stamp,
+         'stencil_sets': {name: [stamp, marshalled stencil set entry]}}
+
+        Read from self.index_path, if there is one there, and kept up to
+        date in memory: stencil sets are indexed as they are loaded, see
+        _indexed_stencil_set(). Only write_index() (run by compile())
+        writes it back, so using a pack never writes into it.
+        """
+        with self._lock:
+            if self._index is None:
+                self._index = self._load_index()
+        return self._index
+
+    def _load_index(self):
+        """Read the index, bringing its pack manifest up to date."""
+        index = self._read_index() or {
+            'api': INDEX_API,
+            'python': _INDEX_PYTHON,
+            'manifest': None,
+            'stamp': None,
+            'stencil_sets': {},
+        }
+        if not self._unchanged(index['stamp'], 'manifest.json'):
+            index['stamp'] = self._stamp('manifest.json')
+            with timings.phase('manifest'):
+                with archive.open_file(self.manifest_path) as man:
+                    index['manifest'] = json.load(man)
+            listed = index['manifest'].get('stencil_sets')
+            for name in list(index['stencil_sets']):
+                if not isinstance(listed, dict) or name not in listed:
+                    del index['stencil_sets'][name]
+            self._index_changed = True
+        return index
+
+    def _read_index(self):
+        """Return the index written in the pack, if any."""
+        if self.index_path is None:
+            return None
+        try:
+            with open(self.index_path, 'rb') as stream:
+                # loads() of the whole file: load() reads object by object
+                index = marshal.loads(stream.read())
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+        if (isinstance(index, dict) and index.get('api') == INDEX_API and
+                index.get('python') == _INDEX_PYTHON):
+            return index
+        return None
+
+    def _stamp(self, name):
+        """Return [stamp, sha1] of the pack file 'name', to index it."""
+        path = os.path.join(self.path, name)
+        return [utils.file_stamp(path), utils.file_hash(path)]
+
+    def _unchanged(self, stamp, name):
+        """Whether the pack file 'name' is still as its [stamp, sha1].
+
+        That is same mtime and size, or else same sha1: the stamp of a
+        file touched but not changed is updated.
+        """
+        if stamp is None:
+            return False
+        path = os.path.join(self.path, name)
+        current = utils.file_stamp(path)
+        if current == stamp[0]:
+            return True
+        if current is None or utils.file_hash(path) != stamp[1]:
+            LOG.debug("Template pack index out of date: %s changed", name)
+            return False
+        stamp[0] = current
+        self._index_changed = True
+        return True
+
+    def _indexed_stencil_set(self, stencilset_name, stencil_path):
+        """Return the index entry of a stencil set, indexing it if needed.
+
+        The entry is {'manifest': ..., 'templates': ...} (see StencilSet),
+        or empty if the stencil set cannot be loaded.
+        """
+        name = os.path.relpath(os.path.join(stencil_path, 'manifest.json'),
+                               self.path)
+        sets = self.index['stencil_sets']
+        if (stencilset_name in sets and
+                self._unchanged(sets[stencilset_name][0], name)):
+            entry = marshal.loads(sets[stencilset_name][1])
+        else:
+            stamp = self._stamp(name)
+            try:
+                stencil_set = stencil_module.StencilSet(stencil_path)
+                entry = {
+                    'manifest': stencil_set.manifest,
+                    'templates': stencil_set.template_names(),
+                }
+            except (exc.FastfoodError, ValueError, TypeError, KeyError):
+                # to fail as the stencil set is loaded
+                return {}
+            with self._lock:
+                sets[stencilset_name] = [stamp, marshal.dumps(entry)]
+                self._index_changed = True
+        return entry
+
+    def write_index(self):
+        """Write the index in the pack if it changed, and if possible."""
+        with self._lock:
+            if not self._index_changed or self.index_path is None:
+                return
+            self._index_changed = False
+            data = marshal.dumps(self._index)
+        tmp_path = '%s.%s.%s.tmp' % (self.index_path, os.getpid(),
+                                     threading.current_thread().ident)
+        try:
+            with open(tmp_path, 'wb') as stream:
+                stream.write(data)
+            os.rename(tmp_path, self.index_path)
+        except (IOError, OSError, ValueError) as err:
+            LOG.debug("Could not write template pack index %s: %s",
+                      self.index_path, err)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def changed(self):
+        """Whether the pack changed since its stencil sets were loaded.
+
+        Only the manifests are checked against their index stamps, and the
+        templates of compiled stencil sets against the compiled index: the
+        other templates are reloaded by jinja as they change.
+        """
+        with self._lock:
+            index = self.index
+            if not self._unchanged(index['stamp'], 'manifest.json'):
+                return True
+            for name, stencil_set in self._stencil_sets.items():
+                entry = index['stencil_sets'].get(name)
+                manifest = os.path.join('stencils', name, 'manifest.json')
+                if entry is None or not self._unchanged(entry[0], manifest):
+                    return True
+                if stencil_set.compiled is None:
+                    continue
+                compiled = self.compiled_index['stencil_sets'][name]
+                for template, stamp in compiled['stamps'].items():
+                    if utils.file_stamp(os.path.join(stencil_set.path,
+                                                     template)) != stamp:
+                        return True
+        return False
+
     @property
     def stencil_sets(self):
         """List of stencil sets."""
-        if not self._stencil_sets:
-            self._stencil_sets = self.manifest['stencil_sets']
-        return self._stencil_sets
+        return self.manifest['stencil_sets']
+
+    @property
+    def compiled_index(self):
+        """The index of precompiled templates written by compile().
+
+        Empty if the pack was never compiled, or compiled by a different
+        version of jinja.
+        """
+        with self._lock:
+            if self._compiled_index is None:
+                self._compiled_index = self._read_compiled_index()
+        return self._compiled_index
+
+    def _read_compiled_index(self):
+        """Return the index written by compile(), if usable, else {}."""
+        index_path = os.path.join(self.compiled_path, 'index.json')
+        if not os.path.isfile(index_path):
+            return {}
+        from fastfood import templating
+        with open(index_path) as index:
+            index = json.load(index)
+        if index.get('jinja2') == templating.JINJA_VERSION:
+            return index
+        LOG.warning("Ignoring templates compiled with jinja2 %s, "
+                    "run `fastfood compile` again.", index.get('jinja2'))
+        return {}
+
+    def compile(self, zip_archive=True):
+        """Precompile the templates of every stencil set in this pack.
+
+        Writes one zip archive (or dir, if not 'zip_archive') of compiled
+        templates per stencil set, plus an index of their manifests,
+        template stamps and hashes and the templates each refers to into
+        self.compiled_path. Stencil sets
+        load their templates from there for as long as the stamps, or
+        else the hashes, still match. The manifest index is written too,
+        see write_index().
+
+        Returns the index.
+        """
+        if self.archive:
+            raise ValueError("Cannot compile the template pack in archive %s"
+                             % self.archive.path)
+        from fastfood import templating
+        index = {
+            'api': 1,
+            'jinja2': templating.JINJA_VERSION,
+            'stencil_sets': {},
+        }
+        try:
+            os.makedirs(self.compiled_path)
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+        for name in sorted(self.stencil_sets):
+            stencil_set = self.load_stencil_set(name)
+            names = stencil_set.template_names()
+            target = '%s.zip' % name if zip_archive else name
+            templating.compile_templates(
+                stencil_set.path, os.path.join(self.compiled_path, target),
+                names, zip_archive=zip_archive)
+            stamps = stencil_set.stamps(names)
+            env = templating.get_environment(stencil_set.path)
+            index['stencil_sets'][name] = {
+                'compiled': target,
+                'manifest': stencil_set.manifest,
+                'stamps': stamps,
+                # for checkouts that do not keep mtimes
+                'hashes': {
+                    path: utils.file_hash(os.path.join(stencil_set.path,
+                                                       path))
+                    for path in stamps
+                },
+                'references': {
+                    path: templating.referenced_templates(env, path)
+                    for path in names
+                },
+            }
+
+        index_path = os.path.join(self.compiled_path, 'index.json')
+        with open('%s.tmp' % index_path, 'w') as index_file:
+            json.dump(index, index_file, indent=2, sort_keys=True)
+        os.rename('%s.tmp' % index_path, index_path)
+        self._compiled_index = index
+        self.write_index()
+        return index
+
+    def _compiled_stencil_set(self, stencilset_name, stencil_path):
+        """Return the compiled index entry for a stencil set, if fresh."""
+        entry = self.compiled_index.get('stencil_sets', {}).get(
+            stencilset_name)
+        if not entry:
+            return None
+        hashes = entry.get('hashes') or {}
+        for name, stamp in entry['stamps'].items():
+            path = os.path.join(stencil_path, name)
+            current = utils.file_stamp(path)
+            if current == stamp:
+                continue
+            # same content under a new mtime, e.g. a fresh checkout
+            if (current is not None and hashes.get(name) is not None and
+                    utils.file_hash(path) == hashes[name]):
+                entry['stamps'][name] = current
+                continue
+            LOG.warning("Compiled templates for stencil set '%s' are "
+                        "out of date, run `fastfood compile` again.",
+                        stencilset_name)
+            return None
+        return entry
 
     def __getattr__(self, stencilset_name):
         """Shortcut to self.load_stencil_set()."""
@@ -88,13 +390,74 @@ class TemplatePack(object):
 
     def load_stencil_set(self, stencilset_name):
         """Return the Stencil Set from this template pack."""
-        if stencilset_name not in self._stencil_sets:
-            if stencilset_name not in self.manifest['stencil_sets'].keys():
-                raise exc.FastfoodStencilSetNotListed(
-                    "Stencil set '%s' not listed in %s under stencil_sets."
-                    % (stencilset_name, self.manifest_path))
-            stencil_path = os.path.join(
-                self.path, 'stencils', stencilset_name)
-            self._stencil_sets[stencilset_name] = (
-                stencil_module.StencilSet(stencil_path))
-        return self._stencil_sets[stencilset_name]
+        stencil_set = self._stencil_sets.get(stencilset_name)
+        if stencil_set is None:
+            stencil_set = self._load_stencil_set(stencilset_name)
+        return stencil_set
+
+    def _load_stencil_set(self, stencilset_name):
+        """Load and cache a stencil set."""
+        if stencilset_name not in self.manifest['stencil_sets'].keys():
+            raise exc.FastfoodStencilSetNotListed(
+                "Stencil set '%s' not listed in %s under stencil_sets."
+                % (stencilset_name, self.manifest_path))
+        stencil_path = os.path.join(
+            self.path, 'stencils', stencilset_name)
+        indexed = self._indexed_stencil_set(stencilset_name, stencil_path)
+        compiled = self._compiled_stencil_set(stencilset_name, stencil_path)
+        if compiled:
+            stencil_set = stencil_module.StencilSet(
+                stencil_path,
+                compiled=os.path.join(self.compiled_path,
+                                      compiled['compiled']),
+                manifest=compiled['manifest'],
+                templates=indexed.get('templates'),
+                references=compiled.get('references'))
+        else:
+            stencil_set = stencil_module.StencilSet(
+                stencil_path, manifest=indexed.get('manifest'),
+                templates=indexed.get('templates'))
+        with self._lock:
+            # another thread may have loaded it meanwhile
+            return self._stencil_sets.setdefault(stencilset_name,
+                                                 stencil_set)
+
+    def preload(self, threads=None):
+        """Load every stencil set listed in the manifest, concurrently.
+
+        Stencil sets not loaded yet are looked for, read and validated by
+        'threads' threads (PRELOAD_THREADS by default), which mostly wait
+        on the file system, and cached.
+
+        Returns {stencil set name: error} for those that cannot be
+        loaded, only logged at debug level: load_stencil_set() raises
+        that error again if the set gets used.
+        """
+        from multiprocessing.pool import ThreadPool
+
+        names = [name for name in sorted(self.stencil_sets)
+                 if name not in self._stencil_sets]
+        errors = {}
+        if not names:
+            return errors
+
+        def load(name):
+            try:
+                self._load_stencil_set(name)
+            except (exc.FastfoodError, ValueError, TypeError, KeyError,
+                    IOError, OSError) as err:
+                return name, err
+            return name, None
+
+        with timings.phase('preload'):
+            pool = ThreadPool(min(threads or PRELOAD_THREADS, len(names)))
+            try:
+                for name, err in pool.imap_unordered(load, names):
+                    if err is not None:
+                        LOG.debug("Cannot preload stencil set '%s': %s",
+                                  name, err)
+                        errors[name] = err
+            finally:
+                pool.close()
+                pool.join()
+        return errors
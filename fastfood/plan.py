@@ -0,0 +1,590 @@
+# Copyright 2015 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Fastfood build plan.
+
+A build first plans the final content of every file it touches, then
+applies the plan, writing each file exactly once.
+"""
+
+from __future__ import print_function
+
+import binascii
+import collections
+import errno
+import hashlib
+import logging
+import os
+import shutil
+
+from fastfood import archive
+from fastfood import events
+from fastfood import utils
+
+LOG = logging.getLogger(__name__)
+# how hard BuildPlan.apply() works to get files onto stable storage:
+#   none  - leave it to the OS
+#   batch - fsync the files written, and the dirs holding them, once the
+#           whole build is written
+#   file  - fsync every file as it is written, and the dirs holding them
+DURABILITY = ('none', 'batch', 'file')
+# how binaries get from the template pack into the cookbook:
+#   copy     - a copy, made in the kernel where possible
+#   reflink  - a copy-on-write clone, or a copy if the fs cannot clone
+#   hardlink - a hard link, or a copy across filesystems
+#   symlink  - a symbolic link to the binary in the template pack
+BINARY_STRATEGIES = ('copy', 'reflink', 'hardlink', 'symlink')
+# python 2 has no atomic rename-over on windows
+_replace = getattr(os, 'replace', os.rename)  # pylint: disable=invalid-name
+# linux ioctl cloning a whole file, see ioctl_ficlone(2)
+FICLONE = 0x40049409
+# errors meaning the kernel cannot copy between these files
+_NO_KERNEL_COPY = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EBADF,
+                   errno.EOPNOTSUPP)
+
+
+def _read(path):
+    """Return the text content of the file at path."""
+    with open(path) as stream:
+        return stream.read()
+
+
+def _makedirs_for(path):
+    """Create the parent dir of path, if needed."""
+    needdir = os.path.dirname(path)
+    assert needdir, "Target should have valid parent dir"
+    try:
+        os.makedirs(needdir)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+
+
+def _temp_file(path):
+    """Create a temp file next to path, returning (fd, temp path).
+
+    Unlike tempfile.mkstemp(), the file gets the mode (umask) of any new
+    file, for it to be renamed over path.
+    """
+    dirname, basename = os.path.split(path)
+    while True:
+        temp = os.path.join(dirname, '.%s.%s' % (
+            basename, binascii.hexlify(os.urandom(4)).decode('ascii')))
+        try:
+            return os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                           0o666), temp
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+
+
+def _unlink_shared(path):
+    """Remove path if it is a link, so writing it leaves the target alone."""
+    try:
+        if os.path.islink(path) or os.stat(path).st_nlink > 1:
+            os.unlink(path)
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+
+
+def _copy_range(src, dst, size):
+    """Copy size bytes between file objects without going through python.
+
+    Uses copy_file_range(2) or sendfile(2) if available, else a plain copy.
+    """
+    for name in ('copy_file_range', 'sendfile'):
+        kernel_copy = getattr(os, name, None)
+        if kernel_copy is None:
+            continue
+        copied = 0
+        try:
+            while copied < size:
+                if name == 'sendfile':
+                    sent = kernel_copy(dst.fileno(), src.fileno(), copied,
+                                       size - copied)
+                else:
+                    sent = kernel_copy(src.fileno(), dst.fileno(),
+                                       size - copied, copied, copied)
+                if not sent:
+                    break
+                copied += sent
+        except OSError as err:
+            if copied or err.errno not in _NO_KERNEL_COPY:
+                raise
+            continue
+        if copied == size:
+            return
+        break
+    src.seek(0)
+    dst.seek(0)
+    dst.truncate()
+    shutil.copyfileobj(src, dst)
+
+
+def _copy_binary(source, dest, reflink=False):
+    """Copy the file at source to dest, keeping its mode."""
+    with open(source, 'rb') as src, open(dest, 'wb') as dst:
+        cloned = False
+        if reflink:
+            try:
+                import fcntl
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                cloned = True
+            except (ImportError, IOError, OSError) as err:
+                LOG.debug("Cannot reflink %s, copying it: %s", source, err)
+        if not cloned:
+            _copy_range(src, dst, os.fstat(src.fileno()).st_size)
+    shutil.copymode(source, dest)
+
+
+def _install_binary(source, dest, strategy):
+    """Install the binary at source as dest, see BINARY_STRATEGIES."""
+    located = archive.locate(source)
+    if located is not None:
+        # nothing to link or clone in an archive, stream the member out
+        with open(dest, 'wb') as dst:
+            located[0].copy(located[1], dst)
+        os.chmod(dest, archive.getmode(source))
+        return
+    if strategy in ('hardlink', 'symlink'):
+        _unlink_shared(dest)
+        if os.path.exists(dest):
+            os.unlink(dest)
+        try:
+            if strategy == 'hardlink':
+                os.link(source, dest)
+            else:
+                os.symlink(os.path.abspath(source), dest)
+            return
+        except (AttributeError, NotImplementedError, OSError) as err:
+            LOG.debug("Cannot %s %s, copying it: %s", strategy, source, err)
+    _copy_binary(source, dest, reflink=strategy == 'reflink')
+
+
+def _fsync(path):
+    """Flush the file or dir at path to stable storage."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        # e.g. dirs cannot be opened on windows
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _sync(paths):
+    """Flush the files at paths, then the dirs holding them, to storage.
+
+    Links are left out: syncing them would sync the template pack.
+    """
+    for path in paths:
+        if not os.path.islink(path):
+            _fsync(path)
+    for dirname in sorted({os.path.dirname(path) for path in paths}):
+        _fsync(dirname)
+
+
+class PlannedFile(object):
+
+    """A file touched by the build.
+
+    Its content is a list of parts, written one after the other:
+
+        ('text', content)
+        ('template', template path, jinja env, template map)
+
+    Template parts are rendered as they are written, unless the content
+    is read (see BuildPlan.read()) before that. A binary file is copied
+    from 'binary' instead.
+    """
+
+    def __init__(self, path, binary_strategy='copy'):
+        """Initialize, as unchanged, the planned file at 'path'."""
+        self.path = path
+        self.binary_strategy = binary_strategy
+        self.existed = os.path.isfile(path)
+        # whether a stencil writes this file, rather than only merging
+        # into it through a wrapper
+        self.planned = False
+        self.parts = []
+        self.binary = None
+        # utils.FileWrapper holding the content, see BuildPlan.wrap()
+        self.wrapper = None
+        # content on disk, if it was read
+        self.original = None
+        # (binary, whether the file already holds it)
+        self._same_binary = None
+        # temp file next to path holding the streamed templates rendered
+        # by identical(), so write() does not render them again
+        self._rendered = None
+
+    def __repr__(self):
+        """Canonical string representation of the planned file."""
+        return '<%s %s [%s]>' % (type(self).__name__, self.path,
+                                 self.action)
+
+    @property
+    def changed(self):
+        """Whether applying the plan would change this file."""
+        if self.binary is not None and self.existed:
+            return not self._holds_binary()
+        if self.planned:
+            return True
+        if self.wrapper is not None:
+            current = self.wrapper.stream.getvalue()
+        elif self.parts:
+            # only text parts, flushed from a wrapper
+            current = ''.join(part[1] for part in self.parts)
+        else:
+            return False
+        return current != self.original
+
+    @property
+    def action(self):
+        """A word describing what applying the plan does to this file."""
+        if not self.changed:
+            return 'unchanged'
+        if not self.existed:
+            return 'create'
+        if self.planned:
+            return 'overwrite'
+        return 'update'
+
+    def _holds_binary(self):
+        """Whether the file on disk is the same size and hash as binary."""
+        if self._same_binary is None or self._same_binary[0] != self.binary:
+            same = (utils.file_stamp(self.path) is not None and
+                    os.path.getsize(self.path) ==
+                    archive.getsize(self.binary) and
+                    utils.file_hash(self.path) ==
+                    utils.file_hash(self.binary))
+            self._same_binary = (self.binary, same)
+        return self._same_binary[1]
+
+    def identical(self):
+        """Whether the file on disk already holds the planned content.
+
+        Sizes are compared first, the content is only hashed if they match.
+        Streamed templates are rendered to a temp file while hashed, kept
+        for write() unless identical, see discard().
+        """
+        if not self.existed or os.path.islink(self.path):
+            return False
+        if self.binary is not None:
+            return self._holds_binary()
+        self.flush()
+        size = os.path.getsize(self.path)
+        if all(part[0] == 'text' for part in self.parts):
+            content = ''.join(part[1] for part in self.parts).encode('utf-8')
+            if len(content) != size:
+                return False
+            return hashlib.sha1(content).hexdigest() == utils.file_hash(
+                self.path)
+        # streamed templates: render them once, next to the file, hashing
+        # as they are written; write() then moves that file into place
+        self.discard()
+        digest = hashlib.sha1()
+        length = 0
+        handle, self._rendered = _temp_file(self.path)
+        try:
+            with os.fdopen(handle, 'w') as newfile:
+                for chunk in self._chunks():
+                    newfile.write(chunk)
+                    chunk = chunk.encode('utf-8')
+                    length += len(chunk)
+                    digest.update(chunk)
+        except Exception:
+            self.discard()
+            raise
+        if (length == size and
+                digest.hexdigest() == utils.file_hash(self.path)):
+            self.discard()
+            return True
+        return False
+
+    def discard(self):
+        """Remove the content rendered by identical(), if not written."""
+        if self._rendered is not None:
+            try:
+                os.unlink(self._rendered)
+            except OSError as err:
+                if err.errno != errno.ENOENT:
+                    raise
+            self._rendered = None
+
+    def flush(self):
+        """Turn the wrapper, if any, back into a text part."""
+        if self.wrapper is not None:
+            self.parts = [('text', self.wrapper.stream.getvalue())]
+            self.wrapper = None
+
+    def render(self):
+        """Return the whole text content, rendering any templates.
+
+        Afterwards the content is held as a single text part.
+        """
+        self.flush()
+        if self.binary is not None:
+            with archive.open_file(self.binary) as stream:
+                return stream.read()
+        if not self.parts and self.existed:
+            if self.original is None:
+                self.original = _read(self.path)
+            return self.original
+        content = ''.join(self._chunks())
+        self.parts = [('text', content)]
+        return content
+
+    def _chunks(self):
+        """Yield the text content chunk by chunk."""
+        from fastfood import templating
+        for part in self.parts:
+            if part[0] == 'text':
+                yield part[1]
+            else:
+                _, tpl_path, env, template_map = part
+                for chunk in templating.stream_file(tpl_path, template_map,
+                                                    env=env):
+                    yield chunk
+
+    def write(self, dest=None, fsync=False):
+        """Write the planned content to disk.
+
+        Writes to self.path, unless staged at 'dest' to be renamed later.
+        """
+        dest = dest or self.path
+        report = events.enabled()
+        if report:
+            action, start = self.action, events.clock()
+        _makedirs_for(dest)
+        # never write through a link into the template pack
+        _unlink_shared(dest)
+
+        print("Writing rendered file %s" % self.path)
+        LOG.info("Writing rendered file %s", self.path)
+        if self.binary is not None:
+            _install_binary(self.binary, dest, self.binary_strategy)
+        else:
+            self.flush()
+            if (self._rendered is None and dest == self.path and
+                    any(part[0] == 'template' for part in self.parts)):
+                # a template failing half way must not truncate the target:
+                # render next to it, to be renamed into place
+                handle, self._rendered = _temp_file(dest)
+                with os.fdopen(handle, 'w') as newfile:
+                    for chunk in self._chunks():
+                        newfile.write(chunk)
+            if self._rendered is not None:
+                # rendered by identical(), or just above
+                if os.path.isfile(self.path):
+                    shutil.copymode(self.path, self._rendered)
+                _replace(self._rendered, dest)
+                self._rendered = None
+            else:
+                with open(dest, 'w') as newfile:
+                    for chunk in self._chunks():
+                        newfile.write(chunk)
+                if dest != self.path and os.path.isfile(self.path):
+                    # keep the mode of the file being replaced
+                    shutil.copymode(self.path, dest)
+        if fsync and not os.path.islink(dest):
+            _fsync(dest)
+        if report:
+            events.emit('file_written', path=self.path, action=action,
+                        bytes=os.lstat(dest).st_size,
+                        seconds=events.clock() - start)
+
+
+class BuildPlan(object):
+
+    """The files a build will write, in the order they were planned."""
+
+    def __init__(self, binaries='copy'):
+        """Initialize an empty plan.
+
+        'binaries' is how binaries are installed, see BINARY_STRATEGIES.
+        """
+        if binaries not in BINARY_STRATEGIES:
+            raise ValueError("Binaries strategy should be one of %s, not %s"
+                             % (", ".join(BINARY_STRATEGIES), binaries))
+        self.binaries = binaries
+        self.files = collections.OrderedDict()
+        # what apply() did (or show() would do) with the files
+        self.written = []
+        self.unchanged = []
+        self.skipped = []
+
+    def __repr__(self):
+        """Canonical string representation of the plan."""
+        return '<%s (%d files)>' % (type(self).__name__, len(self.files))
+
+    def _get(self, path):
+        """Return the PlannedFile for path, adding it if needed."""
+        if path not in self.files:
+            self.files[path] = PlannedFile(path, self.binaries)
+        return self.files[path]
+
+    def exists(self, path):
+        """Whether the file at path will exist once the plan is applied."""
+        planned = self.files.get(path)
+        if planned is not None:
+            return planned.existed or planned.planned
+        return os.path.isfile(path)
+
+    def changed_paths(self):
+        """Return the set of paths that applying the plan would change."""
+        return {path for path, planned in self.files.items()
+                if planned.changed}
+
+    def skip(self, path):
+        """Note that the build left the existing file at path alone."""
+        if path not in self.skipped:
+            self.skipped.append(path)
+            events.emit('file_skipped', path=path, reason='exists')
+
+    def write(self, path, part):
+        """Plan to (over)write the file at path with a content part."""
+        planned = self._get(path)
+        if planned.changed:
+            LOG.info("Replacing content planned for %s", path)
+        planned.planned = True
+        planned.wrapper = None
+        planned.binary = None
+        planned.parts = [part]
+
+    def append(self, path, part):
+        """Plan to append a content part to the file at path."""
+        planned = self._get(path)
+        if not planned.parts:
+            # start from the current content (on disk, or binary)
+            content = planned.render() if self.exists(path) else ''
+            planned.parts = [('text', content)]
+            planned.binary = None
+        planned.flush()
+        planned.planned = True
+        planned.parts.append(part)
+
+    def copy(self, path, source):
+        """Plan to copy the binary file 'source' to path."""
+        planned = self._get(path)
+        planned.planned = True
+        planned.wrapper = None
+        planned.parts = []
+        planned.binary = source
+
+    def read(self, path):
+        """Return the text content planned for the file at path."""
+        if path not in self.files and not os.path.isfile(path):
+            raise ValueError("File %s does not exist" % path)
+        return self._get(path).render()
+
+    def wrap(self, path, wrapper_cls):
+        """Return a utils.FileWrapper of 'wrapper_cls' for path.
+
+        Changes made through the wrapper are part of the plan.
+        """
+        planned = self._get(path)
+        if not isinstance(planned.wrapper, wrapper_cls):
+            content = self.read(path)
+            planned.wrapper = wrapper_cls.from_string(content)
+            planned.parts = []
+        return planned.wrapper
+
+    def apply(self, stage_dir=None, durability='none'):
+        """Write every changed file, once. Returns the paths written.
+
+        With a 'stage_dir' (on the same filesystem as the files), files
+        are written there first and then renamed into place, so no file
+        is ever left half-written. 'durability' is one of DURABILITY.
+        """
+        if durability not in DURABILITY:
+            raise ValueError("Durability should be one of %s, not %s"
+                             % (", ".join(DURABILITY), durability))
+        changed = self._pending()
+        fsync = durability == 'file'
+
+        try:
+            if stage_dir is None:
+                for planned in changed:
+                    planned.write(fsync=fsync)
+                written = [planned.path for planned in changed]
+                if fsync:
+                    # the new dir entries, as the staged renames below
+                    for dirname in sorted({os.path.dirname(path)
+                                           for path in written}):
+                        _fsync(dirname)
+            else:
+                staged = []
+                for index, planned in enumerate(changed):
+                    staged_path = os.path.join(stage_dir, str(index))
+                    planned.write(dest=staged_path, fsync=fsync)
+                    staged.append(staged_path)
+                written = []
+                for staged_path, planned in zip(staged, changed):
+                    _makedirs_for(planned.path)
+                    _replace(staged_path, planned.path)
+                    written.append(planned.path)
+                    if fsync:
+                        _fsync(os.path.dirname(planned.path))
+        finally:
+            # left rendered if writing failed half way
+            for planned in changed:
+                planned.discard()
+
+        if durability == 'batch':
+            # the new content and dir entries of every file, in one pass
+            _sync(written)
+        self.written = written
+        return written
+
+    def _pending(self):
+        """Return the files applying the plan would write.
+
+        Planned files already holding their content on disk are left out,
+        and counted as unchanged.
+        """
+        pending = []
+        self.unchanged = []
+        for path, planned in self.files.items():
+            if planned.changed and not planned.identical():
+                pending.append(planned)
+            elif planned.planned:
+                self.unchanged.append(path)
+                events.emit('file_skipped', path=path, reason='unchanged')
+        written = {planned.path for planned in pending}
+        self.skipped = [path for path in self.skipped
+                        if path not in written and path not in self.unchanged]
+        return pending
+
+    def show(self):
+        """Print what applying the plan would do, without writing.
+
+        Returns the paths that would be written.
+        """
+        self.written = []
+        for planned in self._pending():
+            planned.discard()
+            print("Would %s %s" % (planned.action, planned.path))
+            self.written.append(planned.path)
+        return self.written
+
+    def summary(self):
+        """Return a 'N written, N unchanged, N skipped' summary."""
+        return "%d written, %d unchanged, %d skipped" % (
+            len(self.written), len(self.unchanged), len(self.skipped))
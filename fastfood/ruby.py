@@ -0,0 +1,538 @@
+# Copyright 2015 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Ruby DSL files, like metadata.rb and Berksfile.
+
+tokenize() splits ruby source into tokens in a single pass, and parse()
+groups them into statements. Nothing is lost on the way: the text of a
+Document is exactly the text it was parsed from, so statements can be
+added to a file without touching the formatting of the rest of it.
+
+This is not a ruby parser. It knows enough to tell the statements of
+these files apart (however many lines they span, with whatever comments
+and heredocs) and to read the arguments of simple method calls:
+
+    cookbook 'elasticsearch', '~> 0.3', git: 'git@github.com:...'
+    depends 'apt', '>= 2.0'  # comment
+
+A block (do ... end, or if, def, begin and the like up to their end) is
+part of the statement opening it, see Statement.block. The arguments
+stop at the block, or at a trailing modifier: those of
+
+    depends 'apt' if windows?
+
+are (['apt'], {}), whatever the condition. A heredoc argument is given
+by its body.
+
+Most statements fit on a line, so parse() only tokenizes the lines that
+might not; the tokens of a statement are otherwise only made when its
+arguments are read.
+"""
+
+import re
+import textwrap
+
+from fastfood import exc
+
+# kinds of tokens, most common first; a name followed by a colon is a
+# 'label' (the last group to match), block comments are only looked for
+# at the start of a line, and a quoted string ends on its line
+TOKEN_RE = re.compile(r"""
+    (?P<space>(?:[ \t\f]|\\\r?\n)+)
+  | (?P<name>[@$]{0,2}[A-Za-z_]\w*[?!]?)(?P<label>:(?!:))?
+  | (?P<string>'(?:[^'\\\n]|\\.)*'|"(?:[^"\\\n]|\\.)*"
+      |%[qQwWiI]?(?:\((?:[^()\\]|\\.)*\)|\[(?:[^\[\]\\]|\\.)*\]
+                  |\{(?:[^{}\\]|\\.)*\}|<(?:[^<>\\]|\\.)*>))
+  | (?P<unterminated>['"])
+  | (?P<newline>\r?\n)
+  | (?P<comment>\#[^\n]*)
+  | (?P<heredoc><<[-~]?(?P<quote>['"]?)(?P<tag>[A-Za-z_]\w*)(?P=quote))
+  | (?P<symbol>:(?:[A-Za-z_]\w*[?!=]?|'(?:[^'\\\n]|\\.)*'|"(?:[^"\\\n]|\\.)*"))
+  | (?P<op>=>|::|\*\*|&&|\|\||<=>|[<>=!]=|[-+*/%<>=!&|^~?:.,;()\[\]{}])
+  | (?P<number>\d[\d_]*(?:\.\d[\d_]*)?)
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+# a regexp literal, where a '/' opens one, see _opens_regexp()
+REGEXP_RE = re.compile(r'(?P<regexp>/(?:[^/\\\n]|\\.)*/[a-z]*)')
+DOC_RE = re.compile(r'=begin\b.*?(?:^=end\b[^\n]*|\Z)',
+                    re.MULTILINE | re.DOTALL)
+# a line that cannot go on past its end: no brackets, heredocs, percent
+# literals, escapes or multi-line strings, no block opened, and no code
+# ending with what might be one of CONTINUING (the code ends with a run
+# of characters or a string, each run being as long as it gets)
+PLAIN_LINE_RE = re.compile(r"""
+    (?!=begin|[ \t\f]*(?:(?:begin|case|class|def|for|if|module|unless
+                             |until|while)\b(?!:)
+                          |[@$]{0,2}\w+\b[ \t]*=[ \t]*
+                           (?:begin|case|if|unless|until|while)\b))
+    (?:[ \t\r\f]*
+      (?:[^\s'"\#(\[{<%\\]+(?![^\s'"\#(\[{<%\\])
+        |<(?!<)|'[^'\\\n]*'|"[^"\\\n]*"))*
+    (?<![,>.&|+*/=-])(?<!\bdo)
+    [ \t\r\f]*
+    (?:\#[^\n]*)?
+    (?:\n|\Z)
+""", re.VERBOSE)
+KEYWORD_RE = re.compile(r'[ \t\f]*([@$]{0,2}[A-Za-z_]\w*[?!]?)'
+                        r'(:(?!:)|[ \t]*=(?![=~>]))?')
+# the most common statements, whose arguments are read without tokens:
+# keyword 'string', "string", :symbol, label: 'string'  # comment
+_SIMPLE_VALUE = r"""(?:'[^'\\\n]*'|"[^"\\\n\#]*"|:[A-Za-z_]\w*)"""
+_SIMPLE_ARGUMENT = r'(?:[A-Za-z_]\w*:[ \t]*)?' + _SIMPLE_VALUE
+SIMPLE_RE = re.compile(
+    r'[ \t]*[A-Za-z_]\w*[ \t]+(%s(?:[ \t]*,[ \t]*%s)*)'
+    r'[ \t]*(?:\#[^\n]*)?\r?\n?\Z' % (_SIMPLE_ARGUMENT, _SIMPLE_ARGUMENT))
+SIMPLE_ARGUMENT_RE = re.compile(r'(?:([A-Za-z_]\w*):[ \t]*)?(%s)'
+                                % _SIMPLE_VALUE)
+# tokens that are not part of what a statement says
+TRIVIA = frozenset(('space', 'newline', 'comment', 'doc', 'heredoc_body'))
+OPENING = frozenset('([{')
+CLOSING = frozenset(')]}')
+# a line ending with one of these goes on, on the next line (a '/' there
+# divides, see _opens_regexp())
+CONTINUING = frozenset((',', '=>', '.', '&&', '||', '+', '-', '*', '/',
+                        '='))
+_ESCAPES = {'n': '\n', 't': '\t', 's': ' ', '0': '\0', 'e': '\x1b'}
+# ruby keywords, never the method a statement calls
+KEYWORDS = frozenset((
+    'BEGIN', 'END', 'alias', 'and', 'begin', 'break', 'case', 'class',
+    'def', 'defined?', 'do', 'else', 'elsif', 'end', 'ensure', 'false',
+    'for', 'if', 'in', 'module', 'next', 'nil', 'not', 'or', 'redo',
+    'rescue', 'retry', 'return', 'self', 'super', 'then', 'true', 'undef',
+    'unless', 'until', 'when', 'while', 'yield'))
+# keywords standing for a value, which a '/' after divides
+VALUE_KEYWORDS = frozenset(('end', 'false', 'nil', 'self', 'true'))
+# keywords opening a block up to its 'end' where an expression starts;
+# 'do' always does, but only once after those starting a loop
+OPENERS = frozenset(('begin', 'case', 'class', 'def', 'for', 'if',
+                     'module', 'unless', 'until', 'while'))
+LOOPS = frozenset(('for', 'until', 'while'))
+# keywords ending the arguments of a statement they come after
+MODIFIERS = frozenset(('if', 'unless', 'until', 'while', 'rescue'))
+
+
+def tokenize(text, pos=0):
+    """Yield the (kind, text) tokens of ruby source 'text', from 'pos'.
+
+    Their texts, put back together, are 'text'. Kinds are those of
+    TOKEN_RE and REGEXP_RE, plus 'doc' (an =begin/=end block comment) and
+    'heredoc_body', the lines of a heredoc up to and including its
+    terminator: one per heredoc opened on a line, in order, right after
+    the newline ending that line.
+
+    Raises exc.FastfoodRubySyntaxError on a quoted string not closed on
+    its line, rather than reading the rest of the text as that string.
+    """
+    end = len(text)
+    # heredocs opened on the current line: [(tag, indented), ...]
+    heredocs = []
+    line_start = pos == 0 or text[pos - 1] == '\n'
+    # the last token saying something on this line, and whether space
+    # came after it, see _opens_regexp()
+    previous = None
+    spaced = False
+    while pos < end:
+        match = line_start and DOC_RE.match(text, pos)
+        if not match:
+            match = TOKEN_RE.match(text, pos)
+            if match.group() == '/' and _opens_regexp(
+                    previous, spaced, text[pos + 1:pos + 2]):
+                match = REGEXP_RE.match(text, pos) or match
+        kind = match.lastgroup or 'doc'
+        if kind == 'unterminated':
+            raise exc.FastfoodRubySyntaxError(
+                "Unterminated string on line %d"
+                % (text.count('\n', 0, pos) + 1))
+        yield kind, match.group()
+        pos = match.end()
+        line_start = kind == 'newline'
+        if kind == 'space':
+            spaced = True
+        elif kind not in TRIVIA:
+            previous = (kind, match.group())
+            spaced = False
+        elif line_start:
+            previous = None
+        if kind == 'heredoc':
+            heredocs.append((match.group('tag'), match.group()[2] in '-~'))
+        elif line_start and heredocs:
+            for tag, indented in heredocs:
+                terminator = re.compile(
+                    r'^%s%s[ \t]*(?:\r?\n|\Z)'
+                    % ('[ \t]*' if indented else '', re.escape(tag)),
+                    re.MULTILINE)
+                found = terminator.search(text, pos)
+                start, pos = pos, found.end() if found else end
+                yield 'heredoc_body', text[start:pos]
+            heredocs = []
+
+
+def _opens_regexp(previous, spaced, following):
+    """Whether a '/' after the token 'previous' opens a regexp literal.
+
+    It does where an operand is expected: first on a line, after an
+    operator, a label or a keyword, and after a method name and a space
+    when no space follows, as ruby reads `foo /re/`. Otherwise it
+    divides; 'following' is the character after the '/'.
+    """
+    if previous is None:
+        return True
+    kind, text = previous
+    if kind == 'op':
+        return text not in CLOSING
+    if kind == 'label':
+        return True
+    if kind == 'name':
+        if text in KEYWORDS:
+            return text not in VALUE_KEYWORDS
+        return spaced and following not in ('', ' ', '\t', '\r', '\n', '=')
+    return False
+
+
+class Statement(object):
+
+    """A statement, or a blank or comment line.
+
+    Its text includes the indentation before it, any comment after it
+    and the newline ending it.
+    """
+
+    __slots__ = ('text', '_tokens')
+
+    def __init__(self, text, tokens=None):
+        """Initialize with its text, and its tokens if already known."""
+        self.text = text
+        self._tokens = tokens
+
+    def __repr__(self):
+        """Canonical string representation of the statement."""
+        return '<%s %r>' % (type(self).__name__, self.text)
+
+    @property
+    def tokens(self):
+        """The (kind, text) tokens of the statement, see tokenize()."""
+        if self._tokens is None:
+            self._tokens = list(tokenize(self.text))
+        return self._tokens
+
+    @property
+    def indented(self):
+        """Whether the statement starts after some whitespace."""
+        return self.text[:1] in (' ', '\t', '\f')
+
+    @property
+    def keyword(self):
+        """The method (or variable) the statement starts with, if any.
+
+        None for assignments and ruby keywords.
+        """
+        match = KEYWORD_RE.match(self.text)
+        if match is None or match.group(2) or match.group(1) in KEYWORDS:
+            return None
+        return match.group(1)
+
+    @property
+    def block(self):
+        """The statements of the do ... end block it ends with, or None.
+
+        As a Document, from the line after 'do' to the one before 'end'.
+        """
+        offset = 0
+        opened = False
+        start = stop = None
+        depth = 0
+        previous = None
+        for kind, text in self.tokens:
+            if kind == 'op' and text in OPENING:
+                depth += 1
+            elif kind == 'op' and text in CLOSING:
+                depth = max(depth - 1, 0)
+            elif (kind == 'name' and not depth and
+                    previous != ('op', '.')):
+                if text == 'do':
+                    opened = True
+                elif text == 'end' and start is not None:
+                    stop = offset
+            elif kind == 'newline' and opened and start is None:
+                start = offset + len(text)
+            if kind not in TRIVIA:
+                previous = (kind, text)
+            offset += len(text)
+        if start is None or stop is None:
+            return None
+        stop = self.text.rfind('\n', start, stop) + 1
+        return parse(self.text[start:max(start, stop)])
+
+    def _argument_tokens(self):
+        """Return the tokens after the keyword, trailing trivia excepted.
+
+        They stop at a block, or at a trailing modifier.
+        """
+        tokens = [token for token in self.tokens
+                  if token[0] not in ('comment', 'doc', 'heredoc_body')]
+        start = 0
+        while start < len(tokens) and tokens[start][0] in TRIVIA:
+            start += 1
+        stop = len(tokens)
+        depth = 0
+        for index in range(start + 2, stop):
+            kind, text = tokens[index]
+            if kind == 'op' and text in OPENING:
+                depth += 1
+            elif kind == 'op' and text in CLOSING:
+                depth = max(depth - 1, 0)
+            elif (kind == 'name' and not depth and
+                    (text == 'do' or text in MODIFIERS) and
+                    tokens[index - 1] != ('op', '.')):
+                stop = index
+                break
+        while stop > start and tokens[stop - 1][0] in TRIVIA:
+            stop -= 1
+        return tokens[start + 1:stop]
+
+    def argument_text(self):
+        """Return the source text of the arguments, comments left out."""
+        match = SIMPLE_RE.match(self.text)
+        if match is not None:
+            return match.group(1)
+        return ''.join(token[1] for token in self._argument_tokens()).strip()
+
+    def arguments(self):
+        """Return the arguments, as ([value, ...], {option: value}).
+
+        Strings, symbols and heredocs are given by their value, anything
+        else by its source text. Options are the 'key: value' and
+        'key => value' pairs of a trailing hash.
+        """
+        match = SIMPLE_RE.match(self.text)
+        if match is not None:
+            positional = []
+            options = {}
+            for label, value in SIMPLE_ARGUMENT_RE.findall(match.group(1)):
+                value = unquote(value[1:] if value[0] == ':' else value)
+                if label:
+                    options[label] = value
+                else:
+                    positional.append(value)
+            return positional, options
+
+        # heredocs get their body as a third item, see _value()
+        bodies = iter([text for kind, text in self.tokens
+                       if kind == 'heredoc_body'])
+        tokens = [token + (next(bodies, ''),) if token[0] == 'heredoc'
+                  else token for token in self._argument_tokens()]
+        if tokens and tokens[0][0] == 'space':
+            tokens = tokens[1:]
+        if (tokens and tokens[0] == ('op', '(') and
+                _closing(tokens, 0) == len(tokens) - 1):
+            tokens = tokens[1:-1]
+        positional = []
+        options = {}
+        for argument in _split_arguments(tokens):
+            words = [index for index, token in enumerate(argument)
+                     if token[0] not in TRIVIA]
+            if not words:
+                continue
+            first = argument[words[0]]
+            if len(words) > 1 and first[0] == 'label':
+                options[first[1][:-1]] = _value(argument[words[0] + 1:])
+            elif len(words) > 2 and argument[words[1]] == ('op', '=>'):
+                options[_value([first])] = _value(argument[words[1] + 1:])
+            else:
+                positional.append(_value(argument))
+        return positional, options
+
+
+def _closing(tokens, start):
+    """Return the index of the bracket closing tokens[start], or None."""
+    depth = 0
+    for index in range(start, len(tokens)):
+        kind, text = tokens[index]
+        if kind != 'op':
+            continue
+        if text in OPENING:
+            depth += 1
+        elif text in CLOSING:
+            depth -= 1
+            if not depth:
+                return index
+    return None
+
+
+def _split_arguments(tokens):
+    """Split tokens on the commas between arguments."""
+    arguments = []
+    current = []
+    depth = 0
+    for token in tokens:
+        if token[0] == 'op':
+            text = token[1]
+            if text in OPENING:
+                depth += 1
+            elif text in CLOSING:
+                depth = max(depth - 1, 0)
+            elif text == ',' and not depth:
+                arguments.append(current)
+                current = []
+                continue
+        current.append(token)
+    arguments.append(current)
+    return arguments
+
+
+def _value(tokens):
+    """Return the value of a string, symbol or heredoc, or the source text.
+
+    A heredoc token is followed by its body, see Statement.arguments().
+    """
+    words = [token for token in tokens if token[0] not in TRIVIA]
+    if len(words) == 1:
+        kind, text = words[0][:2]
+        if kind == 'string':
+            return unquote(text)
+        if kind == 'symbol':
+            return unquote(text[1:])
+        if kind == 'heredoc':
+            return _heredoc_value(text, words[0][2])
+    return ''.join(token[1] for token in tokens).strip()
+
+
+def _heredoc_value(opener, body):
+    """Return the value of the heredoc 'opener' (<<-EOS...) from its body.
+
+    Interpolations and escapes are left as they are.
+    """
+    tag = TOKEN_RE.match(opener).group('tag')
+    lines = body.splitlines(True)
+    if lines and lines[-1].strip() == tag:
+        lines.pop()
+    if opener[2:3] == '~':
+        return textwrap.dedent(''.join(lines))
+    return ''.join(lines)
+
+
+def unquote(text):
+    """Return the value of the ruby string literal 'text'.
+
+    Interpolations are left as they are.
+    """
+    if text[:1] == "'":
+        if '\\' not in text:
+            return text[1:-1]
+        return re.sub(r"\\([\\'])", r'\1', text[1:-1])
+    if text[:1] == '"':
+        if '\\' not in text:
+            return text[1:-1]
+        return re.sub(r'\\(.)', lambda match: _ESCAPES.get(
+            match.group(1), match.group(1)), text[1:-1], flags=re.DOTALL)
+    if text[:1] == '%':
+        return text[3:-1] if text[1].isalpha() else text[2:-1]
+    return text
+
+
+class Document(object):
+
+    """The statements of a ruby file, in order."""
+
+    def __init__(self, statements):
+        """Initialize with a list of Statement."""
+        self.statements = statements
+
+    def __iter__(self):
+        """Iterate over the statements."""
+        return iter(self.statements)
+
+    def __len__(self):
+        """Return the number of statements."""
+        return len(self.statements)
+
+    @property
+    def text(self):
+        """The source text of the file."""
+        return ''.join(statement.text for statement in self.statements)
+
+
+def parse(text):
+    """Parse ruby source 'text' into a Document.
+
+    A statement goes on past the end of its line inside brackets and
+    blocks, after a line ending with one of CONTINUING, and over the
+    heredocs it opens.
+    """
+    statements = []
+    pos = 0
+    end = len(text)
+    plain_line = PLAIN_LINE_RE.match
+    while pos < end:
+        match = plain_line(text, pos)
+        if match is not None:
+            statements.append(Statement(match.group()))
+            pos = match.end()
+            continue
+        tokens = _statement_tokens(text, pos)
+        length = sum(len(token[1]) for token in tokens)
+        statements.append(Statement(text[pos:pos + length], tokens))
+        pos += length
+    return Document(statements)
+
+
+def _statement_tokens(text, pos):
+    """Return the tokens of the statement starting at 'pos' in text."""
+    tokens = []
+    depth = 0
+    # blocks opened and not ended yet
+    blocks = 0
+    # the last token saying something, to tell whether the line goes on
+    last = None
+    # whether an expression starts at the next token
+    starting = True
+    # whether a loop opened on this line, its 'do' opening nothing more
+    loop = False
+    # heredoc bodies coming after the next newline
+    heredocs = 0
+    complete = False
+    for token in tokenize(text, pos):
+        kind, value = token
+        tokens.append(token)
+        if kind == 'newline':
+            complete = not depth and not blocks and (
+                last is None or last[0] != 'op' or
+                last[1] not in CONTINUING)
+            if complete and not heredocs:
+                break
+            starting = True
+            loop = False
+        elif kind == 'heredoc_body':
+            heredocs -= 1
+            if complete and not heredocs:
+                break
+        elif kind not in TRIVIA:
+            if kind == 'heredoc':
+                heredocs += 1
+            elif kind == 'name' and last != ('op', '.'):
+                if value == 'end':
+                    blocks = max(blocks - 1, 0)
+                elif value == 'do' and loop:
+                    loop = False
+                elif value == 'do' or (starting and value in OPENERS):
+                    blocks += 1
+                    loop = value in LOOPS
+            elif kind == 'op':
+                if value in OPENING:
+                    depth += 1
+                elif value in CLOSING:
+                    depth = max(depth - 1, 0)
+            starting = kind == 'op' and value not in CLOSING
+            last = token
+    return tokens
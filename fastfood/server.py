@@ -0,0 +1,400 @@
+# Copyright 2015 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Fastfood daemon.
+
+`fastfood serve` keeps template packs (manifests, stencil sets and
+compiled templates) loaded, and runs the commands it receives on a local
+Unix socket, each in a process of its own. call() is the client side: it
+hands a command line over to a running daemon and reports its output.
+
+Requests and responses are a single line of JSON each. A request
+carries the client's fastfood version: a daemon of another version runs
+nothing, and stops, so the client runs the command itself. Otherwise the
+daemon acknowledges the request right away, and sends the command's
+output once it ran.
+"""
+
+from __future__ import print_function
+
+import errno
+import json
+import logging
+import os
+import socket
+import sys
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    # Python 3
+    from io import StringIO
+
+import fastfood
+from fastfood import exc
+from fastfood import utils
+
+LOG = logging.getLogger(__name__)
+# client environment the daemon runs each command with
+FORWARDED_ENV = ('HOME',)
+FORWARDED_ENV_PREFIX = 'FASTFOOD_'
+# seconds a client waits for the daemon to take its command
+CONNECT_TIMEOUT = 5.0
+# seconds a client waits for the command to run, FASTFOOD_DAEMON_TIMEOUT
+RUN_TIMEOUT = 600.0
+
+
+def socket_path():
+    """Return the daemon socket path, FASTFOOD_SOCKET or the default."""
+    home = os.getenv('HOME') or os.path.expanduser('~') or os.getcwd()
+    return os.environ.get(
+        'FASTFOOD_SOCKET',
+        os.path.join(home, '.cache', 'fastfood', 'fastfood.sock'))
+
+
+def _send(sock, message):
+    """Send one JSON message on sock."""
+    sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+
+def _receive(sock):
+    """Receive one JSON message from sock, None if it was closed.
+
+    Only the message is read off sock, not what was sent after it.
+    """
+    chunks = []
+    while True:
+        chunk = sock.recv(65536, socket.MSG_PEEK)
+        if not chunk:
+            break
+        chunk = sock.recv(chunk.find(b'\n') + 1 or len(chunk))
+        chunks.append(chunk)
+        if chunk.endswith(b'\n'):
+            break
+    if not chunks:
+        return None
+    return json.loads(b''.join(chunks).decode('utf-8'))
+
+
+def _run_timeout():
+    """Return the seconds a client waits for its command to run."""
+    try:
+        return float(os.environ.get('FASTFOOD_DAEMON_TIMEOUT', RUN_TIMEOUT))
+    except ValueError:
+        return RUN_TIMEOUT
+
+
+def call(argv, path=None):
+    """Run the command line argv on a running daemon.
+
+    Writes the command's output to stdout and stderr. Returns its exit
+    code, or None if no daemon (of this version of fastfood) is listening
+    on 'path', if it does not take the command within CONNECT_TIMEOUT, or
+    run it within RUN_TIMEOUT, or if it hangs up: the caller then runs
+    the command itself.
+    """
+    path = path or socket_path()
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(CONNECT_TIMEOUT)
+    try:
+        try:
+            sock.connect(path)
+        except socket.error as err:
+            LOG.debug("No fastfood daemon on %s: %s", path, err)
+            return None
+        try:
+            _send(sock, {
+                'version': fastfood.__version__,
+                'argv': list(argv),
+                'cwd': os.getcwd(),
+                'env': {key: val for key, val in os.environ.items()
+                        if key in FORWARDED_ENV or
+                        key.startswith(FORWARDED_ENV_PREFIX)},
+            })
+            response = _receive(sock)
+            if response is not None and response.get('running'):
+                sock.settimeout(_run_timeout())
+                response = _receive(sock)
+        except (socket.error, ValueError) as err:
+            # socket.timeout is a socket.error
+            LOG.warning("No answer from the fastfood daemon on %s, running "
+                        "the command in-process: %s", path, err)
+            return None
+    finally:
+        sock.close()
+    if response is None:
+        LOG.warning("The fastfood daemon on %s hung up, running the "
+                    "command in-process", path)
+        return None
+    if 'exit_code' not in response:
+        LOG.info("Stopped the fastfood %s daemon on %s, running the "
+                 "command in-process", response.get('version'), path)
+        return None
+    sys.stdout.write(response['stdout'])
+    sys.stdout.flush()
+    sys.stderr.write(response['stderr'])
+    sys.stderr.flush()
+    return response['exit_code']
+
+
+def is_listening(path):
+    """Whether a daemon is listening on the socket at path."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+class PackCache(object):
+
+    """Template packs loaded by the daemon.
+
+    A pack is loaded again, with all of its stencil sets (see
+    TemplatePack.preload()), when its archive or any of its manifests
+    changed since it was last loaded (see TemplatePack.changed()).
+    """
+
+    def __init__(self):
+        """Initialize, with no packs loaded."""
+        # {pack path: (TemplatePack, archive stamp)}
+        self._packs = {}
+        # paths of the packs (re)loaded by get(), see Server.reap()
+        self.loaded = []
+
+    def get(self, path):
+        """Return the TemplatePack at path, (re)loading it if needed."""
+        from fastfood import pack
+
+        path = utils.normalize_path(path)
+        # an archive is never written to, its stamp tells it all
+        stamp = utils.file_stamp(path) if os.path.isfile(path) else None
+        cached = self._packs.get(path)
+        if cached is not None:
+            if cached[1] == stamp and (stamp is not None or
+                                       not cached[0].changed()):
+                return cached[0]
+            LOG.info("Template pack %s changed, reloading it", path)
+        self._packs[path] = (pack.TemplatePack(path, preload=True), stamp)
+        self.loaded.append(path)
+        return self._packs[path][0]
+
+
+class Server(object):
+
+    """Run the commands sent to a Unix socket.
+
+    'run' is called as run(argv, packs) for every command, with the
+    daemon's PackCache, and returns the exit code. The command runs in
+    the client's working directory and FASTFOOD_* environment, with its
+    output captured and sent back.
+
+    Each command runs in a child process forked by the daemon, so that
+    commands run side by side, with the packs loaded by the daemon (or,
+    without os.fork(), in the daemon itself, one at a time). The packs a
+    child had to (re)load are loaded by the daemon once it is done, for
+    the next commands, see reap().
+    """
+
+    def __init__(self, path, run):
+        """Initialize the daemon listening on the socket at 'path'."""
+        self.path = utils.normalize_path(path)
+        self.run = run
+        self.packs = PackCache()
+        self.sock = None
+        # set once a client of another version asked, see handle()
+        self.stopping = False
+        self.forks = hasattr(os, 'fork')
+        # {pid: pipe the child reports the packs it loaded on}
+        self.children = {}
+
+    def bind(self):
+        """Listen on the socket, replacing a stale one."""
+        if is_listening(self.path):
+            raise exc.FastfoodDaemonRunning(
+                "A fastfood daemon is already listening on %s" % self.path)
+        try:
+            os.unlink(self.path)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+        try:
+            os.makedirs(os.path.dirname(self.path))
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # only the user may connect, from the moment the socket exists
+        umask = os.umask(0o177)
+        try:
+            self.sock.bind(self.path)
+        finally:
+            os.umask(umask)
+        self.sock.listen(16)
+
+    def serve_forever(self):
+        """Serve commands until interrupted, or asked to stop."""
+        if self.sock is None:
+            self.bind()
+        try:
+            while not self.stopping:
+                conn, _ = self.sock.accept()
+                try:
+                    self.handle(conn)
+                finally:
+                    conn.close()
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop listening, remove the socket and wait for the children."""
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+        self.reap(wait=True)
+
+    def handle(self, conn):
+        """Run the command received on conn and send back its output."""
+        try:
+            request = _receive(conn)
+        except ValueError as err:
+            LOG.warning("Bad request: %s", err)
+            return
+        if request is None:
+            # a liveness check, see is_listening()
+            return
+        if request.get('version') != fastfood.__version__:
+            LOG.warning("Stopping: a client runs fastfood %s, this is %s",
+                        request.get('version'), fastfood.__version__)
+            self.stopping = True
+            try:
+                _send(conn, {'version': fastfood.__version__})
+            except socket.error as err:
+                LOG.warning("Client went away: %s", err)
+            return
+        LOG.info("Running fastfood %s", " ".join(request['argv']))
+        try:
+            _send(conn, {'running': True})
+        except socket.error as err:
+            LOG.warning("Client went away: %s", err)
+            return
+        if not self.forks:
+            self.respond(conn, request)
+            return
+        self.reap()
+        reader, writer = os.pipe()
+        pid = os.fork()
+        if pid:
+            os.close(writer)
+            self.children[pid] = reader
+            return
+        # the child: run the command, report the packs it loaded, exit
+        exit_code = 1
+        try:
+            os.close(reader)
+            if self.sock is not None:
+                self.sock.close()
+            self.packs.loaded = []
+            self.respond(conn, request)
+            with os.fdopen(writer, 'w') as report:
+                json.dump(self.packs.loaded, report)
+            exit_code = 0
+        except BaseException:  # pylint: disable=broad-except
+            LOG.exception("Failed to run %s", request['argv'])
+        finally:
+            os._exit(exit_code)  # pylint: disable=protected-access
+
+    def respond(self, conn, request):
+        """Run a request and send its output on conn."""
+        exit_code, stdout, stderr = self.execute(request)
+        try:
+            _send(conn, {'exit_code': exit_code, 'stdout': stdout,
+                         'stderr': stderr})
+        except socket.error as err:
+            LOG.warning("Client went away: %s", err)
+
+    def reap(self, wait=False):
+        """Collect the children done running their command.
+
+        The packs they (re)loaded are loaded here too, for the children
+        forked next to start with, unless the daemon was closed. With
+        'wait', waits for every child.
+        """
+        for pid, reader in list(self.children.items()):
+            try:
+                done = os.waitpid(pid, 0 if wait else os.WNOHANG)[0]
+            except OSError as err:
+                if err.errno != errno.ECHILD:
+                    raise
+                done = pid
+            if not done:
+                continue
+            del self.children[pid]
+            with os.fdopen(reader) as report:
+                try:
+                    loaded = json.loads(report.read() or '[]')
+                except ValueError:
+                    loaded = []
+            if self.sock is None:
+                continue
+            for path in loaded:
+                try:
+                    self.packs.get(path)
+                except Exception as err:  # pylint: disable=broad-except
+                    LOG.warning("Cannot load template pack %s: %s",
+                                path, err)
+
+    def execute(self, request):
+        """Run a request, returning (exit code, stdout, stderr)."""
+        saved_env = dict(os.environ)
+        saved_cwd = os.getcwd()
+        saved_streams = sys.stdout, sys.stderr
+        stdout, stderr = StringIO(), StringIO()
+        root = logging.getLogger()
+        saved_level = root.level
+        handler = logging.StreamHandler(stderr)
+        for key in list(os.environ):
+            if key in FORWARDED_ENV or key.startswith(FORWARDED_ENV_PREFIX):
+                del os.environ[key]
+        os.environ.update(request.get('env', {}))
+        sys.stdout, sys.stderr = stdout, stderr
+        root.addHandler(handler)
+        try:
+            os.chdir(request['cwd'])
+            exit_code = self.run(request['argv'], self.packs)
+        except SystemExit as err:
+            exit_code = err.code
+            if exit_code is not None and not isinstance(exit_code, int):
+                print(exit_code, file=stderr)
+                exit_code = 1
+        except Exception:  # pylint: disable=broad-except
+            LOG.exception("Failed to run %s", request['argv'])
+            exit_code = 1
+        finally:
+            root.removeHandler(handler)
+            root.setLevel(saved_level)
+            sys.stdout, sys.stderr = saved_streams
+            os.chdir(saved_cwd)
+            os.environ.clear()
+            os.environ.update(saved_env)
+        return exit_code or 0, stdout.getvalue(), stderr.getvalue()
@@ -17,26 +17,32 @@
 
 from __future__ import print_function
 
+import contextlib
 from datetime import datetime
+import glob
 import json
 import logging
 import os
 import sys
 import threading
-
-try:
-    import urllib2 as urllib
-except ImportError:
-    # Python 3
-    # pylint: disable=no-name-in-module
-    from urllib import request as urllib
+import traceback
 
 import fastfood
+from fastfood import events
 from fastfood import exc
-from fastfood import food
 from fastfood import pack
+from fastfood import timings
+from fastfood import utils
+
+# python 2 vs. 3 string types
+try:
+    basestring
+except NameError:
+    basestring = str  # pylint: disable=invalid-name
 
 _LOCAL = threading.local()
+# {FASTFOOD_* environment: argument parser}, see _parser()
+_PARSERS = {}
 LOG = logging.getLogger(__name__)
 NAMESPACE = 'fastfood'
 EXCLAIM = u'\U00002757'
@@ -44,26 +50,192 @@ CHECK = u'\U00002705'
 PIZZA = u'\U0001F355'
 INTERROBANG = u'\U00002049\U0000FE0F'
 RED_X = u'\U0000274C'
+# templating.DEFAULT_CACHE_SIZE in MiB, without loading jinja to get it
+DEFAULT_CACHE_SIZE = 64
+# plan.DURABILITY and plan.BINARY_STRATEGIES, without loading the build
+# plan to get them
+DURABILITY = ('none', 'batch', 'file')
+BINARY_STRATEGIES = ('copy', 'reflink', 'hardlink', 'symlink')
+# where a bare --profile writes pstats, and how many functions it shows
+PROFILE_PATH = 'fastfood.pstats'
+PROFILE_TOP = 25
+# the commands handed over to a running `fastfood serve`, see _use_daemon()
+DAEMON_COMMANDS = ('build', 'list', 'show')
+# top level options taking a value, which may come before the command
+_VALUE_OPTIONS = ('--template-pack', '--cookbooks', '--cache-dir',
+                  '--cache-size')
+
+
+def _expand_config_files(config_files):
+    """Expand config file arguments into a list of config files.
+
+    Each argument may be a file, a directory (meaning every *.json file
+    in it) or a glob pattern.
+    """
+    if isinstance(config_files, basestring):
+        config_files = [config_files]
+    expanded = []
+    for config_file in config_files:
+        if os.path.isdir(config_file):
+            expanded.extend(
+                sorted(glob.glob(os.path.join(config_file, '*.json'))))
+        elif glob.has_magic(config_file):
+            expanded.extend(sorted(glob.glob(config_file)))
+        else:
+            expanded.append(config_file)
+    return expanded
+
+
+def _usage_error(message):
+    """Exit with 'message' as a command line usage error."""
+    parser = getattr(_LOCAL, 'argparser', None) or _parser()
+    parser.error(message)
+
+
+def _template_pack(args, path=None):
+    """Return the template pack at path (default: --template-pack).
+
+    Under `fastfood serve`, packs stay loaded from one command to the next.
+    """
+    path = path or args.template_pack
+    if args.packs is not None:
+        return args.packs.get(path)
+    return pack.TemplatePack(path)
+
+
+@contextlib.contextmanager
+def _event_hooks(args):
+    """Yield the hooks writing build events to --events, if given."""
+    if not args.events:
+        yield None
+        return
+    with open(args.events, 'a') as stream:
+        yield events.JsonLines(stream)
 
 
 def _fastfood_build(args):
     """Run on `fastfood build`."""
-    written_files, cookbook = food.build_cookbook(
-        args.config_file, args.template_pack,
-        args.cookbooks, args.force)
-
-    if len(written_files) > 0:
-        print("%s: %s files written" % (cookbook,
-                                        len(written_files)))
+    from fastfood import food
+    from fastfood import plan
+    from fastfood import templating
+
+    _configure_cache(args)
+    config_files = _expand_config_files(args.config_file)
+    if not config_files:
+        _usage_error("No config files found in %s"
+                     % ", ".join(args.config_file))
+    if len(config_files) > 1:
+        if args.events and args.jobs and args.jobs > 1:
+            _usage_error("--events cannot be used with --jobs when building "
+                         "several cookbooks")
+        return _fastfood_build_batch(args, config_files)
+    if args.stream and args.jobs and args.jobs > 1:
+        _usage_error("--stream cannot be used with --jobs when building "
+                     "one cookbook")
+
+    build_plan = plan.BuildPlan(binaries=args.binaries)
+    with _event_hooks(args) as hooks:
+        written_files, cookbook = food.build_cookbook(
+            config_files[0], _template_pack(args),
+            args.cookbooks, args.force, jobs=args.jobs, stream=args.stream,
+            incremental=not args.no_incremental, dry_run=args.dry_run,
+            atomic=args.atomic, durability=args.durability,
+            build_plan=build_plan, hooks=hooks)
+
+    if args.dry_run:
+        print("%s: %s files would be written" % (cookbook,
+                                                 len(written_files)))
+    elif len(written_files) > 0:
+        print("%s: %s" % (cookbook, build_plan.summary()))
     else:
-        print("%s up to date" % cookbook)
+        print("%s up to date (%d unchanged, %d skipped)"
+              % (cookbook, len(build_plan.unchanged),
+                 len(build_plan.skipped)))
+
+    hits, misses = templating.cache_stats()
+    LOG.info("Template cache: %s hits, %s misses", hits, misses)
 
     return written_files, cookbook
 
 
+def _fastfood_build_batch(args, config_files):
+    """Run on `fastfood build` with several config files."""
+    from fastfood import food
+    from fastfood import templating
+
+    # the output of worker processes forked by `fastfood serve` would end
+    # up in its own log, not the client's: build one cookbook at a time
+    jobs = args.jobs if args.packs is None else 1
+    with _event_hooks(args) as hooks:
+        results = list(food.build_cookbooks(
+            config_files, _template_pack(args), args.cookbooks,
+            jobs=jobs, force=args.force, stream=args.stream,
+            incremental=not args.no_incremental, dry_run=args.dry_run,
+            atomic=args.atomic, durability=args.durability,
+            binaries=args.binaries, hooks=hooks))
+
+    failed = [result for result in results if result.exit_code]
+    written = 'would be written' if args.dry_run else 'written'
+    print("\nBuild summary:")
+    for result in results:
+        if result.exit_code:
+            print("  %s  %s (exit %s): %s" % (RED_X, result.config,
+                                              result.exit_code,
+                                              result.error))
+        else:
+            print("  %s  %s: %s files %s, %s unchanged, %s skipped"
+                  % (CHECK, result.cookbook, len(result.written_files),
+                     written, len(result.unchanged_files),
+                     len(result.skipped_files)))
+    print("%s cookbooks built, %s failed"
+          % (len(results) - len(failed), len(failed)))
+
+    hits, misses = templating.cache_stats()
+    LOG.info("Template cache: %s hits, %s misses", hits, misses)
+
+    if failed:
+        sys.exit(1)
+    return results
+
+
+def _fastfood_compile(args):
+    """Run on `fastfood compile`."""
+    _configure_cache(args)
+    template_pack = _template_pack(args, args.pack_path)
+    index = template_pack.compile(zip_archive=args.format == 'zip')
+    print("Compiled Stencil Sets:")
+    for name, entry in sorted(index['stencil_sets'].items()):
+        # the manifest is stamped along with the templates
+        print("  %12s - %s templates" % (name, len(entry['stamps']) - 1))
+    print("Compiled templates written to %s" % template_pack.compiled_path)
+    return index
+
+
+def _fastfood_check(args):
+    """Run on `fastfood check`."""
+    from fastfood import check
+
+    _configure_cache(args)
+    report = check.check_pack(_template_pack(args, args.pack_path),
+                              jobs=args.jobs)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+    sym = RED_X if report['errors'] else CHECK
+    print("%s  %s errors in %s stencil sets (%.2fs)"
+          % (sym, report['errors'], len(report['stencil_sets']),
+             report['seconds']), file=sys.stderr)
+    if report['errors']:
+        sys.exit(1)
+    return report
+
+
 def _fastfood_list(args):
     """Run on `fastfood list`."""
-    template_pack = pack.TemplatePack(args.template_pack)
+    template_pack = _template_pack(args)
     if args.stencil_set:
         stencil_set = template_pack.load_stencil_set(args.stencil_set)
         print("Available Stencils for %s:" % args.stencil_set)
@@ -77,7 +249,7 @@ def _fastfood_list(args):
 
 def _fastfood_show(args):
     """Run on `fastfood show`."""
-    template_pack = pack.TemplatePack(args.template_pack)
+    template_pack = _template_pack(args)
     if args.stencil_set:
         stencil_set = template_pack.load_stencil_set(args.stencil_set)
         print("Stencil Set %s:" % args.stencil_set)
@@ -91,6 +263,13 @@ def _fastfood_show(args):
 
 def _release_info():
     """Check latest fastfood release info from PyPI."""
+    try:
+        import urllib2 as urllib
+    except ImportError:
+        # Python 3
+        # pylint: disable=no-name-in-module
+        from urllib import request as urllib
+
     pypi_url = 'http://pypi.python.org/pypi/fastfood/json'
     headers = {
         'Accept': 'application/json',
@@ -114,11 +293,24 @@ def getenv(option_name, default=None):
     return os.environ.get(env, default)
 
 
-def main(argv=None):
-    """fastfood command line interface."""
+def _parser():
+    """Return the fastfood command line parser.
+
+    Defaults come from the FASTFOOD_* environment, so a parser is built
+    once per environment (which only matters to `fastfood serve`).
+    """
+    env = tuple(sorted((key, val) for key, val in os.environ.items()
+                       if key == 'HOME' or key.startswith('FASTFOOD_')))
+    if env not in _PARSERS:
+        _PARSERS.clear()
+        _PARSERS[env] = _build_parser()
+    return _PARSERS[env]
+
+
+def _build_parser():
+    """Build the fastfood command line parser."""
     # pylint: disable=missing-docstring
     import argparse
-    import traceback
 
     class HelpfulParser(argparse.ArgumentParser):
         def error(self, message, print_help=False):
@@ -177,13 +369,37 @@ def main(argv=None):
     parser.set_defaults(loglevel=logging.WARNING)
     home = os.getenv('HOME') or os.path.expanduser('~') or os.getcwd()
     parser.add_argument(
-        '--template-pack', help='template pack location',
+        '--template-pack',
+        help='template pack location: a dir, or a zip or tar archive',
         default=getenv(
             'template_pack', os.path.join(home, '.fastfood')))
     parser.add_argument(
         '--cookbooks', help='cookbooks directory',
         default=getenv(
             'cookbooks', os.path.join(home, 'cookbooks')))
+    parser.add_argument(
+        '--cache-dir', help='compiled template cache location',
+        default=getenv(
+            'cache_dir', os.path.join(home, '.cache', 'fastfood')))
+    parser.add_argument(
+        '--cache-size', type=int, help='compiled template cache size (MiB)',
+        default=getenv(
+            'cache_size', DEFAULT_CACHE_SIZE))
+    parser.add_argument(
+        '--no-cache', action='store_true', default=False,
+        help="Do not use the compiled template cache.")
+    parser.add_argument(
+        '--no-daemon', action='store_true', default=False,
+        help="Do not hand the command over to a running `fastfood serve`.")
+    parser.add_argument(
+        '--profile', metavar='PATH',
+        help="Run under cProfile and write pstats to PATH (use "
+             "--profile=PATH; a bare --profile writes %s)." % PROFILE_PATH)
+    parser.add_argument(
+        '--timings', action='store_true', default=False,
+        help="Print the time spent in each phase and each stencil.")
+    # template packs kept loaded by `fastfood serve`, see _template_pack()
+    parser.set_defaults(packs=None)
 
     subparsers = parser.add_subparsers(
         dest='_subparsers', title='fastfood commands',
@@ -216,22 +432,167 @@ def main(argv=None):
     build_parser = subparsers.add_parser(
         'build', help='Create or update a cookbook using a config',
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    build_parser.add_argument('config_file',
-                              help="JSON config file")
+    build_parser.add_argument('config_file', nargs='+',
+                              help="JSON config file(s), directories of them "
+                                   "or glob patterns")
     build_parser.add_argument('--force', '-f', action='store_true',
                               default=False, help="Overwrite existing files.")
+    build_parser.add_argument('--jobs', '-j', type=int, default=1,
+                              help="Render templates (or, with several "
+                                   "config files, build cookbooks) with "
+                                   "this many worker processes.")
+    build_parser.add_argument('--dry-run', '-n', action='store_true',
+                              default=False,
+                              help="Show which files would be written, "
+                                   "without writing them.")
+    build_parser.add_argument('--atomic', action='store_true', default=False,
+                              help="Stage files next to the cookbook and "
+                                   "rename them into place.")
+    build_parser.add_argument('--durability', choices=DURABILITY,
+                              default='none',
+                              help="fsync nothing, once per build (batch) "
+                                   "or every file.")
+    build_parser.add_argument('--binaries', choices=BINARY_STRATEGIES,
+                              default='copy',
+                              help="Copy, reflink, hardlink or symlink "
+                                   "binaries from the template pack.")
+    build_parser.add_argument('--no-incremental', action='store_true',
+                              default=False,
+                              help="Build every stencil, even those "
+                                   "unchanged since the last build.")
+    build_parser.add_argument('--events', metavar='PATH',
+                              help="Append build events to PATH, as lines "
+                                   "of JSON.")
+    build_parser.add_argument('--stream', action='store_true', default=False,
+                              help="Render templates straight to disk "
+                                   "instead of buffering them (not with "
+                                   "--jobs, for one config file).")
 
     build_parser.set_defaults(func=_fastfood_build)
 
-    setattr(_LOCAL, 'argparser', parser)
-    if not argv:
-        argv = None
-    args = parser.parse_args(args=argv)
-    if hasattr(args, 'options'):
-        args.options = {k: v for k, v in args.options}
+    #
+    # `fastfood compile [template_pack]`
+    #
+    compile_parser = subparsers.add_parser(
+        'compile', help='Precompile the templates of a template pack',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    compile_parser.add_argument('pack_path', nargs='?',
+                                metavar='template_pack',
+                                help="Template pack to compile "
+                                     "(defaults to --template-pack)")
+    compile_parser.add_argument('--format', choices=('zip', 'modules'),
+                                default='zip',
+                                help="Write a zip archive or a dir of "
+                                     "python modules per stencil set.")
+    compile_parser.set_defaults(func=_fastfood_compile)
+
+    #
+    # `fastfood check [template_pack]`
+    #
+    check_parser = subparsers.add_parser(
+        'check', help='Check that every stencil of a template pack builds',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    check_parser.add_argument('pack_path', nargs='?',
+                              metavar='template_pack',
+                              help="Template pack to check "
+                                   "(defaults to --template-pack)")
+    check_parser.add_argument('--jobs', '-j', type=int, default=0,
+                              help="Check stencil sets with this many "
+                                   "worker processes (0: one per CPU).")
+    check_parser.add_argument('--output', '-o', metavar='PATH',
+                              help="Write the JSON report to PATH instead "
+                                   "of stdout.")
+    check_parser.set_defaults(func=_fastfood_check)
+
+    #
+    # `fastfood serve`
+    #
+    serve_parser = subparsers.add_parser(
+        'serve', help='Run a daemon keeping template packs loaded',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    # server.socket_path(), without loading the daemon to get it
+    serve_parser.add_argument('--socket',
+                              default=getenv('socket', os.path.join(
+                                  home, '.cache', 'fastfood',
+                                  'fastfood.sock')),
+                              help="Unix socket to listen on (clients use "
+                                   "FASTFOOD_SOCKET)")
+    serve_parser.set_defaults(func=_fastfood_serve)
+
+    return parser
 
-    logging.basicConfig(level=args.loglevel)
 
+def _configure(args):
+    """Set up logging for parsed args."""
+    logging.basicConfig(level=args.loglevel)
+    logging.getLogger().setLevel(args.loglevel)
+
+
+def _configure_cache(args):
+    """Set up the template cache, for commands rendering templates.
+
+    Other commands never load jinja.
+    """
+    from fastfood import templating
+
+    current = templating.JINJA_ENV.bytecode_cache
+    if args.no_cache:
+        if current is not None:
+            templating.configure_cache(None)
+        return
+    max_size = args.cache_size * 1024 * 1024
+    # the daemon keeps the cache it has, if it is the same
+    if (current is None or
+            current.directory != utils.normalize_path(args.cache_dir) or
+            current.max_size != max_size):
+        templating.configure_cache(args.cache_dir, max_size=max_size)
+
+
+def _run(args):
+    """Run the command parsed into args, returning its exit code.
+
+    With --profile, the command runs under cProfile; with --timings, the
+    time spent in each phase of the build is printed after it.
+    """
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+    timings.TIMINGS.reset()
+    timings.TIMINGS.enabled = args.timings
+    try:
+        if profiler is None:
+            return _call(args)
+        return profiler.runcall(_call, args)
+    finally:
+        timings.TIMINGS.enabled = False
+        if profiler is not None:
+            _dump_profile(profiler, args.profile)
+        if args.timings:
+            print(timings.TIMINGS.table(), file=sys.stderr)
+
+
+def _dump_profile(profiler, path):
+    """Write pstats to path and summarize them on stderr."""
+    import pstats
+    profiler.dump_stats(path)
+    stats = pstats.Stats(profiler, stream=sys.stderr)
+    stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+    print("Profile written to %s, see `python -m pstats %s`"
+          % (path, path), file=sys.stderr)
+
+
+def _expand_profile(argv):
+    """Turn a bare --profile into --profile=<default path>.
+
+    So that `fastfood --profile build ...` does not profile to 'build'.
+    """
+    return ['--profile=%s' % PROFILE_PATH if arg == '--profile' else arg
+            for arg in argv]
+
+
+def _call(args):
+    """Call the command parsed into args, returning its exit code."""
     try:
         args.func(args)
     except exc.FastfoodError as err:
@@ -239,7 +600,7 @@ def main(argv=None):
         print('%s  %s: %s' % (RED_X, title, str(err)),
               file=sys.stderr)
         sys.stderr.flush()
-        sys.exit(1)
+        return 1
     except Exception as err:
         print('%s  Unexpected error. Please report this traceback.'
               % INTERROBANG,
@@ -247,9 +608,83 @@ def main(argv=None):
         traceback.print_exc()
         # todo: tracack in -v or -vv mode?
         sys.stderr.flush()
-        sys.exit(1)
+        return 1
+    return 0
+
+
+def _command(argv):
+    """Return the command named in the command line argv, if any."""
+    args = iter(argv)
+    for arg in args:
+        if arg in _VALUE_OPTIONS:
+            next(args, None)
+        elif not arg.startswith('-'):
+            return arg
+    return None
+
+
+def _serve_command(argv, packs):
+    """Run a command sent to `fastfood serve`, with its loaded packs."""
+    parser = _parser()
+    setattr(_LOCAL, 'argparser', parser)
+    if _command(argv) not in DAEMON_COMMANDS:
+        parser.error("`fastfood serve` only runs %s"
+                     % ", ".join(DAEMON_COMMANDS))
+    args = parser.parse_args(args=_expand_profile(argv))
+    args.packs = packs
+    _configure(args)
+    return _run(args)
+
+
+def _fastfood_serve(args):
+    """Run on `fastfood serve`."""
+    from fastfood import server
+
+    daemon = server.Server(args.socket, _serve_command)
+    daemon.bind()
+    print("Serving fastfood on %s" % daemon.path)
+    daemon.serve_forever()
+
+
+def _use_daemon(argv):
+    """Whether to hand the command line argv over to `fastfood serve`.
+
+    Only DAEMON_COMMANDS are, and not to print help or versions.
+    """
+    if getenv('no_daemon'):
+        return False
+    if {'--no-daemon', '-h', '--help', '-V', '--version', '-L',
+            '--latest'} & set(argv):
+        return False
+    return _command(argv) in DAEMON_COMMANDS
+
+
+def main(argv=None):
+    """fastfood command line interface."""
+    if not argv:
+        argv = None
+    if _use_daemon(sys.argv[1:] if argv is None else argv):
+        from fastfood import server
+        exit_code = server.call(sys.argv[1:] if argv is None else argv)
+        if exit_code is not None:
+            if exit_code:
+                sys.exit(exit_code)
+            return
+
+    parser = _build_parser()
+    setattr(_LOCAL, 'argparser', parser)
+    args = parser.parse_args(
+        args=_expand_profile(sys.argv[1:] if argv is None else argv))
+    if hasattr(args, 'options'):
+        args.options = {k: v for k, v in args.options}
+
+    _configure(args)
+    try:
+        exit_code = _run(args)
     except KeyboardInterrupt:
         sys.exit("\nStahp")
+    if exit_code:
+        sys.exit(exit_code)
 
 if __name__ == '__main__':
     main()
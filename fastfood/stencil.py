@@ -20,7 +20,9 @@ import copy
 import json
 import os
 
+from fastfood import archive
 from fastfood import exc
+from fastfood import timings
 from fastfood import utils
 
 # python 2 vs. 3 string types
@@ -37,18 +39,31 @@ class StencilSet(object):
     Holds references to stencils in the set.
     """
 
-    def __init__(self, path):
-        """Initialize the stencilset object with a local path."""
+    def __init__(self, path, compiled=None, manifest=None, templates=None,
+                 references=None):
+        """Initialize the stencilset object with a local path.
+
+        'compiled' is where this set's templates were precompiled to (see
+        TemplatePack.compile()), and 'manifest' its already parsed
+        manifest, if known, like its 'templates' (see template_names()).
+        'references' are, for compiled templates, the names of those they
+        refer to (see templating.referenced_templates()).
+        """
         # assign these attrs early
-        self._manifest = None
+        self._manifest = manifest
         self._stencils = {}
+        # {stencil name: (definition, option defaults, <NAME> files)}
+        self._resolved = {}
+        self._template_names = templates
+        self.compiled = compiled
+        self.references = references or {}
 
         self.path = utils.normalize_path(path)
-        if not os.path.isdir(path):
+        if not archive.isdir(path):
             raise exc.FastfoodStencilSetInvalidPath(
                 "Stencil Set dir %s does not exist." % path)
         self.manifest_path = os.path.join(self.path, 'manifest.json')
-        if not os.path.isfile(self.manifest_path):
+        if not archive.isfile(self.manifest_path):
             raise exc.FastfoodStencilSetMissingManifest(
                 "Stencil Set needs manifest file, %s"
                 % self.manifest_path)
@@ -69,10 +84,41 @@ class StencilSet(object):
     def manifest(self):
         """The manifest definition of the stencilset as a dict."""
         if not self._manifest:
-            with open(self.manifest_path) as man:
-                self._manifest = json.load(man)
+            with timings.phase('manifest'):
+                with archive.open_file(self.manifest_path) as man:
+                    self._manifest = json.load(man)
         return self._manifest
 
+    @property
+    def jinja_env(self):
+        """The jinja env that loads templates from this stencil set."""
+        # jinja is only loaded once something gets rendered
+        from fastfood import templating
+        return templating.get_environment(self.path, compiled=self.compiled)
+
+    def template_names(self):
+        """Return the names of all templates used by this set's stencils.
+
+        Names are relative to the stencil set path. Binaries are not
+        templates, so they are not included.
+        """
+        if self._template_names is None:
+            names = set()
+            for definition in [self.manifest] + list(self.stencils.values()):
+                for key in ('files', 'partials'):
+                    names.update((definition.get(key) or {}).values())
+            self._template_names = sorted(names)
+        return list(self._template_names)
+
+    def stamps(self, names=None):
+        """Return {name: stamp} for the manifest and templates of this set.
+
+        See utils.file_stamp().
+        """
+        names = ['manifest.json'] + list(names or self.template_names())
+        return {name: utils.file_stamp(os.path.join(self.path, name))
+                for name in names}
+
     @property
     def stencils(self):
         """List of stencils."""
@@ -82,32 +128,68 @@ class StencilSet(object):
 
     def get_stencil(self, stencil_name, **options):
         """Return a Stencil instance given a stencil name."""
-        if stencil_name not in self.manifest.get('stencils', {}):
-            raise ValueError("Stencil '%s' not declared in StencilSet "
-                             "manifest." % stencil_name)
-        stencil = copy.deepcopy(self.manifest)
-        allstencils = stencil.pop('stencils')
-        stencil.pop('default_stencil', None)
-        override = allstencils[stencil_name]
-        utils.deepupdate(stencil, override)
+        with timings.phase('get_stencil'):
+            return self._get_stencil(stencil_name, **options)
+
+    def _get_stencil(self, stencil_name, **options):
+        """Resolve the stencil 'stencil_name' with options.
+
+        Only 'options' and 'files' are new, default options copied from
+        the manifest: the rest of the stencil is shared by every call,
+        frozen (see utils.FrozenDict).
+        """
+        if stencil_name not in self._resolved:
+            definition, defaults, named_files = self._resolve(stencil_name)
+            self._resolved[stencil_name] = (utils.freeze(definition),
+                                            defaults, named_files)
+        definition, defaults, named_files = self._resolved[stencil_name]
+        stencil = dict(definition)
 
         # merge options, prefer **options (probably user-supplied)
-        for opt, data in stencil.get('options', {}).items():
+        for opt, default in defaults.items():
             if opt not in options:
-                options[opt] = data.get('default', '')
+                options[opt] = copy.deepcopy(default)
         stencil['options'] = options
 
-        name = stencil['options'].get('name')
-        files = stencil['files'].copy()
-        for fil, templ in files.items():
-            if '<NAME>' in fil:
-                # check for the option b/c there are
-                # cases in which it may not exist
-                if not name:
-                    raise ValueError("Stencil does not include a name option")
-
-                stencil['files'].pop(fil)
-                fil = fil.replace('<NAME>', name)
-                stencil['files'][fil] = templ
+        if named_files:
+            name = options.get('name')
+            # check for the option b/c there are
+            # cases in which it may not exist
+            if not name:
+                raise ValueError("Stencil does not include a name option")
+            files = dict(definition['files'])
+            for fil, templ in named_files:
+                files[fil.replace('<NAME>', name)] = templ
+            stencil['files'] = files
+        elif 'files' in definition:
+            stencil['files'] = dict(definition['files'])
 
         return stencil
+
+    def _resolve(self, stencil_name):
+        """Return the stencil, less its options.
+
+        That is its definition, with the set's manifest as defaults and
+        without the files named after the 'name' option, the default
+        options and those (path, template) files.
+        """
+        if stencil_name not in self.manifest.get('stencils', {}):
+            raise ValueError("Stencil '%s' not declared in StencilSet "
+                             "manifest." % stencil_name)
+        # sharing the parts of the manifest it does not change
+        stencil = utils.deepmerge(
+            {key: val for key, val in self.manifest.items()
+             if key not in ('stencils', 'default_stencil')},
+            self.manifest['stencils'][stencil_name])
+
+        defaults = {opt: data.get('default', '')
+                    for opt, data in stencil.get('options', {}).items()}
+        named_files = []
+        if 'files' in stencil:
+            named_files = [(fil, templ)
+                           for fil, templ in stencil['files'].items()
+                           if '<NAME>' in fil]
+            stencil['files'] = {fil: templ
+                                for fil, templ in stencil['files'].items()
+                                if '<NAME>' not in fil}
+        return stencil, defaults, named_files
@@ -14,16 +14,30 @@
 
 """Jinja templating for Fastfood."""
 
-import codecs
+import errno
+import hashlib
+import logging
+import multiprocessing
 import os
 import re
+import tempfile
+import threading
 
 import jinja2
+from jinja2 import bccache
+from jinja2 import meta
 
-# create a jinja env, overriding delimiters
-JINJA_ENV = jinja2.Environment(variable_start_string='|{',
-                               variable_end_string='}|',
-                               trim_blocks=True)
+from fastfood import archive
+from fastfood import events
+from fastfood import timings
+from fastfood import utils
+
+LOG = logging.getLogger(__name__)
+
+# compiled templates are only usable with the jinja that compiled them
+JINJA_VERSION = jinja2.__version__
+# default upper bound for the on-disk bytecode cache, in bytes
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
 NODE_ATTR_RE = '^node((\[\'([\w_-]+)\'\])+)'
 CHEF_CONST_RE = '^node\.([\w_-]+)'
 
@@ -37,7 +51,413 @@ def qstring(option):
         return option
 
 
-JINJA_ENV.globals['qstring'] = qstring
+class Environment(jinja2.Environment):
+
+    """A jinja env, overriding delimiters.
+
+    With a 'searchpath', templates are loaded (and cached, reloading when
+    they change on disk) through a filesystem loader rooted there, or an
+    ArchiveLoader if it is in an archive, which also lets templates
+    {% include %} or {% extends %} one another.
+    With a 'compiled' archive or dir (see compile_templates()), templates
+    found there are imported rather than parsed.
+    """
+
+    def __init__(self, searchpath=None, compiled=None):
+        """Initialize the env for templates under 'searchpath'."""
+        self.searchpath = searchpath
+        self.compiled = compiled
+        loader = None
+        if searchpath:
+            if archive.locate(searchpath, discover=True):
+                loader = ArchiveLoader(searchpath)
+            else:
+                loader = jinja2.FileSystemLoader(searchpath)
+            if compiled:
+                loader = jinja2.ChoiceLoader(
+                    [jinja2.ModuleLoader(compiled), loader])
+        super(Environment, self).__init__(variable_start_string='|{',
+                                          variable_end_string='}|',
+                                          trim_blocks=True,
+                                          loader=loader,
+                                          auto_reload=True)
+        self.globals['qstring'] = qstring
+
+    def compile(self, source, name=None, filename=None, *args, **kwargs):
+        """Compile 'source', reporting a template_compiled event."""
+        if not events.enabled():
+            return super(Environment, self).compile(
+                source, name, filename, *args, **kwargs)
+        start = events.clock()
+        code = super(Environment, self).compile(
+            source, name, filename, *args, **kwargs)
+        events.emit('template_compiled', template=filename or name,
+                    seconds=events.clock() - start)
+        return code
+
+
+class ArchiveLoader(jinja2.BaseLoader):
+
+    """Loads templates from a dir in an archive, see archive.py.
+
+    Templates are reloaded once the archive itself changes.
+    """
+
+    def __init__(self, searchpath):
+        """Initialize the loader for templates under 'searchpath'."""
+        self.searchpath = utils.normalize_path(searchpath)
+
+    def get_source(self, environment, template):
+        """Return the source, path and uptodate check of 'template'."""
+        path = os.path.join(self.searchpath, *template.split('/'))
+        located = archive.locate(path)
+        if located is None or located[1] not in located[0].files:
+            raise jinja2.TemplateNotFound(template)
+        with archive.open_file(path) as stream:
+            source = stream.read()
+        opened = located[0]
+        return (source, path,
+                lambda: archive.open_archive(opened.path) is opened)
+
+
+JINJA_ENV = Environment()
+# loader environments by (search path, compiled), see get_environment()
+_ENVIRONMENTS = {}
+_ENVIRONMENTS_LOCK = threading.Lock()
+
+
+def get_environment(searchpath, compiled=None):
+    """Return the jinja env whose loader is rooted at 'searchpath'.
+
+    Environments are shared by the whole process, so each template is
+    compiled once no matter how many stencils or cookbooks use it.
+    """
+    key = (utils.normalize_path(searchpath), compiled)
+    with _ENVIRONMENTS_LOCK:
+        if key not in _ENVIRONMENTS:
+            env = Environment(*key)
+            env.bytecode_cache = JINJA_ENV.bytecode_cache
+            _ENVIRONMENTS[key] = env
+        return _ENVIRONMENTS[key]
+
+
+def compile_templates(searchpath, target, names, zip_archive=True):
+    """Compile the templates 'names' under 'searchpath' into 'target'.
+
+    'target' becomes a zip archive of python modules, or a dir of them if
+    not 'zip_archive', that get_environment(searchpath, compiled=target)
+    imports instead of parsing the templates again.
+    """
+    names = set(names)
+    env = Environment(searchpath)
+    env.compile_templates(target,
+                          filter_func=lambda name: name in names,
+                          zip='deflated' if zip_archive else None,
+                          ignore_errors=False)
+
+
+class BytecodeCache(bccache.BytecodeCache):
+
+    """On-disk jinja bytecode cache, keyed by template content.
+
+    Entries are named after a hash of the template source (plus its name
+    and filename, which are baked into the compiled code), so the cache
+    can be shared by every fastfood process on a host and never needs
+    explicit invalidation. Once the directory grows past 'max_size'
+    bytes, the least recently used entries are evicted.
+    """
+
+    prefix = '__fastfood_'
+    suffix = '.cache'
+
+    def __init__(self, directory, max_size=DEFAULT_CACHE_SIZE):
+        """Initialize the cache in 'directory', creating it if needed."""
+        self.directory = utils.normalize_path(directory)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # running total of bytes in the cache dir, computed lazily
+        self._size = None
+        try:
+            os.makedirs(self.directory)
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+
+    def __repr__(self):
+        """Canonical string representation of the cache."""
+        return '<%s %s (%d hits, %d misses)>' % (
+            type(self).__name__, self.directory, self.hits, self.misses)
+
+    def get_bucket(self, environment, name, filename, source):
+        """Return a cache bucket keyed by the template content."""
+        checksum = self.get_source_checksum(source)
+        key = hashlib.sha1(('%s|%s|%s' % (name, filename, checksum))
+                           .encode('utf-8')).hexdigest()
+        bucket = bccache.Bucket(environment, key, checksum)
+        self.load_bytecode(bucket)
+        if bucket.code is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return bucket
+
+    def _entry_path(self, key):
+        """Return the path of the cache entry for 'key'."""
+        return os.path.join(self.directory,
+                            '%s%s%s' % (self.prefix, key, self.suffix))
+
+    def _entries(self):
+        """Return [(mtime, size, path), ...] for every cache entry."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not (name.startswith(self.prefix) and
+                    name.endswith(self.suffix)):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # another process evicted it
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def load_bytecode(self, bucket):
+        """Load bytecode for 'bucket' from disk, if cached."""
+        path = self._entry_path(bucket.key)
+        try:
+            with open(path, 'rb') as entry:
+                bucket.load_bytecode(entry)
+        except (IOError, OSError):
+            return
+        # bump the mtime so eviction is least-recently-used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def dump_bytecode(self, bucket):
+        """Atomically write the bytecode for 'bucket' to disk."""
+        path = self._entry_path(bucket.key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as entry:
+                bucket.write_bytecode(entry)
+            size = os.path.getsize(tmp_path)
+            try:
+                os.rename(tmp_path, path)
+            except OSError:
+                # windows will not rename over an existing file
+                os.remove(path)
+                os.rename(tmp_path, path)
+        except (IOError, OSError) as err:
+            LOG.debug("Could not write bytecode cache entry %s: %s",
+                      path, err)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        if self._size is None:
+            self._size = sum(entry[1] for entry in self._entries())
+        else:
+            self._size += size
+        if self._size > self.max_size:
+            self.prune()
+
+    def prune(self):
+        """Evict least recently used entries until under 'max_size'."""
+        entries = sorted(self._entries())
+        total = sum(entry[1] for entry in entries)
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            LOG.debug("Evicted bytecode cache entry %s", path)
+            total -= size
+        self._size = total
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._size = 0
+
+
+def configure_cache(directory, max_size=DEFAULT_CACHE_SIZE):
+    """Configure the on-disk bytecode cache used to compile templates.
+
+    Pass a falsy 'directory' to disable the cache. Returns the cache.
+    """
+    cache = None
+    if directory:
+        try:
+            cache = BytecodeCache(directory, max_size=max_size)
+        except OSError as err:
+            LOG.warning("Template cache disabled, cannot use %s: %s",
+                        directory, err)
+    JINJA_ENV.bytecode_cache = cache
+    with _ENVIRONMENTS_LOCK:
+        for env in _ENVIRONMENTS.values():
+            env.bytecode_cache = cache
+    return cache
+
+
+def cache_stats():
+    """Return (hits, misses) for the configured bytecode cache."""
+    cache = JINJA_ENV.bytecode_cache
+    if cache is None:
+        return 0, 0
+    return cache.hits, cache.misses
+
+
+def compile_template(source, name=None, filename=None, env=None):
+    """Compile 'source' into a jinja Template, via the bytecode cache.
+
+    This is what env.from_string() does, except that the compiled code
+    is looked up in (and saved to) the environment's bytecode cache.
+    """
+    env = env or JINJA_ENV
+    bcc = env.bytecode_cache
+    if bcc is None:
+        code = env.compile(source, name, filename)
+    else:
+        bucket = bcc.get_bucket(env, name, filename, source)
+        code = bucket.code
+        if code is None:
+            code = env.compile(source, name, filename)
+            bucket.code = code
+            bcc.set_bucket(bucket)
+    return env.template_class.from_code(
+        env, code, env.make_globals(None), None)
+
+
+def _template_name(env, path):
+    """Return the loader name for 'path' in env, or None if not loadable."""
+    if not getattr(env, 'searchpath', None):
+        return None
+    relpath = os.path.relpath(path, env.searchpath)
+    if relpath.split(os.sep, 1)[0] == os.pardir:
+        return None
+    return relpath.replace(os.sep, '/')
+
+
+def get_template(path, env=None):
+    """Return the compiled jinja Template for the file at 'path'.
+
+    Templates under the env's loader search path come from its template
+    cache; anything else is read and compiled on the spot.
+    """
+    env = env or JINJA_ENV
+    if not archive.isfile(path):
+        raise ValueError("Template file %s not found"
+                         % os.path.relpath(path))
+    try:
+        with timings.phase('compile'):
+            name = _template_name(env, path)
+            if name is not None:
+                return env.get_template(name)
+            with archive.open_file(path) as f:
+                text = f.read()
+            return compile_template(text, filename=path, env=env)
+    except jinja2.TemplateSyntaxError as err:
+        msg = ("Error rendering jinja2 template for file %s "
+               "on line %s. Error: %s"
+               % (path, err.lineno, err.message))
+        raise type(err)(
+            msg, err.lineno, filename=os.path.basename(path))
+
+
+def referenced_templates(env, name):
+    """Return the names of the templates 'name' of env refers to.
+
+    Those it includes, imports or extends itself, not recursively. None
+    stands for any name only known when rendering.
+    """
+    source = env.loader.get_source(env, name)[0]
+    return list(meta.find_referenced_templates(env.parse(source)))
+
+
+def render_file(path, template_map, env=None):
+    """Render the jinja template at 'path' according to template_map."""
+    template = get_template(path, env=env)
+    result = template.render(**template_map)
+    if not result.endswith('\n'):
+        result += '\n'
+    return result
+
+
+def stream_file(path, template_map, env=None):
+    """Render the jinja template at 'path' chunk by chunk.
+
+    Like render_file(), the output always ends with a newline.
+
+    Yields unicode chunks.
+    """
+    template = get_template(path, env=env)
+    last = ''
+    for chunk in template.generate(**template_map):
+        if chunk:
+            last = chunk
+            yield chunk
+    if not last.endswith('\n'):
+        yield '\n'
+
+
+def _init_worker(cache_dir, cache_size):
+    """Configure the bytecode cache in a render pool worker."""
+    configure_cache(cache_dir, max_size=cache_size)
+
+
+def _render_job(job):
+    """Render one (env key, path, template_map) job in a pool worker."""
+    key, path, template_map = job
+    env = get_environment(*key) if key else JINJA_ENV
+    return path, render_file(path, template_map, env=env)
+
+
+def render_pool(jobs):
+    """Return a pool of 'jobs' worker processes for render_files().
+
+    Workers share the bytecode cache configured in this process.
+    """
+    cache = JINJA_ENV.bytecode_cache
+    if cache is None:
+        initargs = (None, DEFAULT_CACHE_SIZE)
+    else:
+        initargs = (cache.directory, cache.max_size)
+    return multiprocessing.Pool(jobs, initializer=_init_worker,
+                                initargs=initargs)
+
+
+def render_files(files, template_map, env=None, pool=None):
+    """Render the jinja template 'files' according to template_map.
+
+    Templates are loaded through 'env' (see get_environment()). With a
+    'pool' (see render_pool()) templates are rendered concurrently, but
+    results are still yielded in the order of 'files'.
+
+    Yields (path, result)
+    """
+    if pool is None:
+        for path in files:
+            yield path, render_file(path, template_map, env=env)
+        return
+
+    key = None
+    if getattr(env, 'searchpath', None):
+        key = (env.searchpath, env.compiled)
+    jobs = [(key, path, template_map) for path in files]
+    for path, result in pool.imap(_render_job, jobs):
+        yield path, result
 
 
 def render_templates(*files, **template_map):
@@ -53,23 +473,4 @@ def render_templates_generator(*files, **template_map):
 
     Yields (path, result)
     """
-    for path in files:
-        if not os.path.isfile(path):
-            raise ValueError("Template file %s not found"
-                             % os.path.relpath(path))
-        else:
-            try:
-                with codecs.open(path, encoding='utf-8') as f:
-                    text = f.read()
-                template = JINJA_ENV.from_string(text)
-            except jinja2.TemplateSyntaxError as err:
-                msg = ("Error rendering jinja2 template for file %s "
-                       "on line %s. Error: %s"
-                       % (path, err.lineno, err.message))
-                raise type(err)(
-                    msg, err.lineno, filename=os.path.basename(path))
-
-            result = template.render(**template_map)
-            if not result.endswith('\n'):
-                result += '\n'
-            yield path, result
+    return render_files(files, template_map)
@@ -0,0 +1,137 @@
+# Copyright 2015 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Fastfood build timings.
+
+A cheap, always available breakdown of where a build spends its time:
+fastfood wraps each phase of its work in phase() and each stencil in
+stencil(), and `fastfood --timings` prints the wall time of each.
+
+The time of a phase excludes the phases nested in it, so rendering a
+template does not count the time spent compiling it. Phases timed by
+other threads (see TemplatePack.preload()) overlap the phase waiting on
+them instead.
+"""
+
+import collections
+import contextlib
+import threading
+import time
+
+# python 2 has no perf_counter
+# pylint: disable=invalid-name
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+class Timings(object):
+
+    """Wall time per phase and per stencil, collected while enabled."""
+
+    def __init__(self):
+        """Initialize, disabled."""
+        self.enabled = False
+        # phases and stencils are added to by preload threads too
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget everything collected so far."""
+        # {phase: [seconds, calls]}
+        self.phases = collections.OrderedDict()
+        # {stencil: seconds}
+        self.stencils = collections.OrderedDict()
+        self.started = _clock()
+        # time spent in nested phases, for each phase being timed, per
+        # thread
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time the block as the phase 'name'."""
+        if not self.enabled:
+            yield
+            return
+        nested = getattr(self._local, 'nested', None)
+        if nested is None:
+            nested = self._local.nested = []
+        start = _clock()
+        nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = _clock() - start
+            exclusive = elapsed - nested.pop()
+            with self._lock:
+                entry = self.phases.setdefault(name, [0.0, 0])
+                entry[0] += exclusive
+                entry[1] += 1
+            if nested:
+                nested[-1] += elapsed
+
+    @contextlib.contextmanager
+    def stencil(self, name):
+        """Time the block, phases included, as the stencil 'name'."""
+        if not self.enabled:
+            yield
+            return
+        start = _clock()
+        try:
+            yield
+        finally:
+            elapsed = _clock() - start
+            with self._lock:
+                self.stencils[name] = self.stencils.get(name, 0.0) + elapsed
+
+    def iterate(self, name, iterable):
+        """Yield the items of iterable, timing each step as phase 'name'."""
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def table(self):
+        """Return the timings collected since reset(), as a text table."""
+        total = _clock() - self.started
+        lines = ['%-24s %8s %10s %7s' % ('Phase', 'Calls', 'Seconds', '%')]
+        accounted = 0.0
+        for name, (seconds, calls) in self.phases.items():
+            accounted += seconds
+            lines.append('%-24s %8d %10.4f %6.1f%%'
+                         % (name, calls, seconds, _percent(seconds, total)))
+        lines.append('%-24s %8s %10.4f %6.1f%%'
+                     % ('(other)', '', total - accounted,
+                        _percent(total - accounted, total)))
+        lines.append('%-24s %8s %10.4f' % ('total', '', total))
+        if self.stencils:
+            lines.append('')
+            lines.append('%-33s %10s %7s' % ('Stencil', 'Seconds', '%'))
+            for name, seconds in self.stencils.items():
+                lines.append('%-33s %10.4f %6.1f%%'
+                             % (name, seconds, _percent(seconds, total)))
+        return '\n'.join(lines)
+
+
+def _percent(part, total):
+    """Return part as a percentage of total."""
+    return 100.0 * part / total if total else 0.0
+
+
+TIMINGS = Timings()
+phase = TIMINGS.phase
+stencil = TIMINGS.stencil
+iterate = TIMINGS.iterate
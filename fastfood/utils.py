@@ -18,7 +18,10 @@
 """Fastfood utils."""
 from __future__ import print_function
 
+import collections
 import copy
+import hashlib
+import json
 import os
 try:
     from StringIO import StringIO
@@ -26,6 +29,7 @@ except ImportError:
     # Python 3
     from io import StringIO
 
+
 # python 2 vs. 3 string types
 try:
     basestring
@@ -41,6 +45,43 @@ def normalize_path(path):
     return os.path.abspath(os.path.expanduser(os.path.normpath(path)))
 
 
+def file_stamp(path):
+    """Return [mtime, size] for path, or None if it does not exist.
+
+    Used to tell whether a file changed since it was last looked at.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        # archive imports utils
+        from fastfood import archive
+        located = archive.locate(path)
+        if located is None or located[1] not in located[0].files:
+            return None
+        size, mtime, _ = located[0].files[located[1]]
+        return [mtime, size]
+    return [stat.st_mtime, stat.st_size]
+
+
+def file_hash(path, blocksize=65536):
+    """Return the sha1 hexdigest of the file at path, or None if missing."""
+    from fastfood import archive
+    digest = hashlib.sha1()
+    try:
+        with archive.open_file(path, 'rb') as stream:
+            for block in iter(lambda: stream.read(blocksize), b''):
+                digest.update(block)
+    except (IOError, OSError):
+        return None
+    return digest.hexdigest()
+
+
+def data_hash(data):
+    """Return the sha1 hexdigest of JSON-serializable data."""
+    serialized = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+
 def ruby_strip(chars):
     """Strip whitespace and any quotes."""
     return chars.strip(' "\'')
@@ -85,16 +126,70 @@ def deepupdate(original, update, levels=5):
                 original.update({key: val})
 
 
+def deepmerge(original, update, levels=5):
+    """Return 'original' updated from 'update', like deepupdate().
+
+    Neither is changed: the result shares what was not updated with them.
+    """
+    merged = dict(original)
+    for key, val in dict(update).items():
+        if levels > 0 and isinstance(original.get(key), dict):
+            if not isinstance(val, dict):
+                raise TypeError("Trying to update dict %s with "
+                                "non-dict %s" % (original[key], val))
+            merged[key] = deepmerge(original[key], val, levels=levels-1)
+        else:
+            merged[key] = val
+    return merged
+
+
+class FrozenDict(dict):
+
+    """A dict that cannot be changed, shared instead of copied.
+
+    It is still a dict to json and isinstance(); copies and pickles of it
+    are plain dicts, to be changed at will.
+    """
+
+    def _frozen(self, *args, **kwargs):
+        """Refuse to change the dict."""
+        raise TypeError("'%s' object is read-only" % type(self).__name__)
+
+    __setitem__ = __delitem__ = __ior__ = _frozen
+    clear = pop = popitem = setdefault = update = _frozen
+
+    def __reduce__(self):
+        """Copy (or pickle) as a plain dict."""
+        return dict, (dict(self),)
+
+
+def freeze(data):
+    """Return data with its dicts, however deep, turned into FrozenDicts.
+
+    Lists become tuples.
+    """
+    if isinstance(data, dict):
+        return FrozenDict((key, freeze(val)) for key, val in data.items())
+    if isinstance(data, (list, tuple)):
+        return tuple(freeze(val) for val in data)
+    return data
+
+
 class FileWrapper(object):
 
     """Helps wrap ruby files, usually.
 
-    Like metadata.rb and Berksfile.
+    Like metadata.rb and Berksfile, read as a ruby.Document. Subclasses
+    implement parse(), whose result is kept, like the document, until the
+    file is written to through the wrapper.
     """
 
     def __init__(self, stream):
         """Initialize the wrapper with a file-like object."""
         self.stream = stream
+        # the document and what parse() returned, until the next write
+        self._document = None
+        self._parsed = None
 
     @classmethod
     def from_string(cls, contents):
@@ -120,9 +215,58 @@ class FileWrapper(object):
             raise AttributeError("'%s' object has no attribute '%s'"
                                  % (type(self).__name__, attr))
 
+    @property
+    def document(self):
+        """The file as a ruby.Document."""
+        from fastfood import ruby
+
+        if self._document is None:
+            self.seek(0)
+            self._document = ruby.parse(self.read())
+            self.seek(0)
+        return self._document
+
+    def parse(self):
+        """Parse the file into a dict."""
+        raise NotImplementedError
+
+    @property
+    def parsed(self):
+        """The parsed file, shared by every caller: do not modify it.
+
+        The file is only parsed again after a write through the wrapper.
+        """
+        if self._parsed is None:
+            self.seek(0)
+            self._parsed = self.parse()
+        return self._parsed
+
+    def to_dict(self):
+        """Return a dictionary representation of this file."""
+        return copy.deepcopy(self.parsed)
+
+    def write(self, data):
+        """Write data to the file, forgetting its parsed content."""
+        self._document = self._parsed = None
+        return self.stream.write(data)
+
+    def writelines(self, lines):
+        """Write lines to the file, forgetting its parsed content."""
+        self._document = self._parsed = None
+        return self.stream.writelines(lines)
+
+    def truncate(self, *args):
+        """Truncate the file, forgetting its parsed content."""
+        self._document = self._parsed = None
+        return self.stream.truncate(*args)
+
     def write_statements(self, statements):
         """Insert the statements into the file neatly.
 
+        Each goes after the last (unindented) statement starting with the
+        same word, or at the end of the file. The rest of the file is left
+        as it was.
+
         Ex:
 
         statements = ["good  'dog'", "good 'cat'", "bad  'rat'", "fat 'emu'"]
@@ -143,35 +287,51 @@ class FileWrapper(object):
         bad 'rat'
         fat 'emu'
         """
-        self.seek(0)
-        original_content_lines = self.readlines()
-        new_content_lines = copy.copy(original_content_lines)
+        from fastfood import ruby
+
+        original = self.document.statements
         # ignore blanks and sort statements to be written
         statements = sorted([stmnt for stmnt in statements if stmnt])
+        if not statements:
+            return
 
-        # find all the insert points for each statement
+        # find the insert point for each statement: after the last
+        # statement starting with the same word, OR at the end of the file
         uniqs = {stmnt.split(None, 1)[0] for stmnt in statements}
         insert_locations = {}
-        for line in reversed(original_content_lines):
+        for index in range(len(original) - 1, -1, -1):
             if not uniqs:
                 break
-            if not line:
-                continue
-            for word in uniqs.copy():
-                if line.startswith(word):
-                    index = original_content_lines.index(line) + 1
-                    insert_locations[word] = index
-                    uniqs.remove(word)
+            word = original[index].keyword
+            if word in uniqs and not original[index].indented:
+                insert_locations[word] = index + 1
+                uniqs.remove(word)
 
+        # {insert point: [statement, ...]}
+        inserts = collections.defaultdict(list)
         for statement in statements:
             print("writing to %s : %s" % (self, statement))
             startswith = statement.split(None, 1)[0]
-            # insert new statement with similar OR at the end of the file
-            new_content_lines.insert(
-                insert_locations.get(startswith, len(new_content_lines)),
-                statement)
-
-        if new_content_lines != original_content_lines:
-            self.seek(0)
-            self.writelines(new_content_lines)
-            self.flush()
+            if not statement.endswith('\n'):
+                statement += '\n'
+            inserts[insert_locations.get(startswith, len(original))].extend(
+                ruby.parse(statement))
+
+        # one pass, copying the original statements between insert points
+        new_statements = []
+        start = 0
+        for location in sorted(inserts):
+            new_statements.extend(original[start:location])
+            if new_statements and not new_statements[-1].text.endswith('\n'):
+                # the last line had no newline
+                new_statements[-1] = ruby.Statement(
+                    new_statements[-1].text + '\n')
+            new_statements.extend(inserts[location])
+            start = location
+        new_statements.extend(original[start:])
+
+        document = ruby.Document(new_statements)
+        self.seek(0)
+        self.write(document.text)
+        self.flush()
+        self._document = document
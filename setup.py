@@ -83,7 +83,7 @@ package_attributes = {
     'keywords': ' '.join(about['__keywords__']),
     'license': about['__license__'],
     'long_description': LONG_DESCRIPTION,
-    'packages': find_packages(exclude=['tests']),
+    'packages': find_packages(exclude=['tests', 'benchmarks']),
     'test_suite': 'tests',
     'tests_require': TESTS_REQUIRE,
     'url': about['__url__'],
@@ -52,6 +52,18 @@ class TestFastfoodCommands(unittest.TestCase):
             'cookbook': None,
             'cookbook_name': None,
             'force': None,
+            'jobs': None,
+            'stream': False,
+            'no_incremental': False,
+            'dry_run': False,
+            'atomic': False,
+            'durability': 'none',
+            'binaries': 'copy',
+            'events': None,
+            'packs': None,
+            'no_cache': True,
+            'cache_dir': None,
+            'cache_size': 64,
             'options': None,  # stencil options
             'config_file': None,  # for `fastfood build`
         }
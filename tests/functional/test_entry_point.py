@@ -1,8 +1,40 @@
 """Functional tests for command line use."""
 
+import os
 import subprocess
+import sys
 import unittest
 
+TEST_TEMPLATEPACK = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                 'test_templatepack')
+# modules only a command rendering templates (or --latest, serve, or
+# reading an archive) should load
+HEAVY_MODULES = ('jinja2', 'fastfood.templating', 'fastfood.food',
+                 'fastfood.plan', 'fastfood.ruby', 'fastfood.server',
+                 'multiprocessing', 'urllib.request', 'tarfile', 'zipfile',
+                 'bz2', 'lzma')
+
+
+def import_times(*args, **env):
+    """Run python args, returning {module: cumulative import usecs}."""
+    proc = subprocess.Popen(
+        [sys.executable, '-X', 'importtime'] + list(args),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        env=dict(os.environ, **env), universal_newlines=True)
+    _, stderr = proc.communicate()
+    if proc.returncode:
+        raise AssertionError(stderr)
+    times = {}
+    for line in stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, module = line.split('|')
+            try:
+                times[module.strip()] = int(cumulative)
+            except ValueError:
+                # the header
+                continue
+    return times
+
 
 class TestFastfoodCLI(unittest.TestCase):
 
@@ -25,5 +57,44 @@ class TestFastfoodCLI(unittest.TestCase):
         self.assertIn('usage', str(output).lower())
 
 
+@unittest.skipIf(sys.version_info < (3, 7), "needs python -X importtime")
+class TestFastfoodStartup(unittest.TestCase):
+
+    """Guard `fastfood list` and `show` against slow imports."""
+
+    @classmethod
+    def setUpClass(cls):
+        # argparse loads shutil to size help, which loads bz2 and lzma on
+        # some pythons: fastfood cannot help those
+        cls.unavoidable = set(import_times('-c', 'import shutil'))
+
+    def import_times(self, *argv):
+        """Run fastfood argv, returning {module: cumulative import usecs}."""
+        code = ('import sys; from fastfood import shell; '
+                'shell.main(sys.argv[1:])')
+        return import_times('-c', code, *argv,
+                            FASTFOOD_TEMPLATE_PACK=TEST_TEMPLATEPACK,
+                            FASTFOOD_NO_DAEMON='1')
+
+    def assertLight(self, *argv):
+        times = self.import_times(*argv)
+        self.assertIn('fastfood.shell', times)
+        for module in HEAVY_MODULES:
+            if module in self.unavoidable:
+                continue
+            self.assertNotIn(module, times,
+                             "`fastfood %s` imports %s" % (" ".join(argv),
+                                                           module))
+
+    def test_list_is_light(self):
+        self.assertLight('list')
+
+    def test_show_is_light(self):
+        self.assertLight('show', 'newrelic')
+
+    def test_help_is_light(self):
+        self.assertLight('--help')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,10 +1,25 @@
 """Functional tests for command line use."""
 
+import shutil
 import tempfile
 import unittest
 import os
 from datetime import date
 
+try:
+    from StringIO import StringIO
+except ImportError:
+    # Python 3
+    from io import StringIO
+
+try:
+    import mock
+except ImportError:
+    # Python 3
+    import unittest.mock as mock
+
+from fastfood import book
+from fastfood import food
 from fastfood import shell
 
 from test_commands import TestFastfoodCommands
@@ -97,6 +112,238 @@ class TestFastfoodBuildCommand(TestFastfoodCommands):
         rackspace_jpg = os.path.join(cookbook.path, 'images', 'rackspace.jpg')
         self.assertFileExists(rackspace_jpg)
 
+    def assertSameBuild(self, first, second):
+        serial_written, serial_cookbook = first
+        written, cookbook = second
+        relative = [os.path.relpath(path, cookbook.path) for path in written]
+        self.assertEqual(
+            relative,
+            [os.path.relpath(path, serial_cookbook.path)
+             for path in serial_written])
+        for path in relative:
+            with open(os.path.join(serial_cookbook.path, path), 'rb') as f:
+                serial_content = f.read()
+            with open(os.path.join(cookbook.path, path), 'rb') as f:
+                self.assertEqual(f.read(), serial_content)
+
+    def build_twice(self, **args):
+        self.build_config_file = tempfile.NamedTemporaryFile(mode='w+')
+        self.build_config_file.write(BUILD_CONFIG)
+        self.build_config_file.seek(0)
+        self.args.config_file = self.build_config_file.name
+
+        first = shell._fastfood_build(self.args)
+        self.args.cookbooks = self.create_tempdir(suffix='.second')
+        for key, val in args.items():
+            setattr(self.args, key, val)
+        return first, shell._fastfood_build(self.args)
+
+    def test_fastfood_build_parallel_matches_serial(self):
+        self.assertSameBuild(*self.build_twice(jobs=3))
+
+    def test_fastfood_build_stream_matches_buffered(self):
+        self.assertSameBuild(*self.build_twice(stream=True))
+
+    def test_fastfood_build_atomic_matches_plain(self):
+        first, second = self.build_twice(atomic=True, durability='batch')
+        self.assertSameBuild(first, second)
+        cookbook = second[1]
+        # the staging dir is gone
+        self.assertEqual(os.listdir(os.path.dirname(cookbook.path)),
+                         [os.path.basename(cookbook.path)])
+
+    def test_fastfood_build_from_archives(self):
+        for fmt in ('zip', 'gztar', 'tar'):
+            base = os.path.join(self.create_tempdir(), 'pack')
+            self.args.template_pack = shutil.make_archive(
+                base, fmt, os.path.dirname(self.templatepack_path),
+                os.path.basename(self.templatepack_path))
+            self.args.cookbooks = self.create_tempdir()
+            self.assertSameBuild(*self.build_twice(
+                template_pack=self.templatepack_path))
+
+    def test_fastfood_build_stream_skips_without_rendering(self):
+        _, (_, cookbook) = self.build_twice(stream=True, no_incremental=True)
+        with mock.patch('fastfood.templating.get_template') as get_template:
+            written, _ = shell._fastfood_build(self.args)
+        self.assertFalse(get_template.called)
+        self.assertEqual(written, [])
+
+    def rebuild_stencils(self):
+        """Rebuild, returning the names of the stencil sets processed."""
+        with mock.patch('fastfood.food.process_stencil',
+                        side_effect=food.process_stencil) as process:
+            shell._fastfood_build(self.args)
+        return [os.path.basename(call[0][4].path)
+                for call in process.call_args_list]
+
+    def test_fastfood_build_incremental(self):
+        _, (_, cookbook) = self.build_twice()
+        ledger = os.path.join(cookbook.path, '.fastfood.lock')
+        self.assertTrue(os.path.isfile(ledger))
+
+        # nothing changed, not even the ledger
+        os.utime(ledger, (1, 1))
+        self.assertEqual(self.rebuild_stencils(), [])
+        self.assertEqual(os.stat(ledger).st_mtime, 1)
+
+        # an output went missing
+        newrelic_rb = os.path.join(cookbook.path, 'recipes', 'newrelic.rb')
+        os.remove(newrelic_rb)
+        self.assertEqual(self.rebuild_stencils(), ['newrelic'])
+        self.assertTrue(os.path.isfile(newrelic_rb))
+        self.assertEqual(self.rebuild_stencils(), [])
+
+        # the config entry changed
+        with open(self.args.config_file, 'w') as cfg:
+            cfg.write(BUILD_CONFIG.replace('"openfor"', '"openedfor"'))
+        self.assertEqual(self.rebuild_stencils(), ['utility'])
+
+        # --force and --no-incremental build everything
+        self.args.force = True
+        self.assertEqual(len(self.rebuild_stencils()), 5)
+        self.args.force = False
+        self.args.no_incremental = True
+        self.assertEqual(len(self.rebuild_stencils()), 5)
+
+    def test_fastfood_build_incremental_inputs(self):
+        self.args.template_pack = os.path.join(self.create_tempdir(), 'pack')
+        shutil.copytree(self.templatepack_path, self.args.template_pack)
+        recipes = os.path.join(self.args.template_pack, 'stencils',
+                               'utility', 'recipes')
+        with open(os.path.join(recipes, 'default.rb'), 'a') as recipe:
+            recipe.write("{% include 'recipes/_part.rb' %}\n")
+        with open(os.path.join(recipes, '_part.rb'), 'w') as part:
+            part.write("# part v1\n")
+        _, (_, cookbook) = self.build_twice()
+        self.assertEqual(self.rebuild_stencils(), [])
+
+        # an included template changed
+        with open(os.path.join(recipes, '_part.rb'), 'w') as part:
+            part.write("# part v2\n")
+        self.assertEqual(self.rebuild_stencils(), ['utility'])
+        self.assertEqual(self.rebuild_stencils(), [])
+
+        # the metadata every template renders with changed
+        with open(os.path.join(cookbook.path, 'metadata.rb'), 'a') as rb:
+            rb.write("version '9.9.9'\n")
+        self.assertEqual(len(self.rebuild_stencils()), 5)
+        self.assertEqual(self.rebuild_stencils(), [])
+
+    @mock.patch('sys.stdout', new_callable=StringIO)
+    def test_fastfood_build_force_skips_identical_files(self, stdout):
+        for stream in (False, True):
+            _, (_, cookbook) = self.build_twice(stream=stream)
+            default_rb = os.path.join(cookbook.path, 'recipes', 'default.rb')
+            mtime = os.path.getmtime(default_rb) - 10
+            os.utime(default_rb, (mtime, mtime))
+
+            self.args.force = True
+            self.args.no_incremental = True
+            written, _ = shell._fastfood_build(self.args)
+            self.assertEqual(written, [])
+            self.assertEqual(os.path.getmtime(default_rb), mtime)
+            self.assertIn(' up to date (25 unchanged, 1 skipped)',
+                          stdout.getvalue())
+            self.args.force = False
+            self.args.no_incremental = False
+
+    @mock.patch('sys.stdout', new_callable=StringIO)
+    def test_fastfood_build_writes_each_file_once(self, stdout):
+        _, (_, cookbook) = self.build_twice()
+        writes = [line for line in stdout.getvalue().splitlines()
+                  if line.startswith('Writing rendered file %s'
+                                     % cookbook.path)]
+        self.assertEqual(len(writes), len(set(writes)))
+        self.assertIn('Writing rendered file %s'
+                      % os.path.join(cookbook.path, '.kitchen.yml'), writes)
+
+    @mock.patch('sys.stdout', new_callable=StringIO)
+    def test_fastfood_build_merges_dependencies_once(self, stdout):
+        with mock.patch.object(book.MetadataRb, 'merge', autospec=True,
+                               side_effect=book.MetadataRb.merge) as merge:
+            _, (_, cookbook) = self.build_twice()
+        # once for each of the two builds
+        self.assertEqual(merge.call_count, 2)
+        depends = cookbook.metadata.to_dict()['depends']
+        for name in ('sudo', 'nodejs', 'newrelic', 'ulimit'):
+            self.assertIn(name, depends)
+
+    @mock.patch('sys.stdout', new_callable=StringIO)
+    def test_fastfood_build_dry_run(self, stdout):
+        self.build_config_file = tempfile.NamedTemporaryFile(mode='w+')
+        self.build_config_file.write(BUILD_CONFIG)
+        self.build_config_file.seek(0)
+        self.args.config_file = self.build_config_file.name
+        self.args.dry_run = True
+
+        written, cookbook = shell._fastfood_build(self.args)
+        self.assertTrue(written)
+        self.assertFalse(os.path.exists(cookbook.path))
+        self.assertIn('Would create %s'
+                      % os.path.join(cookbook.path, 'metadata.rb'),
+                      stdout.getvalue())
+
+
+class TestFastfoodBatchBuildCommand(TestFastfoodCommands):
+
+    def write_configs(self, *names):
+        config_dir = self.create_tempdir(suffix='.configs')
+        for name in names:
+            with open(os.path.join(config_dir, '%s.json' % name), 'w') as f:
+                f.write(BUILD_CONFIG.replace('test_build_cookbook', name))
+        return config_dir
+
+    def test_fastfood_build_directory(self):
+        self.args.config_file = [self.write_configs('one', 'two', 'three')]
+        results = shell._fastfood_build(self.args)
+
+        self.assertEqual([os.path.basename(result.cookbook)
+                          for result in results],
+                         ['one', 'three', 'two'])
+        for result in results:
+            self.assertEqual(result.exit_code, 0)
+            self.assertTrue(result.written_files)
+            self.assertFileContains(
+                os.path.join(result.cookbook, 'metadata.rb'),
+                os.path.basename(result.cookbook))
+
+    @mock.patch('sys.stdout')
+    def test_fastfood_build_glob_with_failures(self, _):
+        config_dir = self.write_configs('good', 'alsogood')
+        with open(os.path.join(config_dir, 'bad.json'), 'w') as f:
+            f.write('{"name": "bad", "stencils": [{"stencil_set": "nope"}]}')
+        self.args.config_file = [os.path.join(config_dir, '*.json')]
+        self.args.jobs = 2
+
+        with self.assertRaises(SystemExit) as exit_:
+            shell._fastfood_build(self.args)
+        self.assertEqual(exit_.exception.code, 1)
+        for name in ('good', 'alsogood'):
+            self.assertTrue(os.path.isfile(
+                os.path.join(self.cookbooks_path, name, 'metadata.rb')))
+
+    @mock.patch('sys.stderr', new_callable=StringIO)
+    def test_fastfood_build_usage_errors(self, stderr):
+        config_dir = self.write_configs('one', 'two')
+        for config_file, events, stream in (
+                (os.path.join(config_dir, '*.nope'), None, False),
+                (config_dir, os.path.join(config_dir, 'events.log'), False),
+                (os.path.join(config_dir, 'one.json'), None, True)):
+            self.args.config_file = [config_file]
+            self.args.events = events
+            self.args.stream = stream
+            self.args.jobs = 2
+            with self.assertRaises(SystemExit) as exit_:
+                shell._fastfood_build(self.args)
+            self.assertEqual(exit_.exception.code, 2)
+        self.assertIn('No config files found', stderr.getvalue())
+        self.assertIn('--events cannot be used with --jobs',
+                      stderr.getvalue())
+        self.assertIn('--stream cannot be used with --jobs',
+                      stderr.getvalue())
+        self.assertFalse(os.listdir(self.cookbooks_path))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,90 @@
+"""Functional tests for `fastfood compile`."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import mock
+except ImportError:
+    # Python 3
+    import unittest.mock as mock
+
+import jinja2
+
+from fastfood import pack
+from fastfood import shell
+
+from test_commands import TestFastfoodCommands
+from test_fastfood_build_command import BUILD_CONFIG
+
+
+class TestFastfoodCompileCommand(TestFastfoodCommands):
+
+    def setUp(self):
+        super(TestFastfoodCompileCommand, self).setUp()
+        # compile a copy, the artifacts are written into the pack
+        self.templatepack_path = os.path.join(
+            self.create_tempdir(suffix='.pack'), 'pack')
+        shutil.copytree(self.pack.path, self.templatepack_path)
+        self.args.template_pack = self.templatepack_path
+        self.args.pack_path = None
+        self.args.format = 'zip'
+
+    def build(self):
+        build_config_file = tempfile.NamedTemporaryFile(mode='w+')
+        build_config_file.write(BUILD_CONFIG)
+        build_config_file.seek(0)
+        self.args.config_file = build_config_file.name
+        self.args.cookbooks = self.create_tempdir(suffix='.cookbooks')
+        return shell._fastfood_build(self.args)
+
+    def test_build_from_compiled(self):
+        index = shell._fastfood_compile(self.args)
+        self.assertEqual(sorted(index['stencil_sets']),
+                         sorted(self.pack.stencil_sets))
+
+        template_pack = pack.TemplatePack(self.templatepack_path)
+        apache = template_pack.load_stencil_set('apache')
+        self.assertEqual(apache.compiled,
+                         os.path.join(template_pack.compiled_path,
+                                      'apache.zip'))
+
+        # templates are imported, never read from their source
+        with mock.patch.object(jinja2.FileSystemLoader, 'get_source') as src:
+            _, cookbook = self.build()
+        self.assertFalse(src.called)
+        kitchen_yml = os.path.join(cookbook.path, '.kitchen.yml')
+        self.assertFileContains(kitchen_yml, 'test_build_cookbook::_apache')
+
+    def test_stale_compiled_templates(self):
+        self.args.format = 'modules'
+        shell._fastfood_compile(self.args)
+        template = os.path.join(self.templatepack_path, 'stencils',
+                                'apache', 'recipes', '_apache.rb.jinja2')
+        with open(template, 'a') as tpl:
+            tpl.write('# recompile me\n')
+
+        template_pack = pack.TemplatePack(self.templatepack_path)
+        self.assertIsNone(template_pack.load_stencil_set('apache').compiled)
+        self.assertIsNotNone(template_pack.load_stencil_set('base').compiled)
+
+        _, cookbook = self.build()
+        recipe = os.path.join(cookbook.path, 'recipes', '_apache.rb')
+        self.assertFileContains(recipe, '# recompile me')
+
+    def test_checkout_keeps_compiled_templates(self):
+        shell._fastfood_compile(self.args)
+        # a fresh checkout: same content, every mtime changed
+        for root, _, files in os.walk(self.templatepack_path):
+            for name in files:
+                os.utime(os.path.join(root, name), (1, 1))
+
+        template_pack = pack.TemplatePack(self.templatepack_path)
+        for name in template_pack.stencil_sets:
+            self.assertIsNotNone(template_pack.load_stencil_set(name).compiled)
+
+
+if __name__ == '__main__':
+    unittest.main()
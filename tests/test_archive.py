@@ -0,0 +1,116 @@
+"""Template packs in archives related tests."""
+
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+try:
+    import mock
+except ImportError:
+    # Python 3
+    import unittest.mock as mock
+
+from fastfood import archive
+from fastfood import exc
+from fastfood import food
+from fastfood import pack
+from fastfood import utils
+
+TEST_TEMPLATEPACK = os.path.join(os.path.dirname(__file__),
+                                 'test_templatepack')
+JPG = os.path.join('stencils', 'base', 'files', 'rackspace.jpg')
+
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='%s-' % __name__)
+        self.addCleanup(shutil.rmtree, self.tempdir)
+
+    def make(self, fmt, top=True):
+        """Archive the test template pack, in a top dir if 'top'."""
+        base = os.path.join(self.tempdir, fmt)
+        if top:
+            return shutil.make_archive(
+                base, fmt, os.path.dirname(TEST_TEMPLATEPACK),
+                os.path.basename(TEST_TEMPLATEPACK))
+        return shutil.make_archive(base, fmt, TEST_TEMPLATEPACK)
+
+    def test_pack_root(self):
+        for fmt in ('zip', 'tar', 'gztar', 'bztar'):
+            path = self.make(fmt)
+            template_pack = pack.TemplatePack(path)
+            self.assertEqual(template_pack.path,
+                             os.path.join(path, 'test_templatepack'))
+            self.assertIsNone(template_pack.index_path)
+            self.assertEqual(pack.TemplatePack(self.make(fmt, top=False)).path,
+                             path)
+
+    def test_members(self):
+        for fmt in ('zip', 'gztar'):
+            template_pack = pack.TemplatePack(self.make(fmt, top=False))
+            jpg = os.path.join(template_pack.path, JPG)
+            with open(os.path.join(TEST_TEMPLATEPACK, JPG), 'rb') as stream:
+                content = stream.read()
+            self.assertTrue(archive.isfile(jpg))
+            self.assertTrue(archive.isdir(os.path.dirname(jpg)))
+            self.assertFalse(archive.isfile(os.path.dirname(jpg)))
+            self.assertEqual(archive.getsize(jpg), len(content))
+            with archive.open_file(jpg, 'rb') as stream:
+                self.assertEqual(stream.read(), content)
+            self.assertEqual(utils.file_hash(jpg),
+                             utils.file_hash(os.path.join(TEST_TEMPLATEPACK,
+                                                          JPG)))
+            self.assertEqual(utils.file_stamp(jpg)[1], len(content))
+            self.assertIsNone(utils.file_stamp(jpg + '.missing'))
+
+    def test_stencil_set(self):
+        template_pack = pack.TemplatePack(self.make('zip'))
+        self.assertIn('utility', template_pack.stencil_sets)
+        stencil_set = template_pack.load_stencil_set('utility')
+        stencil = stencil_set.get_stencil('default', name='web')
+        self.assertIn('recipes/web.rb', stencil['files'])
+        template = stencil_set.jinja_env.get_template(
+            stencil['files']['recipes/web.rb'])
+        self.assertIn('web', template.render(options={'name': 'web'},
+                                             cookbook={}))
+        self.assertRaises(exc.FastfoodStencilSetNotListed,
+                          template_pack.load_stencil_set, 'nope')
+
+    def test_reopened_when_changed(self):
+        path = self.make('zip')
+        first = archive.open_archive(path)
+        self.assertIs(archive.open_archive(path), first)
+        os.utime(path, (1, 1))
+        self.assertIsNot(archive.open_archive(path), first)
+
+    def test_no_manifest(self):
+        path = os.path.join(self.tempdir, 'empty.zip')
+        with zipfile.ZipFile(path, 'w') as stream:
+            stream.writestr('README', 'no pack here')
+        self.assertRaises(ValueError, pack.TemplatePack, path)
+
+    def test_build_workers_reopen_archive(self):
+        template_pack = pack.TemplatePack(self.make('zip'))
+        self.assertEqual(template_pack.location, template_pack.archive.path)
+        with mock.patch('multiprocessing.Pool') as pool:
+            pool.return_value.imap.return_value = []
+            list(food.build_cookbooks(['fastfood.json'], template_pack,
+                                      self.tempdir, jobs=2))
+        initargs = pool.call_args[1]['initargs']
+        # as a spawned worker would, without the archives opened here
+        with mock.patch.dict(archive._ARCHIVES, clear=True):
+            with mock.patch.object(food, '_WORKER_PACK'):
+                food._init_build_worker(*initargs)
+                self.assertEqual(food._WORKER_PACK.path, template_pack.path)
+
+    def test_no_compile(self):
+        template_pack = pack.TemplatePack(self.make('zip'))
+        self.assertEqual(template_pack.compiled_index, {})
+        self.assertRaises(ValueError, template_pack.compile)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -119,6 +119,23 @@ class TestBerks(unittest.TestCase):
             fbd['cookbook']['logstash']['git'],
             'git@github.com:racker/chef-logstash.git')
 
+    def test_berks_group(self):
+        fb = book.Berksfile.from_string(
+            "source 'https://supermarket.chef.io'\n"
+            "group :integration do\n"
+            "  cookbook 'wrapper', path: 'test/fixtures/cookbooks/wrapper'\n"
+            "end\n"
+            "cookbook 'apt'\n")
+        fbd = fb.to_dict()
+        self.assertEqual(sorted(fbd), ['cookbook', 'source'])
+        self.assertEqual(fbd['cookbook']['wrapper'],
+                         {'path': 'test/fixtures/cookbooks/wrapper',
+                          'group': 'integration'})
+
+        # a cookbook of the group is not added again
+        fb.merge(book.Berksfile.from_string("cookbook 'wrapper'\n"))
+        self.assertEqual(fb.read().count("cookbook 'wrapper'"), 1)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,95 @@
+"""metadata.rb and Berksfile wrapper related tests."""
+
+import unittest
+
+try:
+    import mock
+except ImportError:
+    # Python 3
+    import unittest.mock as mock
+
+from fastfood import book
+
+METADATA_RB = """\
+name             'parsed'
+version          '0.1.0'
+
+depends 'apt'
+"""
+
+
+class TestParsed(unittest.TestCase):
+
+    def setUp(self):
+        self.metadata = book.MetadataRb.from_string(METADATA_RB)
+        patcher = mock.patch.object(book.MetadataRb, 'parse', autospec=True,
+                                    side_effect=book.MetadataRb.parse)
+        self.parse = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_parsed_once(self):
+        self.assertEqual(self.metadata.parsed['name'], 'parsed')
+        self.metadata.to_dict()
+        self.metadata.to_dict()
+        self.assertEqual(self.parse.call_count, 1)
+
+    def test_to_dict_is_a_copy(self):
+        self.metadata.to_dict()['depends']['yum'] = []
+        self.assertNotIn('yum', self.metadata.to_dict()['depends'])
+
+    def test_merge_without_change(self):
+        self.metadata.merge(book.MetadataRb.from_dict({'depends': {
+            'apt': {}}}))
+        # this file and the other one, once each
+        self.assertEqual(self.parse.call_count, 2)
+
+    def test_write_invalidates(self):
+        self.metadata.parsed
+        with mock.patch('sys.stdout'):
+            merged = self.metadata.merge(book.MetadataRb.from_dict({
+                'depends': {'yum': {}}}))
+        self.assertEqual(sorted(merged['depends']), ['apt', 'yum'])
+        self.assertEqual(self.parse.call_count, 3)
+        self.metadata.parsed
+        self.assertEqual(self.parse.call_count, 3)
+
+        self.metadata.seek(0, 2)
+        self.metadata.write("depends 'zypper'\n")
+        self.assertIn('zypper', self.metadata.parsed['depends'])
+        self.assertEqual(self.parse.call_count, 4)
+
+    def test_regexp_ending_line(self):
+        metadata = book.MetadataRb.from_string(
+            "supports 'ubuntu' if node.name =~ /web/\ndepends 'x'\n")
+        self.assertEqual(sorted(metadata.parsed['depends']), ['x'])
+
+
+class TestWriteStatements(unittest.TestCase):
+
+    def write(self, content, statements):
+        wrapper = book.MetadataRb.from_string(content)
+        with mock.patch('sys.stdout'):
+            wrapper.write_statements(statements)
+        return wrapper.stream.getvalue()
+
+    def test_insert_after_similar(self):
+        content = "good 'cow'\nnice 'man'\nbad 'news'\n"
+        statements = ["good 'dog'\n", "good 'cat'\n", "bad 'rat'\n",
+                      "fat 'emu'\n", '']
+        self.assertEqual(self.write(content, statements),
+                         "good 'cow'\ngood 'cat'\ngood 'dog'\n"
+                         "nice 'man'\nbad 'news'\nbad 'rat'\n"
+                         "fat 'emu'\n")
+
+    def test_repeated_line(self):
+        content = "depends 'apt'\nversion '1.0'\ndepends 'apt'\n"
+        self.assertEqual(self.write(content, ["depends 'yum'\n"]),
+                         "depends 'apt'\nversion '1.0'\ndepends 'apt'\n"
+                         "depends 'yum'\n")
+
+    def test_nothing_to_write(self):
+        self.assertEqual(self.write("name 'x'\n", ['']), "name 'x'\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+"""Template pack preflight related tests."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from fastfood import check
+from fastfood import pack
+
+TEST_TEMPLATEPACK = os.path.join(os.path.dirname(__file__),
+                                 'test_templatepack')
+
+
+class TestCheck(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='%s-' % __name__)
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.path = os.path.join(self.tempdir, 'pack')
+        shutil.copytree(TEST_TEMPLATEPACK, self.path,
+                        ignore=shutil.ignore_patterns(pack.INDEX_NAME))
+
+    def stencil_path(self, *parts):
+        return os.path.join(self.path, 'stencils', *parts)
+
+    def break_pack(self):
+        """Break a template, a binary, an include and a stencil set."""
+        with open(self.stencil_path('apache', 'recipes',
+                                    '_apache.rb.jinja2'), 'a') as stream:
+            stream.write('{% if %}\n')
+        os.remove(self.stencil_path('base', 'files', 'rackspace.jpg'))
+        with open(self.stencil_path('base', 'files', 'README.md'),
+                  'a') as stream:
+            stream.write("{% include 'files/nope.jinja2' %}\n")
+        shutil.rmtree(self.stencil_path('nodejs'))
+
+    def errors(self, report):
+        return sorted((name, error['path'], error['error'].split(':')[0])
+                      for name, entry in report['stencil_sets'].items()
+                      for error in entry['errors'])
+
+    def test_clean(self):
+        report = check.check_pack(self.path, jobs=1)
+        self.assertEqual(report['errors'], 0)
+        self.assertEqual(sorted(report['stencil_sets']),
+                         ['apache', 'base', 'newrelic', 'nodejs', 'utility'])
+        base = report['stencil_sets']['base']
+        self.assertEqual(base['binaries'], 1)
+        self.assertEqual(sorted(base['seconds']),
+                         ['compile', 'load', 'resolve'])
+        # machine-readable
+        self.assertEqual(json.loads(json.dumps(report)), report)
+
+    def test_reports_every_error(self):
+        self.break_pack()
+        report = check.check_pack(self.path, jobs=1)
+        self.assertEqual(report['errors'], 4)
+        self.assertEqual(self.errors(report), [
+            ('apache', 'recipes/_apache.rb.jinja2', 'Template Syntax Error'),
+            ('base', 'files/README.md', 'Missing template files/nope.jinja2'),
+            ('base', 'files/rackspace.jpg',
+             'Missing binary files/rackspace.jpg'),
+            ('nodejs', None, 'Stencil Set Invalid Path'),
+        ])
+
+    def test_nested_reference(self):
+        files = self.stencil_path('base', 'files')
+        with open(os.path.join(files, 'README.md'), 'a') as stream:
+            stream.write("{% include 'files/_part.jinja2' %}\n")
+        with open(os.path.join(files, '_part.jinja2'), 'w') as stream:
+            stream.write("{% include 'files/_nope.jinja2' %}\n"
+                         "{% include 'files/README.md' %}\n")
+        report = check.check_pack(self.path, jobs=1)
+        self.assertEqual(self.errors(report), [
+            ('base', 'files/README.md',
+             'Missing template files/_nope.jinja2'),
+        ])
+
+    def test_workers_match_serial(self):
+        self.break_pack()
+        serial = check.check_pack(self.path, jobs=1)
+        parallel = check.check_pack(self.path, jobs=3)
+        self.assertEqual(parallel['jobs'], 3)
+        self.assertEqual(self.errors(parallel), self.errors(serial))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+"""Build event related tests."""
+
+import collections
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    # Python 3
+    from io import StringIO
+
+try:
+    import mock
+except ImportError:
+    # Python 3
+    import unittest.mock as mock
+
+from fastfood import events
+from fastfood import food
+from fastfood import templating
+
+TEST_TEMPLATEPACK = os.path.join(os.path.dirname(__file__),
+                                 'test_templatepack')
+BUILD_CONFIG = {
+    'name': 'test_events',
+    'stencils': [
+        {'stencil_set': 'base'},
+        {'stencil_set': 'newrelic'},
+    ],
+}
+
+
+class Recorder(events.Hooks):
+
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event, **fields):
+        self.events.append((event, fields))
+
+    def named(self, event):
+        return [fields for name, fields in self.events if name == event]
+
+
+class TestHooks(unittest.TestCase):
+
+    def test_methods_call_emit(self):
+        hooks = Recorder()
+        hooks.file_written(path='x', action='create', bytes=1, seconds=0.0)
+        self.assertEqual(hooks.events[0][0], 'file_written')
+        self.assertRaises(AttributeError, getattr, hooks, 'file_eaten')
+
+    def test_overridden_method(self):
+        class Skips(Recorder):
+            def file_skipped(self, path, reason):
+                self.events.append(('skipped', path))
+
+        hooks = Skips()
+        with events.installed(hooks):
+            events.emit('file_skipped', path='x', reason='exists')
+            events.emit('file_written', path='x', action='create', bytes=1,
+                        seconds=0.0)
+        self.assertEqual([name for name, _ in hooks.events],
+                         ['skipped', 'file_written'])
+
+    def test_installed(self):
+        outer, inner = Recorder(), Recorder()
+        self.assertFalse(events.enabled())
+        with events.installed(outer):
+            with events.installed(None):
+                events.emit('build_started', cookbook='a', config='a.json')
+            with events.installed(inner):
+                events.emit('build_started', cookbook='b', config='b.json')
+        self.assertFalse(events.enabled())
+        events.emit('build_started', cookbook='c', config='c.json')
+        self.assertEqual(outer.named('build_started'),
+                         [{'cookbook': 'a', 'config': 'a.json'}])
+        self.assertEqual(inner.named('build_started'),
+                         [{'cookbook': 'b', 'config': 'b.json'}])
+
+    def test_json_lines(self):
+        stream = StringIO()
+        hooks = events.JsonLines(stream)
+        with mock.patch('time.time', return_value=1428000000.0):
+            hooks.file_skipped(path='metadata.rb', reason='unchanged')
+        self.assertEqual(json.loads(stream.getvalue()),
+                         {'event': 'file_skipped', 'path': 'metadata.rb',
+                          'reason': 'unchanged', 'time': 1428000000.0})
+        self.assertTrue(stream.getvalue().endswith('\n'))
+
+
+class TestBuildEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='%s-' % __name__)
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.config = os.path.join(self.tempdir, 'fastfood.json')
+        with open(self.config, 'w') as config:
+            json.dump(BUILD_CONFIG, config)
+        # a pack of its own, with templates no test compiled yet
+        self.templatepack_path = os.path.join(self.tempdir, 'pack')
+        shutil.copytree(TEST_TEMPLATEPACK, self.templatepack_path)
+        templating.configure_cache(None)
+        patcher = mock.patch('sys.stdout', new_callable=StringIO)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def build(self):
+        hooks = Recorder()
+        food.build_cookbook(self.config, self.templatepack_path,
+                            self.tempdir, hooks=hooks)
+        return hooks
+
+    def test_build(self):
+        hooks = self.build()
+        self.assertFalse(events.enabled())
+        counts = collections.Counter(name for name, _ in hooks.events)
+        self.assertEqual(hooks.events[0][0], 'build_started')
+        self.assertEqual(hooks.events[-1][0], 'build_finished')
+        self.assertEqual(counts['stencil_started'], 2)
+        self.assertEqual(counts['stencil_finished'], 2)
+        # once per build
+        self.assertEqual(counts['dependencies_merged'], 1)
+
+        rendered = hooks.named('template_rendered')
+        written = hooks.named('file_written')
+        self.assertTrue(rendered)
+        for fields in rendered:
+            self.assertTrue(os.path.isfile(fields['template']))
+            self.assertGreater(fields['bytes'], 0)
+        for fields in written:
+            self.assertEqual(os.path.getsize(fields['path']),
+                             fields['bytes'])
+            self.assertEqual(fields['action'], 'create')
+        finished = hooks.named('build_finished')[0]
+        self.assertEqual(finished['written'], len(written))
+        self.assertEqual(finished['cookbook'], 'test_events')
+
+        merged = hooks.named('dependencies_merged')[0]
+        self.assertEqual(merged['dependencies'], ['newrelic'])
+
+    def test_rebuild(self):
+        self.build()
+        hooks = self.build()
+        self.assertEqual(hooks.named('file_written'), [])
+        self.assertEqual(
+            [fields['up_to_date'] for fields in
+             hooks.named('stencil_finished')], [True, True])
+
+    def test_template_compiled(self):
+        # templates are compiled once per process
+        hooks = self.build()
+        compiled = hooks.named('template_compiled')
+        self.assertTrue(compiled)
+        self.assertGreaterEqual(compiled[0]['seconds'], 0)
+
+    def test_hooks_need_one_job(self):
+        builds = food.build_cookbooks([self.config], TEST_TEMPLATEPACK,
+                                      self.tempdir, jobs=2, hooks=Recorder())
+        self.assertRaises(ValueError, list, builds)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+"""Build helper related tests."""
+
+import unittest
+
+from fastfood import food
+
+
+class TestPendingDependencies(unittest.TestCase):
+
+    def setUp(self):
+        self.dependencies = food.PendingDependencies()
+
+    def test_dedupe(self):
+        self.dependencies.add({'id': 'base', 'dependencies': {'apt': {}}})
+        self.dependencies.add({'id': 'apache', 'dependencies': {'apt': {}},
+                               'berks_dependencies': None})
+        self.assertEqual(self.dependencies.depends, {'apt': ({}, 'base')})
+        self.assertEqual(self.dependencies.berks, {})
+
+    def test_conflict(self):
+        self.dependencies.add({
+            'id': 'nodejs',
+            'berks_dependencies': {'nodejs': {'git': 'https://a'}}})
+        self.assertRaises(ValueError, self.dependencies.add, {
+            'id': 'other',
+            'berks_dependencies': {'nodejs': {'git': 'https://b'}}})
+
+    def test_nothing_to_apply(self):
+        # no metadata.rb or Berksfile needed
+        self.dependencies.add({'id': 'base', 'dependencies': {}})
+        self.dependencies.apply(None, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
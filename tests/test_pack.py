@@ -0,0 +1,169 @@
+"""Template pack index related tests."""
+
+import json
+import marshal
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    import mock
+except ImportError:
+    # Python 3
+    import unittest.mock as mock
+
+from fastfood import exc
+from fastfood import pack
+
+TEST_TEMPLATEPACK = os.path.join(os.path.dirname(__file__),
+                                 'test_templatepack')
+
+
+class TestIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='%s-' % __name__)
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.path = os.path.join(self.tempdir, 'pack')
+        shutil.copytree(TEST_TEMPLATEPACK, self.path,
+                        ignore=shutil.ignore_patterns(pack.INDEX_NAME))
+        self.first = pack.TemplatePack(self.path)
+        self.first.load_stencil_set('utility')
+        self.first.write_index()
+
+    def load(self):
+        """Load the pack again, counting the manifests parsed."""
+        with mock.patch('json.load', side_effect=json.load) as load:
+            template_pack = pack.TemplatePack(self.path)
+            stencil_set = template_pack.load_stencil_set('utility')
+            stencil = stencil_set.get_stencil('default', name='web')
+        return template_pack, stencil, load.call_count
+
+    def test_written(self):
+        self.assertTrue(os.path.isfile(self.first.index_path))
+        self.assertEqual(list(self.first.index['stencil_sets']),
+                         ['utility'])
+
+    def test_not_written_by_use(self):
+        os.remove(self.first.index_path)
+        template_pack, _, _ = self.load()
+        template_pack.load_stencil_set('apache')
+        self.assertIn('apache', template_pack.index['stencil_sets'])
+        self.assertFalse(os.path.exists(self.first.index_path))
+
+    def test_list_loads_no_stencil_set(self):
+        with mock.patch('marshal.loads', side_effect=marshal.loads) as load:
+            template_pack = pack.TemplatePack(self.path)
+            self.assertIn('utility', template_pack.stencil_sets)
+        self.assertEqual(load.call_count, 1)
+
+    def test_reused(self):
+        template_pack, stencil, parsed = self.load()
+        self.assertEqual(parsed, 0)
+        self.assertEqual(template_pack.manifest, self.first.manifest)
+        self.assertIn('recipes/web.rb', stencil['files'])
+
+    def test_touched_manifest(self):
+        manifest = os.path.join(self.path, 'stencils', 'utility',
+                                'manifest.json')
+        os.utime(manifest, (1, 1))
+        self.assertEqual(self.load()[2], 0)
+
+    def test_changed_manifest(self):
+        manifest = os.path.join(self.path, 'stencils', 'utility',
+                                'manifest.json')
+        with open(manifest) as stream:
+            data = json.load(stream)
+        data['stencils']['default']['files']['extra.rb'] = 'recipes/x.rb'
+        with open(manifest, 'w') as stream:
+            json.dump(data, stream)
+        _, stencil, parsed = self.load()
+        self.assertTrue(parsed)
+        self.assertEqual(stencil['files']['extra.rb'], 'recipes/x.rb')
+
+    def test_changed(self):
+        self.assertFalse(self.first.changed())
+        manifest = os.path.join(self.path, 'stencils', 'utility',
+                                'manifest.json')
+        os.utime(manifest, (1, 1))
+        self.assertFalse(self.first.changed())
+        with open(manifest, 'a') as stream:
+            stream.write('\n')
+        self.assertTrue(self.first.changed())
+
+    def test_changed_compiled_template(self):
+        self.first.compile()
+        template_pack = pack.TemplatePack(self.path, preload=True)
+        self.assertFalse(template_pack.changed())
+        recipe = os.path.join(self.path, 'stencils', 'utility', 'recipes',
+                              'default.rb')
+        with open(recipe, 'a') as stream:
+            stream.write('# more\n')
+        os.utime(recipe, (1, 1))
+        self.assertTrue(template_pack.changed())
+
+    def test_unreadable_index(self):
+        with open(self.first.index_path, 'wb') as stream:
+            stream.write(b'not an index')
+        template_pack, _, parsed = self.load()
+        self.assertTrue(parsed)
+        self.assertEqual(template_pack.manifest, self.first.manifest)
+
+
+class TestPreload(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='%s-' % __name__)
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        self.path = os.path.join(self.tempdir, 'pack')
+        shutil.copytree(TEST_TEMPLATEPACK, self.path,
+                        ignore=shutil.ignore_patterns(pack.INDEX_NAME))
+
+    def test_preload(self):
+        template_pack = pack.TemplatePack(self.path, preload=True)
+        self.assertEqual(sorted(template_pack._stencil_sets),
+                         sorted(template_pack.stencil_sets))
+        self.assertEqual(sorted(template_pack.index['stencil_sets']),
+                         sorted(template_pack.stencil_sets))
+        self.assertFalse(os.path.exists(template_pack.index_path))
+        with mock.patch('json.load') as load:
+            template_pack.load_stencil_set('utility')
+            self.assertEqual(template_pack.preload(), {})
+        self.assertFalse(load.called)
+
+    def test_preload_errors(self):
+        shutil.rmtree(os.path.join(self.path, 'stencils', 'nodejs'))
+        template_pack = pack.TemplatePack(self.path)
+        with mock.patch.object(pack, 'LOG') as log:
+            errors = template_pack.preload(threads=2)
+        # not worth a warning unless the set gets used
+        self.assertFalse(log.warning.called)
+        self.assertEqual(list(errors), ['nodejs'])
+        self.assertIsInstance(errors['nodejs'],
+                              exc.FastfoodStencilSetInvalidPath)
+        self.assertRaises(exc.FastfoodStencilSetInvalidPath,
+                          template_pack.load_stencil_set, 'nodejs')
+        self.assertIn('apache', template_pack._stencil_sets)
+
+    def test_threads_share_stencil_sets(self):
+        template_pack = pack.TemplatePack(self.path)
+        loaded = []
+
+        def load():
+            loaded.append(template_pack.load_stencil_set('apache'))
+
+        threads = [threading.Thread(target=load) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(loaded), 8)
+        apache = template_pack.load_stencil_set('apache')
+        for stencil_set in loaded:
+            self.assertIs(stencil_set, apache)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,242 @@
+"""Build plan related tests."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import mock
+except ImportError:
+    # Python 3
+    import unittest.mock as mock
+
+from fastfood import book
+from fastfood import plan
+from fastfood import shell
+from fastfood import templating
+
+
+class TestBuildPlan(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='%s-' % __name__)
+        self.metadata_rb = os.path.join(self.tempdir, 'metadata.rb')
+        with open(self.metadata_rb, 'w') as metadata:
+            metadata.write("name 'planned'\ndepends 'apt'\n")
+        self.plan = plan.BuildPlan()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def read(self, *path):
+        with open(os.path.join(self.tempdir, *path)) as stream:
+            return stream.read()
+
+    def test_write_then_append_once(self):
+        kitchen_yml = os.path.join(self.tempdir, 'test', '.kitchen.yml')
+        self.assertFalse(self.plan.exists(kitchen_yml))
+        self.plan.write(kitchen_yml, ('text', 'suites:\n'))
+        self.plan.append(kitchen_yml, ('text', '  - name: default\n'))
+        self.plan.append(kitchen_yml, ('text', '  - name: apache\n'))
+        self.assertTrue(self.plan.exists(kitchen_yml))
+        self.assertFalse(os.path.exists(kitchen_yml))
+
+        self.assertEqual(self.plan.apply(), [kitchen_yml])
+        self.assertEqual(self.read('test', '.kitchen.yml'),
+                         'suites:\n  - name: default\n  - name: apache\n')
+
+    def test_unchanged_wrapper_is_not_written(self):
+        metadata = self.plan.wrap(self.metadata_rb, book.MetadataRb)
+        self.assertEqual(metadata.to_dict()['name'], 'planned')
+        metadata.merge(book.MetadataRb.from_dict({'depends': {'apt': {}}}))
+        self.assertEqual(self.plan.changed_paths(), set())
+        self.assertEqual(self.plan.apply(), [])
+
+    def test_merge_through_wrapper(self):
+        metadata = self.plan.wrap(self.metadata_rb, book.MetadataRb)
+        metadata.merge(book.MetadataRb.from_dict({'depends': {'yum': {}}}))
+        self.assertEqual(self.plan.files[self.metadata_rb].action, 'update')
+        # nothing is written before the plan is applied
+        self.assertNotIn('yum', self.read('metadata.rb'))
+
+        self.assertEqual(self.plan.apply(), [self.metadata_rb])
+        self.assertEqual(self.read('metadata.rb'),
+                         "name 'planned'\ndepends 'apt'\ndepends 'yum'\n")
+
+    def test_overwrite_drops_merges(self):
+        metadata = self.plan.wrap(self.metadata_rb, book.MetadataRb)
+        metadata.merge(book.MetadataRb.from_dict({'depends': {'yum': {}}}))
+        self.plan.write(self.metadata_rb, ('text', "name 'overwritten'\n"))
+        self.assertEqual(self.plan.files[self.metadata_rb].action,
+                         'overwrite')
+        self.plan.apply()
+        self.assertEqual(self.read('metadata.rb'), "name 'overwritten'\n")
+
+    def test_identical_content_is_not_written(self):
+        self.plan.write(self.metadata_rb,
+                        ('text', "name 'planned'\ndepends 'apt'\n"))
+        self.assertEqual(self.plan.apply(), [])
+        self.assertEqual(self.plan.unchanged, [self.metadata_rb])
+
+        self.plan.write(self.metadata_rb,
+                        ('text', "name 'planned'\ndepends 'yum'\n"))
+        self.assertEqual(self.plan.apply(), [self.metadata_rb])
+        self.assertEqual(self.plan.summary(),
+                         "1 written, 0 unchanged, 0 skipped")
+
+    def test_apply_staged(self):
+        os.chmod(self.metadata_rb, 0o755)
+        recipe = os.path.join(self.tempdir, 'recipes', 'default.rb')
+        self.plan.write(recipe, ('text', "package 'nginx'\n"))
+        self.plan.write(self.metadata_rb, ('text', "name 'staged'\n"))
+        stage_dir = tempfile.mkdtemp(dir=self.tempdir)
+
+        self.assertEqual(self.plan.apply(stage_dir=stage_dir,
+                                         durability='file'),
+                         [recipe, self.metadata_rb])
+        self.assertEqual(self.read('recipes', 'default.rb'),
+                         "package 'nginx'\n")
+        self.assertEqual(self.read('metadata.rb'), "name 'staged'\n")
+        self.assertEqual(os.stat(self.metadata_rb).st_mode & 0o777, 0o755)
+        # everything was renamed out of the staging dir
+        self.assertEqual(os.listdir(stage_dir), [])
+
+    def test_apply_file_durability(self):
+        recipe = os.path.join(self.tempdir, 'recipes', 'default.rb')
+        self.plan.write(recipe, ('text', "package 'nginx'\n"))
+        self.plan.write(self.metadata_rb, ('text', "name 'synced'\n"))
+        with mock.patch.object(plan, '_fsync') as fsync:
+            self.plan.apply(durability='file')
+        synced = [call[0][0] for call in fsync.call_args_list]
+        self.assertEqual(sorted(synced),
+                         sorted([recipe, self.metadata_rb, self.tempdir,
+                                 os.path.dirname(recipe)]))
+
+    def test_streamed_template_rendered_once(self):
+        template = os.path.join(self.tempdir, 'metadata.rb.jinja2')
+        with open(template, 'w') as stream:
+            stream.write("name '|{ name }|'\n")
+        os.chmod(self.metadata_rb, 0o755)
+        part = ('template', template, None, {'name': 'streamed'})
+        with mock.patch.object(templating, 'stream_file',
+                               wraps=templating.stream_file) as stream_file:
+            self.plan.write(self.metadata_rb, part)
+            self.assertEqual(self.plan.apply(), [self.metadata_rb])
+        self.assertEqual(stream_file.call_count, 1)
+        self.assertEqual(self.read('metadata.rb'), "name 'streamed'\n")
+        self.assertEqual(os.stat(self.metadata_rb).st_mode & 0o777, 0o755)
+
+        # nothing rendered is left behind when unchanged or only shown
+        self.plan.write(self.metadata_rb, part)
+        self.assertEqual(self.plan.apply(), [])
+        self.plan.write(self.metadata_rb,
+                        ('template', template, None, {'name': 'shown'}))
+        self.assertEqual(self.plan.show(), [self.metadata_rb])
+        self.assertEqual(sorted(os.listdir(self.tempdir)),
+                         ['metadata.rb', 'metadata.rb.jinja2'])
+
+    def test_failed_stream_leaves_target(self):
+        template = os.path.join(self.tempdir, 'metadata.rb.jinja2')
+        with open(template, 'w') as stream:
+            stream.write("name '|{ name }|'\n|{ missing.attr }|\n")
+        for path in (self.metadata_rb,
+                     os.path.join(self.tempdir, 'README.md')):
+            build_plan = plan.BuildPlan()
+            build_plan.write(path, ('template', template, None,
+                                    {'name': 'failed'}))
+            self.assertRaises(Exception, build_plan.apply)
+        self.assertEqual(self.read('metadata.rb'),
+                         "name 'planned'\ndepends 'apt'\n")
+        self.assertEqual(sorted(os.listdir(self.tempdir)),
+                         ['metadata.rb', 'metadata.rb.jinja2'])
+
+    def test_apply_batch_durability(self):
+        recipe = os.path.join(self.tempdir, 'recipes', 'default.rb')
+        self.plan.write(recipe, ('text', "package 'nginx'\n"))
+        self.plan.write(self.metadata_rb, ('text', "name 'synced'\n"))
+        stage_dir = tempfile.mkdtemp(dir=self.tempdir)
+        with mock.patch.object(plan, '_fsync') as fsync:
+            self.plan.apply(stage_dir=stage_dir, durability='batch')
+        # once each, after the renames: nothing in the staging dir
+        synced = [call[0][0] for call in fsync.call_args_list]
+        self.assertEqual(sorted(synced),
+                         sorted([recipe, self.metadata_rb, self.tempdir,
+                                 os.path.dirname(recipe)]))
+
+    def test_apply_bad_durability(self):
+        self.assertRaises(ValueError, self.plan.apply, durability='always')
+
+    def test_command_line_choices(self):
+        # listed again by the shell, not to load the build plan for them
+        self.assertEqual(shell.DURABILITY, plan.DURABILITY)
+        self.assertEqual(shell.BINARY_STRATEGIES, plan.BINARY_STRATEGIES)
+
+
+class TestBinaries(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='%s-' % __name__)
+        self.source = os.path.join(self.tempdir, 'pack', 'logo.png')
+        os.makedirs(os.path.dirname(self.source))
+        with open(self.source, 'wb') as source:
+            source.write(b'\x89PNG' * 4096)
+        self.target = os.path.join(self.tempdir, 'cookbook', 'files',
+                                   'logo.png')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def install(self, binaries):
+        build_plan = plan.BuildPlan(binaries=binaries)
+        build_plan.copy(self.target, self.source)
+        return build_plan.apply()
+
+    def assertInstalled(self):
+        with open(self.target, 'rb') as target:
+            self.assertEqual(target.read(), b'\x89PNG' * 4096)
+
+    def test_copy(self):
+        self.assertEqual(self.install('copy'), [self.target])
+        self.assertInstalled()
+        self.assertNotEqual(os.stat(self.target).st_ino,
+                            os.stat(self.source).st_ino)
+
+    def test_reflink(self):
+        # copies where the filesystem cannot clone
+        self.assertEqual(self.install('reflink'), [self.target])
+        self.assertInstalled()
+
+    def test_hardlink(self):
+        self.install('hardlink')
+        self.assertInstalled()
+        self.assertEqual(os.stat(self.target).st_ino,
+                         os.stat(self.source).st_ino)
+
+    def test_symlink(self):
+        self.install('symlink')
+        self.assertInstalled()
+        self.assertEqual(os.readlink(self.target), self.source)
+
+    def test_identical_binary_is_skipped(self):
+        self.install('copy')
+        self.assertEqual(self.install('copy'), [])
+        with open(self.target, 'ab') as target:
+            target.write(b'changed')
+        self.assertEqual(self.install('copy'), [self.target])
+        self.assertInstalled()
+
+    def test_write_does_not_follow_links(self):
+        self.install('hardlink')
+        build_plan = plan.BuildPlan()
+        build_plan.write(self.target, ('text', 'overwritten'))
+        build_plan.apply()
+        with open(self.source, 'rb') as source:
+            self.assertEqual(source.read(), b'\x89PNG' * 4096)
+
+    def test_bad_strategy(self):
+        self.assertRaises(ValueError, plan.BuildPlan, binaries='move')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+"""Ruby tokenizer related tests."""
+
+import re
+import unittest
+
+try:
+    import mock
+except ImportError:
+    # Python 3
+    import unittest.mock as mock
+
+from fastfood import exc
+from fastfood import ruby
+
+BERKSFILE = """\
+source 'https://supermarket.chef.io'
+metadata
+=begin
+cookbook 'commented'
+=end
+cookbook 'apt', # why
+         '~> 2.0'  # pinned
+cookbook("yum", ">= 1")
+cookbook :foo, :git => "a\\"b", ref: 'x'
+group :integration do
+  cookbook 'inner', path: 'test/fixtures/inner'
+end
+"""
+HEREDOC = """\
+long_description <<-EOH
+  depends 'described'
+  EOH
+depends 'after'
+"""
+
+
+class TestParse(unittest.TestCase):
+
+    def test_lossless(self):
+        for text in (BERKSFILE, HEREDOC, '', 'name "no newline"',
+                     "foo /re/\nbar a / b\n"):
+            self.assertEqual(ruby.parse(text).text, text)
+
+    def test_unterminated_string(self):
+        for text in ("cookbook 'unterminated\ncookbook 'a'\n",
+                     'depends "b\n', "name :'x\n"):
+            with self.assertRaises(exc.FastfoodRubySyntaxError) as raised:
+                ruby.parse(text)
+            self.assertIn('line 1', str(raised.exception))
+
+    def test_statements(self):
+        document = ruby.parse(BERKSFILE)
+        self.assertEqual(
+            [statement.keyword for statement in document],
+            ['source', 'metadata', None, 'cookbook', 'cookbook', 'cookbook',
+             'group'])
+        self.assertEqual(document.statements[2].text,
+                         "=begin\ncookbook 'commented'\n=end\n")
+        self.assertIsNone(document.statements[0].block)
+
+    def test_block(self):
+        group = ruby.parse(BERKSFILE).statements[-1]
+        self.assertEqual(group.arguments(), (['integration'], {}))
+        self.assertEqual([statement.keyword for statement in group.block],
+                         ['cookbook'])
+        self.assertTrue(group.block.statements[0].indented)
+
+        document = ruby.parse("if windows?\n  depends 'a'\nend\n"
+                              "%w(a b).each do |os|\n"
+                              "  while os do\n    supports os\n  end\n"
+                              "end\nname 'x'\n")
+        self.assertEqual([statement.keyword for statement in document],
+                         [None, None, 'name'])
+
+    def test_heredoc(self):
+        document = ruby.parse(HEREDOC)
+        self.assertEqual(len(document), 2)
+        self.assertEqual(document.statements[0].keyword, 'long_description')
+        self.assertEqual(document.statements[1].arguments(), (['after'], {}))
+
+    def test_heredoc_assigned(self):
+        document = ruby.parse("readme = <<-EOS\n  text\n  EOS\n"
+                              "depends 'q'\n")
+        self.assertEqual([statement.keyword for statement in document],
+                         [None, 'depends'])
+        self.assertEqual(document.statements[1].arguments(), (['q'], {}))
+
+    def test_continued_line(self):
+        document = ruby.parse("x = [1,\n  2]\nfoo ,\n  bar\n")
+        self.assertEqual([statement.text for statement in document],
+                         ['x = [1,\n  2]\n', 'foo ,\n  bar\n'])
+
+    def test_regexp(self):
+        # a regexp ending a line does not continue it, a division does
+        document = ruby.parse("supports /re/\ndepends 'x'\n"
+                              "ok = name =~ /a\\/b/\ndepends 'y'\n"
+                              "half = total /\n  2\ndepends 'z'\n")
+        self.assertEqual([statement.keyword for statement in document],
+                         ['supports', 'depends', None, 'depends', None,
+                          'depends'])
+        self.assertEqual(document.statements[0].arguments(), (['/re/'], {}))
+        self.assertEqual(document.statements[4].text,
+                         "half = total /\n  2\n")
+
+
+class TestArguments(unittest.TestCase):
+
+    def arguments(self, text):
+        return [statement.arguments() for statement in ruby.parse(text)
+                if statement.keyword == 'cookbook']
+
+    def test_arguments(self):
+        self.assertEqual(self.arguments(BERKSFILE), [
+            (['apt', '~> 2.0'], {}),
+            (['yum', '>= 1'], {}),
+            (['foo'], {'git': 'a"b', 'ref': 'x'}),
+        ])
+
+    def test_modifier(self):
+        self.assertEqual(self.arguments("cookbook 'a' if true\n"
+                                        "cookbook('b', ref: 'x') unless c\n"
+                                        "cookbook 'c', \"d\" rescue nil\n"),
+                         [(['a'], {}), (['b'], {'ref': 'x'}),
+                          (['c', 'd'], {})])
+
+    def test_simple_matches_tokens(self):
+        # the fast path for one line statements gives what tokens would
+        for text in ("cookbook 'a', \"b c\", :d, ref: 'x' # e\n",
+                     "cookbook 'a',git: \"b\"\n"):
+            self.assertIsNotNone(ruby.SIMPLE_RE.match(text))
+            expected = self.arguments(text)
+            with mock.patch.object(ruby, 'SIMPLE_RE', re.compile('(?!)')):
+                self.assertEqual(self.arguments(text), expected)
+
+    def test_heredoc_value(self):
+        document = ruby.parse("long_description <<-EOS\n  Long\n  EOS\n"
+                              "description <<~EOS, <<X\n  a\n   b\nEOS\nc\nX\n"
+                              "depends 'x'\n")
+        self.assertEqual([statement.keyword for statement in document],
+                         ['long_description', 'description', 'depends'])
+        self.assertEqual(document.statements[0].arguments(),
+                         (['  Long\n'], {}))
+        self.assertEqual(document.statements[1].arguments(),
+                         (['a\n b\n', 'c\n'], {}))
+
+    def test_argument_text(self):
+        statement = ruby.parse("version    '1.0' + suffix # x\n").statements[0]
+        self.assertEqual(statement.argument_text(), "'1.0' + suffix")
+        self.assertEqual(statement.arguments(), (["'1.0' + suffix"], {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,247 @@
+"""fastfood serve related tests."""
+
+import json
+import os
+import shutil
+import socket
+import stat
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    # Python 3
+    from io import StringIO
+
+try:
+    import mock
+except ImportError:
+    # Python 3
+    import unittest.mock as mock
+
+import fastfood
+from fastfood import exc
+from fastfood import server
+from fastfood import shell
+
+TEST_TEMPLATEPACK = os.path.join(os.path.dirname(__file__),
+                                 'test_templatepack')
+
+
+def _wait_or_touch(argv, _):
+    """Run ['touch', path], or ['wait', path] until something touches it."""
+    command, path = argv
+    if command == 'touch':
+        open(path, 'w').close()
+        return 0
+    deadline = time.time() + 10
+    while not os.path.exists(path):
+        if time.time() > deadline:
+            return 1
+        time.sleep(0.01)
+    return 0
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='%s-' % __name__)
+        self.templatepack_path = os.path.join(self.tempdir, 'pack')
+        shutil.copytree(TEST_TEMPLATEPACK, self.templatepack_path)
+        self.socket_path = os.path.join(self.tempdir, 'fastfood.sock')
+        self.daemon = server.Server(self.socket_path, shell._serve_command)
+        self.daemon.bind()
+        env = {'FASTFOOD_TEMPLATE_PACK': self.templatepack_path,
+               'FASTFOOD_SOCKET': self.socket_path}
+        patcher = mock.patch.dict(os.environ, env)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.daemon.close()
+        shutil.rmtree(self.tempdir)
+
+    def serve_one(self):
+        """Handle one connection to the daemon, in a thread."""
+        def serve_one():
+            conn, _ = self.daemon.sock.accept()
+            try:
+                self.daemon.handle(conn)
+            finally:
+                conn.close()
+        thread = threading.Thread(target=serve_one)
+        thread.start()
+        return thread
+
+    def call(self, *argv):
+        """Run argv on the daemon, returning (exit code, stdout)."""
+        thread = self.serve_one()
+        with mock.patch('sys.stdout', new_callable=StringIO) as stdout:
+            exit_code = server.call(list(argv))
+        thread.join()
+        return exit_code, stdout.getvalue()
+
+    def test_list(self):
+        exit_code, output = self.call('--no-cache', 'list')
+        self.assertEqual(exit_code, 0)
+        self.assertIn('Available Stencil Sets:', output)
+        self.assertIn('Creates a newrelic recipe', output)
+
+    def test_pack_stays_loaded(self):
+        self.call('--no-cache', 'show', 'newrelic')
+        pack_ = self.daemon.packs.get(self.templatepack_path)
+        self.call('--no-cache', 'list')
+        self.assertIs(self.daemon.packs.get(self.templatepack_path), pack_)
+
+    def test_pack_reloaded_on_change(self):
+        self.call('--no-cache', 'list')
+        manifest_path = os.path.join(self.templatepack_path, 'manifest.json')
+        with open(manifest_path) as manifest:
+            manifest = json.load(manifest)
+        manifest['stencil_sets']['newrelic']['help'] = 'Monitors things'
+        with open(manifest_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        # make sure the stamp changes, even on coarse mtimes
+        os.utime(manifest_path, (0, 0))
+
+        _, output = self.call('--no-cache', 'list')
+        self.assertIn('Monitors things', output)
+
+    def test_pack_loaded_by_daemon(self):
+        self.call('--no-cache', 'list')
+        # the child loaded the pack, the daemon does once it is done
+        self.daemon.reap(wait=True)
+        self.assertEqual(self.daemon.packs.loaded,
+                         [self.templatepack_path])
+        # the command forked next does not load it again
+        with mock.patch('os.walk', side_effect=AssertionError('walked')):
+            exit_code, _ = self.call('--no-cache', 'list')
+        self.assertEqual(exit_code, 0)
+
+    def test_pack_not_walked(self):
+        self.daemon.forks = False
+        self.call('--no-cache', 'list')
+        with mock.patch('os.walk') as walk:
+            self.call('--no-cache', 'list')
+        self.assertFalse(walk.called)
+
+    def test_concurrent_commands(self):
+        self.daemon.run = _wait_or_touch
+        path = os.path.join(self.tempdir, 'touched')
+
+        def serve_two():
+            for _ in range(2):
+                conn, _ = self.daemon.sock.accept()
+                try:
+                    self.daemon.handle(conn)
+                finally:
+                    conn.close()
+        serving = threading.Thread(target=serve_two)
+        serving.start()
+        exit_codes = []
+        waiting = threading.Thread(
+            target=lambda: exit_codes.append(server.call(['wait', path])))
+        waiting.start()
+        # the waiting command does not hold up the next one
+        deadline = time.time() + 10
+        while not self.daemon.children and time.time() < deadline:
+            time.sleep(0.01)
+        exit_codes.append(server.call(['touch', path]))
+        waiting.join()
+        serving.join()
+        self.assertEqual(exit_codes, [0, 0])
+
+    def test_batch_build_output(self):
+        cookbooks = os.path.join(self.tempdir, 'cookbooks')
+        os.mkdir(cookbooks)
+        configs = []
+        for name in ('first', 'second'):
+            configs.append(os.path.join(self.tempdir, '%s.json' % name))
+            with open(configs[-1], 'w') as config:
+                json.dump({'name': name,
+                           'stencils': [{'stencil_set': 'base'}]}, config)
+        exit_code, output = self.call('--no-cache', '--cookbooks', cookbooks,
+                                      'build', '--jobs', '2', *configs)
+        self.assertEqual(exit_code, 0)
+        # built by the daemon itself, not by workers printing to its log
+        for name in ('first', 'second'):
+            self.assertIn('Writing rendered file %s' % os.path.join(
+                cookbooks, name, 'metadata.rb'), output)
+
+    def test_other_version(self):
+        thread = self.serve_one()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+            server._send(sock, {'version': '0.0.1', 'argv': ['list'],
+                                'cwd': os.getcwd()})
+            response = server._receive(sock)
+        finally:
+            sock.close()
+        thread.join()
+        self.assertEqual(response, {'version': fastfood.__version__})
+        self.assertTrue(self.daemon.stopping)
+
+        # and the client runs the command itself; _receive is shared with
+        # the daemon thread, which then stops again
+        receive = server._receive
+        with mock.patch.object(server, '_receive',
+                               side_effect=lambda sock: dict(
+                                   receive(sock), version='0.0.1')):
+            self.assertIsNone(self.call('list')[0])
+
+    @mock.patch.object(server, 'CONNECT_TIMEOUT', new=0.1)
+    def test_unresponsive_daemon(self):
+        # nothing accepts the connection
+        self.assertIsNone(server.call(['list']))
+
+        # the daemon takes the command, then dies
+        def hang_up():
+            # the connection given up on above
+            self.daemon.sock.accept()[0].close()
+            conn, _ = self.daemon.sock.accept()
+            server._receive(conn)
+            server._send(conn, {'running': True})
+            conn.close()
+        thread = threading.Thread(target=hang_up)
+        thread.start()
+        self.assertIsNone(server.call(['list']))
+        thread.join()
+
+    def test_forwarded_commands(self):
+        for argv, forwarded in (
+                (['list'], True),
+                (['--template-pack', 'list', 'show', 'base'], True),
+                (['-v', 'build', 'fastfood.json'], True),
+                (['build', '--help'], False),
+                (['-V'], False),
+                (['--no-daemon', 'list'], False),
+                (['compile'], False),
+                (['check', 'build'], False),
+                (['serve'], False)):
+            self.assertEqual(shell._use_daemon(argv), forwarded, argv)
+        exit_code, _ = self.call('compile')
+        self.assertEqual(exit_code, 2)
+
+    def test_socket_mode(self):
+        mode = stat.S_IMODE(os.stat(self.socket_path).st_mode)
+        self.assertEqual(mode, 0o600)
+
+    def test_error_exit_code(self):
+        exit_code, _ = self.call('--no-cache', 'show', 'missing')
+        self.assertEqual(exit_code, 1)
+
+    def test_one_daemon_per_socket(self):
+        other = server.Server(self.socket_path, shell._serve_command)
+        self.assertRaises(exc.FastfoodDaemonRunning, other.bind)
+
+    def test_no_daemon(self):
+        self.daemon.close()
+        self.assertIsNone(server.call(['list']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+"""Stencil set related tests."""
+
+import os
+import unittest
+
+from fastfood import stencil as stencil_module
+
+TEST_STENCILS = os.path.join(os.path.dirname(__file__), 'test_templatepack',
+                             'stencils')
+
+
+class TestGetStencil(unittest.TestCase):
+
+    def setUp(self):
+        self.stencil_set = stencil_module.StencilSet(
+            os.path.join(TEST_STENCILS, 'utility'))
+
+    def test_resolved(self):
+        stencil = self.stencil_set.get_stencil('default', name='web')
+        self.assertEqual(stencil['id'], 'utility')
+        self.assertIn('sudo', stencil['dependencies'])
+        self.assertEqual(stencil['files']['recipes/web.rb'],
+                         'recipes/default.rb')
+        self.assertEqual(stencil['options'], {'name': 'web',
+                                              'sudo': 'false'})
+        self.assertNotIn('stencils', stencil)
+        self.assertNotIn('default_stencil', stencil)
+
+    def test_calls_do_not_share_changes(self):
+        first = self.stencil_set.get_stencil('deploy_guard')
+        first['files']['extra.rb'] = 'recipes/default.rb'
+        first['options']['sudo'] = 'true'
+        self.assertRaises(TypeError, first['dependencies'].update, {'a': {}})
+        second = self.stencil_set.get_stencil('deploy_guard')
+        self.assertNotIn('extra.rb', second['files'])
+        self.assertEqual(second['options']['sudo'], 'false')
+        self.assertIn('recipes/_deploy_script.rb', second['files'])
+
+    def test_default_options_copied(self):
+        manifest = {'api': 1, 'default_stencil': 'default', 'stencils': {
+            'default': {'options': {'users': {'default': ['root']}}}}}
+        stencil_set = stencil_module.StencilSet(
+            os.path.join(TEST_STENCILS, 'utility'), manifest=manifest)
+        stencil_set.get_stencil('default')['options']['users'].append('x')
+        self.assertEqual(
+            stencil_set.get_stencil('default')['options']['users'], ['root'])
+        self.assertEqual(
+            manifest['stencils']['default']['options']['users']['default'],
+            ['root'])
+
+    def test_name_needed(self):
+        self.assertRaises(ValueError, self.stencil_set.get_stencil,
+                          'default', name='')
+
+    def test_undeclared(self):
+        self.assertRaises(ValueError, self.stencil_set.get_stencil, 'nope')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+"""Templating related tests."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from fastfood import templating
+
+
+class TestBytecodeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='%s-' % __name__)
+        self.cache_dir = os.path.join(self.tempdir, 'cache')
+        self.template = os.path.join(self.tempdir, 'recipe.rb.jinja2')
+        with open(self.template, 'w') as tpl:
+            tpl.write("# Cookbook Name:: |{ cookbook.name }|")
+
+    def tearDown(self):
+        templating.configure_cache(None)
+        shutil.rmtree(self.tempdir)
+
+    def render(self):
+        return templating.render_templates(
+            self.template, cookbook={'name': 'cached'})
+
+    def test_hits_and_misses(self):
+        templating.configure_cache(self.cache_dir)
+        self.assertEqual(templating.cache_stats(), (0, 0))
+        first = self.render()
+        self.assertEqual(templating.cache_stats(), (0, 1))
+
+        # a new process would start with an empty in-memory cache
+        cache = templating.configure_cache(self.cache_dir)
+        second = self.render()
+        self.assertEqual(first, second)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+        # changing the template content is a miss, not a stale hit
+        with open(self.template, 'a') as tpl:
+            tpl.write("\n# changed")
+        changed = self.render()
+        self.assertIn('# changed', changed[0][1])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_size_bounded_eviction(self):
+        cache = templating.configure_cache(self.cache_dir, max_size=1)
+        self.render()
+        # every entry is bigger than 1 byte, so nothing is kept
+        self.assertEqual(cache._entries(), [])
+
+    def test_disabled(self):
+        templating.configure_cache(None)
+        self.render()
+        self.assertEqual(templating.cache_stats(), (0, 0))
+
+
+class TestStencilSetEnvironment(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='%s-' % __name__)
+        os.makedirs(os.path.join(self.tempdir, 'recipes'))
+        self.header = os.path.join(self.tempdir, '_header.jinja2')
+        with open(self.header, 'w') as tpl:
+            tpl.write("# Cookbook Name:: |{ cookbook.name }|\n")
+        self.recipe = os.path.join(self.tempdir, 'recipes', 'default.rb')
+        with open(self.recipe, 'w') as tpl:
+            tpl.write("{% include '_header.jinja2' %}\n\ninclude_recipe 'apt'")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_shared_per_path(self):
+        env = templating.get_environment(self.tempdir)
+        self.assertIs(env, templating.get_environment(self.tempdir + '/'))
+        self.assertIsNot(env, templating.JINJA_ENV)
+
+    def test_include(self):
+        env = templating.get_environment(self.tempdir)
+        rendered = list(templating.render_files(
+            [self.recipe], {'cookbook': {'name': 'inc'}}, env=env))
+        self.assertEqual(
+            rendered,
+            [(self.recipe, "# Cookbook Name:: inc\ninclude_recipe 'apt'\n")])
+
+    def test_compiled_once(self):
+        env = templating.get_environment(self.tempdir)
+        first = templating.get_template(self.recipe, env=env)
+        self.assertIs(first, templating.get_template(self.recipe, env=env))
+
+    def test_outside_searchpath(self):
+        env = templating.get_environment(os.path.join(self.tempdir,
+                                                      'recipes'))
+        template = templating.get_template(self.header, env=env)
+        self.assertEqual(template.render(cookbook={'name': 'out'}),
+                         "# Cookbook Name:: out")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+"""fastfood --timings related tests."""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    # Python 3
+    from io import StringIO
+
+try:
+    import mock
+except ImportError:
+    # Python 3
+    import unittest.mock as mock
+
+from fastfood import shell
+from fastfood import timings
+
+TEST_TEMPLATEPACK = os.path.join(os.path.dirname(__file__),
+                                 'test_templatepack')
+
+
+class TestTimings(unittest.TestCase):
+
+    def setUp(self):
+        self.timings = timings.Timings()
+        self.timings.enabled = True
+
+    def test_disabled(self):
+        self.timings.enabled = False
+        with self.timings.phase('render'):
+            pass
+        with self.timings.stencil('base/base'):
+            pass
+        self.assertEqual(self.timings.phases, {})
+        self.assertEqual(self.timings.stencils, {})
+
+    def test_phase_calls(self):
+        for _ in range(3):
+            with self.timings.phase('render'):
+                pass
+        self.assertEqual(self.timings.phases['render'][1], 3)
+
+    def test_phase_calls_from_threads(self):
+        def render():
+            for _ in range(500):
+                with self.timings.phase('render'):
+                    pass
+
+        threads = [threading.Thread(target=render) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.timings.phases['render'][1], 4000)
+
+    def test_nested_phases_are_exclusive(self):
+        with mock.patch.object(timings, '_clock',
+                               side_effect=[0.0, 1.0, 3.0, 4.0]):
+            with self.timings.phase('render'):
+                with self.timings.phase('compile'):
+                    pass
+        self.assertEqual(self.timings.phases['compile'], [2.0, 1])
+        self.assertEqual(self.timings.phases['render'], [2.0, 1])
+
+    def test_stencils_include_phases(self):
+        with mock.patch.object(timings, '_clock',
+                               side_effect=[0.0, 1.0, 3.0, 4.0]):
+            with self.timings.stencil('base/base'):
+                with self.timings.phase('compile'):
+                    pass
+        self.assertEqual(self.timings.stencils['base/base'], 4.0)
+
+    def test_iterate(self):
+        items = list(self.timings.iterate('render', 'abc'))
+        self.assertEqual(items, ['a', 'b', 'c'])
+        # the last step finds the iterator exhausted
+        self.assertEqual(self.timings.phases['render'][1], 4)
+
+    def test_table(self):
+        with self.timings.phase('render'):
+            pass
+        with self.timings.stencil('base/base'):
+            pass
+        table = self.timings.table()
+        for name in ('render', '(other)', 'total', 'base/base'):
+            self.assertIn(name, table)
+
+
+class TestShellFlags(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='%s-' % __name__)
+        self.addCleanup(shutil.rmtree, self.tempdir)
+
+    def run_list(self, *flags):
+        argv = list(flags) + ['--no-cache', '--template-pack',
+                              TEST_TEMPLATEPACK, 'list']
+        args = shell._build_parser().parse_args(shell._expand_profile(argv))
+        with mock.patch('sys.stdout', new_callable=StringIO), \
+                mock.patch('sys.stderr', new_callable=StringIO) as stderr:
+            exit_code = shell._run(args)
+        self.assertEqual(exit_code, 0)
+        return stderr.getvalue()
+
+    def test_expand_profile(self):
+        self.assertEqual(shell._expand_profile(['--profile', 'build']),
+                         ['--profile=%s' % shell.PROFILE_PATH, 'build'])
+        self.assertEqual(shell._expand_profile(['--profile=x', 'build']),
+                         ['--profile=x', 'build'])
+
+    def test_timings(self):
+        output = self.run_list('--timings')
+        self.assertIn('Phase', output)
+        self.assertIn('total', output)
+        self.assertFalse(timings.TIMINGS.enabled)
+
+    def test_profile(self):
+        path = os.path.join(self.tempdir, 'list.pstats')
+        output = self.run_list('--profile=%s' % path)
+        self.assertTrue(os.path.isfile(path))
+        self.assertIn('Profile written to %s' % path, output)
+
+
+if __name__ == '__main__':
+    unittest.main()